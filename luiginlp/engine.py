@@ -1,5 +1,6 @@
 import sys
 import os
+import ast
 import luigi
 import sciluigi
 import logging
@@ -7,28 +8,91 @@ import inspect
 import argparse
 import importlib
 import itertools
+import collections
 import shutil
 import subprocess
 import glob
-import socket
 import json
-from luiginlp.util import shellsafe, getlog, replaceextension
+import hashlib
+import functools
+import shlex
+import tempfile
+import time
+import resource
+from luiginlp.modules.manifest import COMPONENTMODULES
+from luiginlp.util import shellsafe, getlog, replaceextension, shutdownservers, ProcessPool, getstatedir, windowed, scandir_glob, chunk, getoutputcache, getmodelregistry, filedigest, executableversion, execute, openredirects, closeredirects, argvsize, argvlimit, getmetricsfile, appendjsonline, readjsonlines, schedulerrunning, PrivateScheduler, exitcode, prefetchexistence, fileexists, clearexistence, DirectoryManifest, setenviron, restoreenviron, getrun
 
 log = getlog()
 
-INPUTFORMATS = []
-COMPONENTS = []
+class Registry:
+    """Registry of the workflow components and input formats, indexed by name. Also indexes the inputs the registered components accept through InputFormat (by extension and format id) and which components accept which other components (InputComponent), for introspection and planning. That index is built when first consulted, by calling the accepts() method of every component with default parameters and no input file, and is rebuilt when components are registered or accept() is called"""
+
+    def __init__(self):
+        self.components = {} #name => component class
+        self.formats = {} #name => input format class
+        self.inputs = None #component class => tuple of AcceptedInput (None if the index has to be (re)built)
+        self.byextension = {} #extension => list of component classes accepting it directly
+        self.byformat = {} #format id => list of component classes accepting it directly
+        self.acceptedby = {} #component class => list of component classes accepting its output
+
+    def addcomponent(self, Class):
+        if self.components.get(Class.__name__) is not Class:
+            self.components[Class.__name__] = Class
+            self.invalidate()
+
+    def addformat(self, Class):
+        self.formats[Class.__name__] = Class
+
+    def invalidate(self):
+        self.inputs = None
+
+    def index(self):
+        if self.inputs is not None:
+            return
+        importcomponents(COMPONENTMODULES) #index all of LuigiNLP's own components, not only those imported so far
+        self.inputs = {}
+        self.byextension = {}
+        self.byformat = {}
+        self.acceptedby = {}
+        for Class in self.components.values():
+            inputs, accepted = probeaccepts(Class)
+            self.inputs[Class] = inputs
+            for acceptedinput in inputs:
+                for extension in acceptedinput.extensions:
+                    self.byextension.setdefault(extension, []).append(Class)
+                self.byformat.setdefault(acceptedinput.format_id, []).append(Class)
+            for AcceptedClass in accepted:
+                self.acceptedby.setdefault(AcceptedClass, []).append(Class)
+
+    def accepting(self, inputfile):
+        """Returns the component classes that accept the specified input file (or extension, if it starts with a period), directly or through the components they accept, the former first"""
+        self.index()
+        parts = os.path.basename(inputfile).split('.')
+        found = []
+        for i in range(1, len(parts)):
+            for Class in self.byextension.get('.'.join(parts[i:]), ()):
+                if Class not in found:
+                    found.append(Class)
+        for Class in found: #breadth-first through the components accepting the ones found (the list grows while iterating)
+            for ParentClass in self.acceptedby.get(Class, ()):
+                if ParentClass not in found:
+                    found.append(ParentClass)
+        return found
+
+AcceptedInput = collections.namedtuple('AcceptedInput', ('format_id', 'extensions', 'inputparameter', 'directory'))
+
+REGISTRY = Registry()
+COMPONENTS = REGISTRY.components
+INPUTFORMATS = REGISTRY.formats
 
 def registerformat(Class):
     assert inspect.isclass(Class) and issubclass(Class,InputFormat)
-    if Class not in INPUTFORMATS:
-        INPUTFORMATS.append(Class)
+    REGISTRY.addformat(Class)
     return Class
 
 def registercomponent(Class):
     assert inspect.isclass(Class) and issubclass(Class,WorkflowComponent)
-    if Class not in COMPONENTS:
-        COMPONENTS.append(Class)
+    REGISTRY.addcomponent(Class)
     return Class
 
 class LuigiNLPException(Exception):
@@ -49,6 +113,122 @@ class AutoSetupError(LuigiNLPException):
 class SchedulingError(LuigiNLPException):
     pass
 
+class ArgumentListTooLong(LuigiNLPException):
+    pass
+
+class ProcessFailure(LuigiNLPException):
+    pass
+
+class ResolutionCache:
+    """Caches how the input of a workflow component is resolved: which alternative from accepts() handles the input. Components with the same class, input extension, startcomponent, inputslot and parameters resolve the same way, so subsequent resolutions try only the alternative that matched before rather than walking the whole accept chain (sub-components consult the cache in turn)."""
+
+    IGNOREPARAMETERS = ('inputfile', 'outputdir', 'replaceinputdir', 'instance_name', 'workflow_task')
+
+    def __init__(self):
+        self.plans = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, component):
+        inputfile = getattr(component, 'inputfile', None)
+        if isinstance(inputfile, str):
+            basename = os.path.basename(inputfile)
+            extension = basename[basename.find('.')+1:] if '.' in basename else ''
+        else:
+            extension = None
+        parameters = tuple(sorted( (key, repr(value)) for key, value in component.param_kwargs.items() if key not in self.IGNOREPARAMETERS and key not in ('startcomponent','inputslot')))
+        return (component.__class__, extension, component.startcomponent, component.inputslot, hash(parameters))
+
+    def get(self, key):
+        plan = self.plans.get(key)
+        if plan is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return plan
+
+    def set(self, key, plan):
+        self.plans[key] = plan
+
+    def invalidate(self, ComponentClass=None, key=None):
+        """Invalidate the cache, entirely or only for the specified component class or key"""
+        if key is not None:
+            self.plans.pop(key, None)
+        elif ComponentClass is not None:
+            for key in list(self.plans):
+                if key[0] is ComponentClass:
+                    del self.plans[key]
+        else:
+            self.plans.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.plans)}
+
+RESOLUTIONCACHE = ResolutionCache()
+
+EXTENSIONMATCHERS = {} #extensions accepted by an InputFormat => matcher, see getextensionmatcher()
+
+def getextensionmatcher(extensions):
+    """Returns a matcher for the specified accepted extensions (compiled once): a dictionary mapping the last part of an extension (after the last period) to the accepted extensions ending in it, with a leading period and longest first. The key None holds the extensions without leading period, in the specified order"""
+    try:
+        return EXTENSIONMATCHERS[extensions]
+    except KeyError:
+        pass
+    stripped = tuple( extension[1:] if extension[0] == '.' else extension for extension in extensions )
+    matcher = {None: stripped}
+    for extension in sorted(stripped, key=len, reverse=True):
+        matcher.setdefault(extension[extension.rfind('.')+1:], []).append('.' + extension)
+    EXTENSIONMATCHERS[extensions] = matcher
+    return matcher
+
+class ClassInfo:
+    """Introspection information for a Task or WorkflowComponent class, computed once per class: its parameters (as (name, Parameter) tuples, in definition order), input slots and output slots (attribute names)"""
+
+    def __init__(self, Class):
+        self.Class = Class
+        parameters = []
+        inputslots = []
+        outputslots = []
+        for key in dir(Class):
+            attr = getattr(Class, key)
+            if isinstance(attr, luigi.Parameter):
+                parameters.append((key, attr))
+            elif key[:3] == 'in_':
+                inputslots.append(key)
+            elif key[:4] == 'out_':
+                outputslots.append(key)
+        parameters.sort(key=lambda x: x[1]._counter) #same order luigi uses
+        self.parameters = tuple(parameters)
+        self.parameternames = frozenset( key for key, _ in parameters )
+        self.passparameters = tuple( key for key, _ in parameters if key not in ('instance_name', 'workflow_task') ) #parameters that may be passed on to other tasks/components
+        self.inputslots = tuple(inputslots)
+        self.outputslots = tuple(outputslots)
+
+CLASSINFO = {}
+
+def getclassinfo(Class):
+    """Returns the ClassInfo for the specified class"""
+    try:
+        return CLASSINFO[Class]
+    except KeyError:
+        CLASSINFO[Class] = classinfo = ClassInfo(Class)
+        return classinfo
+
+class ClassInfoMixin:
+    """Mixin for luigi tasks that serves get_params() from the class' ClassInfo rather than scanning all attributes on every task instantiation"""
+
+    @classmethod
+    def get_params(cls):
+        return list(getclassinfo(cls).parameters)
+
+    @classmethod
+    def inherit_parameters(cls, *ChildClasses):
+        for ChildClass in ChildClasses:
+            for key in getclassinfo(ChildClass).passparameters:
+                if not hasattr(cls,key):
+                    setattr(cls,key, getattr(ChildClass, key))
+        CLASSINFO.clear() #invalidates subclasses too
+
 class InputComponent:
     """A class that encapsulates a WorkflowComponent and is used by other components to list possible dependencies, used in WorkflowComponent.accepts(), holds parameter information to pass to sub-workflows"""
     def __init__(self, parentcomponent, Class, *args,**kwargs):
@@ -57,12 +237,11 @@ class InputComponent:
         self.args = args
         self.kwargs = kwargs
         #automatically transfer parameters
-        for key in dir(self.Class):
-            attr = getattr(self.Class, key)
-            if isinstance(attr,luigi.Parameter) and key not in self.kwargs and hasattr(parentcomponent ,key):
+        for key, _ in getclassinfo(self.Class).parameters:
+            if key not in self.kwargs and hasattr(parentcomponent ,key):
                 self.kwargs[key] = getattr(parentcomponent, key)
 
-class InputTask(sciluigi.ExternalTask):
+class InputTask(ClassInfoMixin, sciluigi.ExternalTask):
     """InputTask, an external task"""
 
     format_id=luigi.Parameter()
@@ -76,31 +255,47 @@ class InputTask(sciluigi.ExternalTask):
 
 
 class InputFormat:
-    """A class that encapsulates an initial task"""
+    """A class that encapsulates an initial task. The input is matched against the accepted extensions on construction, whether the input exists is only checked when the validity is first consulted, so alternatives in accepts() that are never tried cost no filesystem check"""
 
     def __init__(self, workflow, format_id, extension, inputparameter='inputfile', directory=False, force=False):
         assert isinstance(workflow,WorkflowComponent)
         self.inputtask = None
-        self.valid = False
         self.format_id = format_id
         self.directory = directory
+        self.inputparameter = inputparameter
         if isinstance(extension, str):
             extensions = (extension,)
         else:
             extensions = extension
         if not hasattr(workflow,inputparameter):
             raise AttributeError("Workflow " + workflow.__class__.__name__ + " has no attribute " + inputparameter)
-        for extension in extensions:
-            if extension[0] == '.': extension = extension[1:]
-            if getattr(workflow,inputparameter).endswith('.' + extension) or force:
-                self.basename =  getattr(workflow,inputparameter)[:-(len(extension) + 1)]
-                self.extension = extension
-                if not os.path.exists(self.basename + '.' + self.extension):
-                    raise FileNotFoundError("Specified input file for format " + self.format_id + " to " + workflow.__class__.__name__ + " does not exist: " + self.basename + "." + self.extension)
-                self.valid = True
+        matcher = getextensionmatcher(extensions)
+        self.extensions = matcher[None]
+        inputfile = getattr(workflow,inputparameter)
+        self.basename = self.extension = None
+        #one lookup by the last extension of the input, then the accepted extensions ending in it, longest first (so folia.xml takes precedence over xml)
+        for dottedextension in matcher.get(inputfile[inputfile.rfind('.')+1:], ()):
+            if inputfile.endswith(dottedextension):
+                self.basename = inputfile[:-len(dottedextension)]
+                self.extension = dottedextension[1:]
                 break
-        #if not self.valid:
-        #    log.info("InputFormat " + format_id + " (extensions " + ",".join(extensions)+") did not match " + getattr(workflow, inputparameter))
+        else:
+            if force:
+                self.basename = inputfile[:-(len(self.extensions[0]) + 1)]
+                self.extension = self.extensions[0]
+        self.workflowname = workflow.__class__.__name__
+        self.__valid = None
+
+    @property
+    def valid(self):
+        if self.__valid is None:
+            if self.extension is None:
+                self.__valid = False
+            elif not fileexists(self.basename + '.' + self.extension):
+                raise FileNotFoundError("Specified input file for format " + self.format_id + " to " + self.workflowname + " does not exist: " + self.basename + "." + self.extension)
+            else:
+                self.__valid = True
+        return self.__valid
 
     def __str__(self):
         if self.valid:
@@ -116,7 +311,7 @@ class InputFormat:
 
 
 
-class WorkflowComponent(sciluigi.WorkflowTask):
+class WorkflowComponent(ClassInfoMixin, sciluigi.WorkflowTask):
     """A workflow component"""
 
     startcomponent = luigi.Parameter(default="")
@@ -135,11 +330,17 @@ class WorkflowComponent(sciluigi.WorkflowTask):
         if not self._hasloggedstart:
             log.info('>>> Starting component %s', str(self)) # (logging to %s)', clsname, self.get_wflogpath())
             self._hasloggedstart = True
+        try:
+            #luigi calls requires() repeatedly, the workflow only needs to be set up once
+            return self._workflow_output
+        except AttributeError:
+            pass
         workflow_output = self.workflow()
         if workflow_output is None:
             clsname = self.__class__.__name__
             raise Exception(('Nothing returned from workflow() method in the %s Workflow task. '
                              'Forgot to add a return statement at the end?') % clsname)
+        self._workflow_output = workflow_output
         return workflow_output
 
     def run(self):
@@ -158,15 +359,8 @@ class WorkflowComponent(sciluigi.WorkflowTask):
         for ChildClass in ChildClasses:
             if ChildClass not in cls.accepted_components:
                 cls.accepted_components.append(ChildClass)
-
-    @classmethod
-    def inherit_parameters(cls, *ChildClasses):
-        for ChildClass in ChildClasses:
-            for key in dir(ChildClass):
-                if key not in ('instance_name', 'workflow_task'):
-                    attr = getattr(ChildClass, key)
-                    if isinstance(attr,luigi.Parameter) and not hasattr(cls,key):
-                        setattr(cls,key, attr)
+        RESOLUTIONCACHE.invalidate()
+        REGISTRY.invalidate()
 
     def setup(self,workflow, input_feeds):
         if hasattr(self, 'autosetup'):
@@ -180,19 +374,15 @@ class WorkflowComponent(sciluigi.WorkflowTask):
             for TaskClass in configuration:
                 if not inspect.isclass(TaskClass) or not issubclass(TaskClass,Task):
                     raise AutoSetupError("AutoSetup expected a Task class, got " + str(type(TaskClass)))
-                if hasattr(TaskClass, 'in_' + input_type):
+                classinfo = getclassinfo(TaskClass)
+                if 'in_' + input_type in classinfo.inputslots:
                     passparameters = {}
-                    for key in dir(TaskClass):
-                        if key not in ('instance_name', 'workflow_task') and isinstance(getattr(TaskClass,key), luigi.Parameter):
-                            if hasattr(self, key):
-                                passparameters[key] = getattr(self,key)
+                    for key in classinfo.passparameters:
+                        if hasattr(self, key):
+                            passparameters[key] = getattr(self,key)
                     task = workflow.new_task(TaskClass.__name__, TaskClass,**passparameters)
                     setattr(task, 'in_' + input_type, input_slot)
-                    found = False
-                    for key in dir(TaskClass):
-                        if key.startswith('out_'):
-                            found = True
-                    if not found:
+                    if not classinfo.outputslots:
                         raise AutoSetupError("No output slots found on " + TaskClass.__name__)
                     else:
                         return task
@@ -209,7 +399,15 @@ class WorkflowComponent(sciluigi.WorkflowTask):
             inputlog.append("inputfile=" + self.inputfile)
         if not isinstance(accepts, (tuple, list)):
             accepts = (accepts,)
-        for inputtuple in itertools.chain(accepts, self.accepted_components):
+        alternatives = list(itertools.chain(accepts, self.accepted_components))
+        cachekey = RESOLUTIONCACHE.key(self)
+        plan = RESOLUTIONCACHE.get(cachekey)
+        if plan is not None and plan < len(alternatives):
+            #we resolved this kind of input before, only try the alternative that matched then
+            candidates = ((plan, alternatives[plan]),)
+        else:
+            candidates = enumerate(alternatives)
+        for i, inputtuple in candidates:
             input_feeds = {} #reset
             if not isinstance(inputtuple, tuple): inputtuple = (inputtuple,)
             for input in inputtuple: #pylint: disable=redefined-builtin
@@ -251,23 +449,28 @@ class WorkflowComponent(sciluigi.WorkflowTask):
                 for inputtask in inputtasks:
                     if not isinstance(inputtask, Task):
                         raise TypeError("setup() did not return a Task or a sequence of Tasks")
-                    for attrname in dir(inputtask):
-                        if attrname[:4] == 'out_':
-                            format_id = attrname[4:]
-                            if format_id in input_feeds:
-                                if isinstance(input_feeds[format_id], list):
-                                    input_feeds[format_id] += [getattr(inputtask, attrname)]
-                                else:
-                                    input_feeds[format_id] = [input_feeds[format_id], getattr(inputtask, attrname)]
+                    for attrname in getclassinfo(inputtask.__class__).outputslots:
+                        format_id = attrname[4:]
+                        if format_id in input_feeds:
+                            if isinstance(input_feeds[format_id], list):
+                                input_feeds[format_id] += [getattr(inputtask, attrname)]
                             else:
-                                input_feeds[format_id] = getattr(inputtask, attrname)
+                                input_feeds[format_id] = [input_feeds[format_id], getattr(inputtask, attrname)]
+                        else:
+                            input_feeds[format_id] = getattr(inputtask, attrname)
 
                 #print("UPDATED INPUT_FEEDS (c)",len(input_feeds), repr(input_feeds),file=sys.stderr)
 
             if len(input_feeds) > 0:
                 #print("RETURNING INPUT_FEEDS (d)",len(input_feeds), repr(input_feeds),file=sys.stderr)
+                RESOLUTIONCACHE.set(cachekey, i)
                 return input_feeds
 
+        if plan is not None:
+            #cached resolution did not work out (should not happen), retry without the cache
+            RESOLUTIONCACHE.invalidate(key=cachekey)
+            return self.setup_input(workflow)
+
         #input was not handled, raise error
         raise InvalidInput("Unable to find an entry point for supplied input: " + "; ". join(inputlog))
 
@@ -287,17 +490,265 @@ class WorkflowComponent(sciluigi.WorkflowTask):
         if not isinstance(instance_name,str):
             raise TypeError("First parameter to new_task must be an instance_name (str), got " + repr(instance_name))
         if 'autopass' in kwargs and kwargs['autopass']:
-            for key in dir(cls):
-                if key not in ('instance_name', 'workflow_task'):
-                    attr = getattr(cls, key)
-                    if isinstance(attr,luigi.Parameter) and key not in kwargs and hasattr(self,key):
-                        kwargs[key] = getattr(self,key)
+            for key in getclassinfo(cls).passparameters:
+                if key not in kwargs and hasattr(self,key):
+                    kwargs[key] = getattr(self,key)
             del kwargs['autopass']
         return super().new_task(instance_name, cls, **kwargs)
 
-class Task(sciluigi.Task):
+def targetpaths(value):
+    """Returns the paths of the TargetInfo objects in an input or output slot value (which may be a TargetInfo, a callable returning one, or a list or dictionary of those)"""
+    if callable(value):
+        value = value()
+    if isinstance(value, sciluigi.TargetInfo):
+        return [value.path]
+    elif isinstance(value, list):
+        return [ path for item in value for path in targetpaths(item) ]
+    elif isinstance(value, dict):
+        return [ path for _, item in sorted(value.items()) for path in targetpaths(item) ]
+    else:
+        raise TypeError("Slot value is neither callable, TargetInfo, nor list or dict: " + repr(value))
+
+def getenv(kwargs):
+    """Returns the environment for an external process, the current environment extended with the variables in the __env directive (if any), or None for an unchanged environment"""
+    if '__env' in kwargs and kwargs['__env']:
+        env = dict(os.environ)
+        env.update( (key, str(value)) for key, value in kwargs['__env'].items() )
+        return env
+    return None
+
+def wraprun(run):
+    """Wraps the run() method of a Task so metrics are collected and the output cache (if enabled) is consulted first"""
+    if inspect.isgeneratorfunction(run):
+        @functools.wraps(run)
+        def wrapper(self):
+            self.beginmetrics()
+            if not self.restorefromcache(ran=True):
+                yield from run(self)
+            self.endmetrics()
+    else:
+        @functools.wraps(run)
+        def wrapper(self):
+            self.beginmetrics()
+            if not self.restorefromcache(ran=True):
+                result = run(self)
+            else:
+                result = None
+            self.endmetrics()
+            return result
+    return wrapper
+
+def pathsize(path):
+    """Returns the size of a file, or the total size of the files in a directory (not recursively), in bytes. Returns 0 if the path does not exist"""
+    try:
+        if os.path.isdir(path):
+            return sum( entry.stat().st_size for entry in os.scandir(path) if entry.is_file() )
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def summarizemetrics(records):
+    """Aggregates task metrics records (see Task.writemetrics()) per component and task, returns a dictionary (component, task) => dictionary of totals"""
+    summary = {}
+    for record in records:
+        totals = summary.setdefault((record['component'], record['task']), {'tasks': 0, 'failed': 0, 'cached': 0, 'walltime': 0.0, 'user': 0.0, 'sys': 0.0, 'maxrss': 0, 'rchar': 0, 'wchar': 0, 'inputsize': 0, 'outputsize': 0})
+        totals['tasks'] += 1
+        if record['status'] != 'success':
+            totals['failed'] += 1
+        if record.get('cached'):
+            totals['cached'] += 1
+        for key in ('walltime', 'user', 'sys', 'rchar', 'wchar', 'inputsize', 'outputsize'):
+            totals[key] += record.get(key,0)
+        totals['maxrss'] = max(totals['maxrss'], record.get('maxrss',0))
+    return summary
+
+def logmetricssummary(summary):
+    for (component, task), totals in sorted(summary.items(), key=lambda x: -x[1]['walltime']):
+        log.info("LuigiNLP: " + component + "/" + task + ": " + str(totals['tasks']) + " tasks (" + str(totals['failed']) + " failed, " + str(totals['cached']) + " cached), wall " + str(round(totals['walltime'],2)) + "s, user " + str(round(totals['user'],2)) + "s, sys " + str(round(totals['sys'],2)) + "s, peak rss " + str(totals['maxrss']) + "KiB, read " + str(totals['rchar']) + "B, written " + str(totals['wchar']) + "B")
+
+class Task(ClassInfoMixin, sciluigi.Task):
     outputdir = luigi.Parameter(default="")
 
+    batchable = False #set to True if the task implements run_batch()
+    argfile = None #if the executable can read its positional arguments from a file (a response file, one argument per line), the argument that passes such a file, with {} for the filename (e.g. '@{}'); used when the arguments exceed the system limit
+    chunkable = False #set to True if the executable may be invoked repeatedly on consecutive subsets of its positional arguments instead, when they exceed the system limit
+    cacheable = True #set to False if the outputs of the task may not be taken from the output cache (if enabled), e.g. because they are not regular files
+    cachebyname = False #set to True if the output depends on the names of the input files (e.g. when the document ID is derived from it), rather than just their contents; the names are then part of the cache key
+    modelregistry = False #set to True for tasks that train models: their outputs are kept in the model registry (if enabled) rather than the output cache, so training is skipped whenever a model for the same data and parameters exists
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'run' in cls.__dict__:
+            cls.run = wraprun(cls.__dict__['run'])
+
+    def cachekey(self):
+        """Returns the key of this task in the output cache, a digest of the contents of the inputs, the task class, its parameters and the version of its executable. Returns None if the task can not be cached (inputs missing or directories, outputs not single files)"""
+        classinfo = getclassinfo(self.__class__)
+        slots = sorted( attrname for attrname in self.__dict__ if attrname[:3] == 'in_' )
+        if not slots or not classinfo.outputslots:
+            return None
+        h = hashlib.sha256()
+        h.update((self.__class__.__module__ + '.' + self.__class__.__name__ + "\n").encode('utf-8'))
+        for key, value in sorted(self.to_str_params().items()):
+            if key not in ('instance_name', 'workflow_task', 'outputdir', 'replaceinputdir'): #parameters that only affect the location of the output
+                h.update((key + '=' + value + "\n").encode('utf-8'))
+        if getattr(self, 'executable', None):
+            version = executableversion(self.executable)
+            if version is None:
+                return None
+            h.update((version + "\n").encode('utf-8'))
+        for attrname in slots:
+            try:
+                paths = targetpaths(getattr(self, attrname))
+            except (AttributeError, TypeError):
+                return None
+            for path in paths:
+                if not os.path.isfile(path):
+                    return None
+                if self.cachebyname:
+                    h.update((os.path.basename(path) + "\n").encode('utf-8'))
+                h.update((attrname + '=' + filedigest(path) + "\n").encode('utf-8'))
+        return h.hexdigest()
+
+    def getcache(self):
+        """Returns the cache that holds the outputs of this task: the model registry if the task trains models, the output cache otherwise (None if disabled)"""
+        if self.modelregistry:
+            return getmodelregistry()
+        return getoutputcache()
+
+    def cachetargets(self):
+        """Returns a dictionary of output slot => path, or None if the outputs are not all single files"""
+        targets = {}
+        for attrname in getclassinfo(self.__class__).outputslots:
+            paths = targetpaths(getattr(self, attrname))
+            if len(paths) != 1:
+                return None
+            targets[attrname] = paths[0]
+        return targets
+
+    def restorefromcache(self, ran=False):
+        """Materialises the outputs of this task from the output cache, if enabled and available. Returns True if restored"""
+        try:
+            if self.__cachechecked: #already checked (and missed) for this run
+                return False
+        except AttributeError:
+            pass
+        cache = self.getcache()
+        if cache is None or not self.cacheable:
+            return False
+        key = self.cachekey()
+        targets = self.cachetargets() if key else None
+        if key and targets and cache.restore(key, targets):
+            log.info("Restored output of " + self.__class__.__name__ + " from cache (" + key + ")")
+            cache.record('hit', self.__class__.__name__)
+            self.__cachehit = True
+            return True
+        if ran: #the task will actually run, don't check again in this run (e.g. after dynamic dependencies)
+            self.__cachechecked = True
+            self.__cachekey = key
+            if key:
+                cache.record('miss', self.__class__.__name__)
+        return False
+
+    def storeincache(self):
+        """Adds the outputs of this task to the output cache, if enabled and if the task actually ran"""
+        try:
+            key = self.__cachekey
+        except AttributeError: #not run (or restored from cache)
+            return
+        cache = self.getcache()
+        if cache is None or key is None:
+            return
+        targets = self.cachetargets()
+        if targets and all( os.path.isfile(path) for path in targets.values() ):
+            cache.put(key, targets)
+            cache.record('store', self.__class__.__name__)
+
+    def complete(self):
+        if super().complete():
+            return True
+        return self.restorefromcache()
+
+    def beginmetrics(self):
+        try:
+            self.__begintime
+        except AttributeError: #not begun yet (run() may be invoked multiple times with dynamic dependencies)
+            self.__begintime = time.time()
+            self.__beginrusage = resource.getrusage(resource.RUSAGE_SELF)
+            self.__usage = []
+
+    def endmetrics(self):
+        self.__endtime = time.time()
+
+    def recordusage(self, usage):
+        """Records the resource usage of an external process invoked by this task (see luiginlp.util.processusage())"""
+        try:
+            self.__usage.append(usage)
+        except AttributeError:
+            self.__usage = [usage]
+
+    def chain(self):
+        """Returns the names of the task classes leading up to this one in the workflow (following the first input)"""
+        chain = [self.__class__.__name__]
+        task = self
+        while True:
+            dependencies = [ dependency for dependency in luigi.task.flatten(task.requires()) if isinstance(dependency, Task) ]
+            if not dependencies:
+                return chain
+            task = dependencies[0]
+            chain.insert(0, task.__class__.__name__)
+
+    def writemetrics(self, status):
+        """Writes a record with the metrics of this task run to the metrics file (see luiginlp.util.getmetricsfile()): wall time, CPU time of the task itself, and the total CPU time, peak RSS and I/O of the external processes it invoked, as well as the sizes of the inputs and outputs"""
+        metricsfile = getmetricsfile()
+        if metricsfile is None:
+            return
+        try:
+            begintime = self.__begintime
+            beginrusage = self.__beginrusage
+        except AttributeError: #did not run in this process
+            return
+        usage = list(self.__usage)
+        try:
+            usage += [ process.usage() for process in self.__processpool.finished ]
+        except AttributeError:
+            pass
+        rusage = resource.getrusage(resource.RUSAGE_SELF)
+        if isinstance(self.workflow_task, luigi.Task):
+            component = self.workflow_task.__class__.__name__
+        else:
+            component = ''
+        record = {
+            'task': self.__class__.__name__,
+            'task_id': self.task_id,
+            'component': component,
+            'chain': self.chain(),
+            'status': status,
+            'cached': getattr(self, '_Task__cachehit', False),
+            'begintime': begintime,
+            'walltime': getattr(self, '_Task__endtime', time.time()) - begintime,
+            'self_user': rusage.ru_utime - beginrusage.ru_utime,
+            'self_sys': rusage.ru_stime - beginrusage.ru_stime,
+            'processes': len(usage),
+            'user': sum( u.get('user',0) for u in usage ),
+            'sys': sum( u.get('sys',0) for u in usage ),
+            'maxrss': max( [ u.get('maxrss',0) for u in usage ] + [0] ),
+            'rchar': sum( u.get('rchar',0) for u in usage ),
+            'wchar': sum( u.get('wchar',0) for u in usage ),
+            'read_bytes': sum( u.get('read_bytes',0) for u in usage ),
+            'write_bytes': sum( u.get('write_bytes',0) for u in usage ),
+            'inputsize': sum( pathsize(path) for attrname in sorted(self.__dict__) if attrname[:3] == 'in_' for path in targetpaths(getattr(self, attrname)) ),
+            'outputsize': sum( pathsize(path) for attrname in getclassinfo(self.__class__).outputslots for path in targetpaths(getattr(self, attrname)) ),
+        }
+        record['user'] += record['self_user']
+        record['sys'] += record['self_sys']
+        appendjsonline(metricsfile, record)
+
+    @classmethod
+    def run_batch(cls, tasks):
+        """Runs multiple tasks of this class, all with the same parameters, at once; typically in a single invocation of the executable, amortising its start-up cost. Must produce the outputs of all the tasks. Only called on classes that set batchable = True, used by ParallelBatch(batchexec=True)"""
+        raise NotImplementedError("No run_batch() method implemented for Task " + cls.__name__)
+
     def setup_output_dir(self, d):
         #Make output directory
         if os.path.exists(d):
@@ -312,6 +763,15 @@ class Task(sciluigi.Task):
             self.__output_dir = [d]
 
     def on_failure(self, exception):
+        try:
+            self.__processpool.terminate()
+        except AttributeError:
+            pass
+        self.cleanup_async()
+        try:
+            self.writemetrics('failed')
+        except Exception as e: #pylint: disable=broad-except
+            log.warning("Unable to write metrics: " + str(e))
         try:
             if self.__output_dir:
                 for d in self.__output_dir:
@@ -337,22 +797,23 @@ class Task(sciluigi.Task):
         except AttributeError:
             pass
 
-        for attrname in dir(self):
-            if attrname[:4] == 'out_':
-                log.info("Produced output " + getattr(self, attrname)().path)
+        for attrname in getclassinfo(self.__class__).outputslots:
+            log.info("Produced output " + getattr(self, attrname)().path)
+        try:
+            self.storeincache()
+        except Exception as e: #pylint: disable=broad-except
+            log.warning("Unable to store the outputs in the cache: " + str(e)) #the task itself succeeded
+        try:
+            self.writemetrics('success')
+        except Exception as e: #pylint: disable=broad-except
+            log.warning("Unable to write metrics: " + str(e))
         return super().on_success()
 
     def run(self):
         raise NotImplementedError("No run() method implemented for Task " + self.__class__.__name__)
 
-    def getcmd(self, *args, **kwargs):
-        if not hasattr(self,'executable'):
-            raise Exception("No executable defined for Task " + self.__class__.__name__)
-
-        if self.executable[-4:] == '.jar':
-            cmd = 'java -jar ' + self.executable
-        else:
-            cmd = self.executable
+    def getopts(self, **kwargs):
+        """Converts keyword arguments to a list of (option, delimiter, value) tuples, value is None for flags"""
         opts = []
         for key, value in kwargs.items():
             if value is None or value is False:
@@ -375,6 +836,77 @@ class Task(sciluigi.Task):
                     delimiter = '='
 
             if value is True:
+                opts.append((key, delimiter, None))
+            else:
+                opts.append((key, delimiter, value))
+        return opts
+
+    def getargs(self, *args, **kwargs):
+        """Like getcmd(), but returns a list of arguments (excluding the executable) rather than a shell command, no quoting is applied"""
+        opts = []
+        for key, delimiter, value in self.getopts(**kwargs):
+            if value is None:
+                opts.append(key)
+            elif delimiter == ' ':
+                opts += [key, str(value)]
+            else:
+                opts.append(key + delimiter + str(value))
+        if '__options_last' in kwargs and kwargs['__options_last']:
+            return [ str(arg) for arg in args ] + opts
+        else:
+            return opts + [ str(arg) for arg in args ]
+
+    def getargv(self, *args, **kwargs):
+        """Returns the command as an argument vector (including the executable), for execution without a shell. The redirection directives (__stdin_from etc) are not included"""
+        executable = kwargs.get('__executable', getattr(self, 'executable', None)) #__executable invokes another executable than the task's own
+        if not executable:
+            raise Exception("No executable defined for Task " + self.__class__.__name__)
+        if executable[-4:] == '.jar':
+            argv = ['java', '-jar', executable]
+        else:
+            argv = [executable]
+        return argv + self.getargs(*args, **kwargs)
+
+    def getargvs(self, argfiles, *args, **kwargs):
+        """Returns a list of argument vectors to execute. This is just one, unless the positional arguments exceed the system limit, in which case they are passed through a response file (if the task has an argfile) or split over multiple invocations (if the task is chunkable). Response files are added to argfiles, the caller should remove them after execution"""
+        argv = self.getargv(*args, **kwargs)
+        limit = argvlimit()
+        if argvsize(argv) <= limit:
+            return [argv]
+        if self.argfile:
+            fd, argfile = tempfile.mkstemp(prefix='luiginlp-args-')
+            argfiles.append(argfile)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                for arg in args:
+                    f.write(str(arg) + "\n")
+            return [self.getargv(self.argfile.format(argfile), **kwargs)]
+        if self.chunkable:
+            argvs = []
+            base = argvsize(self.getargv(**kwargs))
+            begin = size = 0
+            for i, arg in enumerate(args):
+                argsize = argvsize([str(arg)])
+                if i > begin and base + size + argsize > limit:
+                    argvs.append(self.getargv(*args[begin:i], **kwargs))
+                    begin = i
+                    size = 0
+                size += argsize
+            argvs.append(self.getargv(*args[begin:], **kwargs))
+            return argvs
+        raise ArgumentListTooLong("Arguments for " + kwargs.get("__executable", self.executable) + " exceed the system limit (" + str(argvsize(argv)) + " > " + str(limit) + " bytes) and Task " + self.__class__.__name__ + " supports neither an argfile nor chunking")
+
+    def getcmd(self, *args, **kwargs):
+        executable = kwargs.get('__executable', getattr(self, 'executable', None)) #__executable invokes another executable than the task's own
+        if not executable:
+            raise Exception("No executable defined for Task " + self.__class__.__name__)
+
+        if executable[-4:] == '.jar':
+            cmd = 'java -jar ' + executable
+        else:
+            cmd = executable
+        opts = []
+        for key, delimiter, value in self.getopts(**kwargs):
+            if value is None:
                 opts.append(key)
             elif isinstance(value,str):
                 opts.append(key + delimiter + shellsafe(value))
@@ -403,37 +935,86 @@ class Task(sciluigi.Task):
 
 
     def ex(self, *args, **kwargs):
-        cmd = self.getcmd(*args,**kwargs)
-        if '__ignorefailure' in kwargs and kwargs['__ignorefailure']:
-            try:
+        if '__shell' in kwargs and kwargs['__shell']:
+            #execute through the shell
+            cmd = self.getcmd(*args,**kwargs)
+            if '__ignorefailure' in kwargs and kwargs['__ignorefailure']:
+                try:
+                    super(Task, self).ex(cmd)
+                except:
+                    log.warn("Ignoring failure on request!")
+                    pass
+            else:
                 super(Task, self).ex(cmd)
-            except:
-                log.warn("Ignoring failure on request!")
-                pass
-        else:
-            super(Task, self).ex(cmd)
+            return
 
+        argfiles = []
+        redirects = openredirects(kwargs.get('__stdin_from'), kwargs.get('__stdout_to'), kwargs.get('__stderr_to'))
+        try:
+            for argv in self.getargvs(argfiles, *args, **kwargs):
+                log.info("Executing command: " + shlex.join(argv))
+                returncode, stdout, stderr, usage = execute(argv, env=getenv(kwargs), **redirects)
+                self.recordusage(usage)
+                if stderr:
+                    log.debug("Stderr from command: " + stderr)
+                if returncode != 0:
+                    if '__ignorefailure' in kwargs and kwargs['__ignorefailure']:
+                        log.warn("Ignoring failure on request!")
+                    else:
+                        raise ProcessFailure("Command failed (returncode " + str(returncode) + "): " + shlex.join(argv) + "\nCommand output: " + stdout + "\nCommand stderr: " + stderr)
+        finally:
+            closeredirects(redirects)
+            for argfile in argfiles:
+                os.unlink(argfile)
 
-    def ex_async(self, *args, **kwargs):
-        cmd = self.getcmd(*args,**kwargs)
-        process = subprocess.Popen(cmd, shell=True)
-        if process:
-            log.info("Executing asynchronous command: " + cmd)
-            return process.pid
-        else:
-            raise Exception("Unable to launch process: " + cmd)
 
+    def getprocesspool(self, threads=None, slots=None):
+        """Returns the pool of processes launched asynchronously by this task. The maximum number of concurrent processes is set by the threads argument on first invocation, it defaults to the task's threads parameter if it has one, and 1 otherwise. Slots (luiginlp.util.Slots) additionally bound the number of processes machine-wide"""
+        try:
+            return self.__processpool
+        except AttributeError:
+            if threads is None:
+                threads = getattr(self, 'threads', 1)
+            self.__processpool = ProcessPool(threads, slots)
+            return self.__processpool
 
+    def ex_async(self, *args, **kwargs):
+        """Like ex(), but executes the command asynchronously in the task's process pool (blocks whilst the pool is full). Returns the pid (of the last process, if the arguments had to be split over multiple invocations). Call wait_async() to wait for all processes to complete."""
+        try:
+            argfiles = self.__argfiles
+        except AttributeError:
+            argfiles = self.__argfiles = []
+        redirects = openredirects(kwargs.get('__stdin_from'), kwargs.get('__stdout_to'), kwargs.get('__stderr_to'))
+        try:
+            for argv in self.getargvs(argfiles, *args, **kwargs):
+                log.info("Executing asynchronous command: " + shlex.join(argv))
+                process = self.getprocesspool().submit(argv, owner=self, ignorefailure='__ignorefailure' in kwargs and kwargs['__ignorefailure'], env=getenv(kwargs), **redirects)
+        finally:
+            closeredirects(redirects) #the processes have their own copies
+        return process.pid
+
+    def cleanup_async(self):
+        try:
+            for argfile in self.__argfiles:
+                if os.path.exists(argfile):
+                    os.unlink(argfile)
+            self.__argfiles = []
+        except AttributeError:
+            pass
 
+    def wait_async(self):
+        """Waits for all processes launched with ex_async() to finish, raises a ProcessFailure if any of them failed"""
+        pool = self.getprocesspool()
+        pool.wait()
+        self.cleanup_async()
+        failures = pool.failures()
+        if failures:
+            raise ProcessFailure(str(len(failures)) + " of " + str(len(pool.finished)) + " asynchronous processes of " + self.__class__.__name__ + " failed: " + "; ".join( str(process) for process in failures))
 
-    @classmethod
-    def inherit_parameters(Class, *ChildClasses):
-        for ChildClass in ChildClasses:
-            for key in dir(ChildClass):
-                if key not in ('instance_name', 'workflow_task'):
-                    attr = getattr(ChildClass, key)
-                    if isinstance(attr,luigi.Parameter) and not hasattr(Class, key):
-                        setattr(Class,key, attr)
+
+    def getmanifest(self, directory):
+        """Returns the manifest of an input directory, for tasks that process the files in it incrementally (see luiginlp.util.DirectoryManifest). The manifest is kept per task class and output"""
+        return DirectoryManifest(directory, self.__class__.__name__ + " " + " ".join( target.path for target in luigi.task.flatten(self.output()) if hasattr(target, 'path') ))
 
     def outputfrominput(self, inputformat, stripextension, addextension, replaceinputdirparam='replaceinputdir', outputdirparam='outputdir'):
         """Derives the output filename from the input filename, removing the input extension and adding the output extension. Supports outputdir parameter."""
@@ -475,11 +1056,84 @@ class TargetInfo(sciluigi.TargetInfo):
 
 
 def getcomponentclass(classname):
-    for Class in COMPONENTS:
-        if Class.__name__ == classname:
-            return Class
+    """Returns the class of the workflow component with the specified name. Components of LuigiNLP's own modules are found even if their module was not imported yet, it is imported on demand"""
+    try:
+        return COMPONENTS[classname]
+    except KeyError:
+        pass
+    if classname in COMPONENTMODULES and importcomponents([classname]):
+        return getcomponentclass(classname)
     raise Exception("No such component: " + classname)
 
+def importcomponents(names):
+    """Imports the modules defining the specified workflow components, as far as they are components of LuigiNLP's own modules (names of other components are ignored). Returns True if any module was imported"""
+    imported = False
+    for name in names:
+        if name in COMPONENTMODULES and COMPONENTMODULES[name] not in sys.modules:
+            importlib.import_module(COMPONENTMODULES[name])
+            imported = True
+    return imported
+
+def bareinstance(Class):
+    """Returns an instance of a workflow component class with default parameters (empty strings for parameters without a default), for introspection only: it is not initialised as a luigi task"""
+    component = Class.__new__(Class)
+    for key, parameter in getclassinfo(Class).parameters:
+        setattr(component, key, parameter._default if parameter._default is not luigi.parameter._no_value else "") #pylint: disable=protected-access
+    return component
+
+def probeaccepts(Class):
+    """Returns what a workflow component accepts with default parameters: a tuple of AcceptedInput for the inputs it accepts directly, and a tuple of the component classes it accepts. accepts() is called on a bare instance without input files"""
+    try:
+        accepts = bareinstance(Class).accepts()
+    except Exception as e: #pylint: disable=broad-except
+        log.debug("Unable to determine the inputs accepted by " + Class.__name__ + ": " + str(e))
+        return (), ()
+    if not isinstance(accepts, (tuple, list)):
+        accepts = (accepts,)
+    inputs = []
+    accepted = []
+    for alternative in itertools.chain(accepts, Class.accepted_components):
+        if not isinstance(alternative, tuple): alternative = (alternative,)
+        for input in alternative: #pylint: disable=redefined-builtin
+            if isinstance(input, InputFormat):
+                inputs.append(AcceptedInput(input.format_id, input.extensions, input.inputparameter, input.directory))
+            elif isinstance(input, InputComponent):
+                accepted.append(input.Class)
+            elif inspect.isclass(input) and issubclass(input, WorkflowComponent):
+                accepted.append(input)
+    return tuple(inputs), tuple(accepted)
+
+def acceptedinputs(ComponentClass):
+    """Returns the inputs a workflow component accepts directly (with default parameters), as a tuple of AcceptedInput (format_id, extensions, inputparameter, directory)"""
+    if isinstance(ComponentClass, str): ComponentClass = getcomponentclass(ComponentClass)
+    REGISTRY.index()
+    if ComponentClass not in REGISTRY.inputs:
+        return probeaccepts(ComponentClass)[0]
+    return REGISTRY.inputs[ComponentClass]
+
+def componentsaccepting(inputfile):
+    """Returns the registered workflow components that accept the specified input file, directly or through the components they accept (e.g. Frog accepts a .rst file through ConvertToFoLiA). Pass an extension with a leading period (e.g. ``.folia.xml``) to query by extension. Only the extension is considered, not the presence of the file"""
+    return REGISTRY.accepting(inputfile)
+
+def componentsforformat(format_id):
+    """Returns the registered workflow components that directly accept input of the specified format id"""
+    REGISTRY.index()
+    return list(REGISTRY.byformat.get(format_id, ()))
+
+def outputformats(ComponentClass):
+    """Returns the output formats (format ids of the output slots) of the tasks a workflow component sets up through autosetup(), or None if the component uses setup() and its outputs can only be determined by setting up a workflow"""
+    if isinstance(ComponentClass, str): ComponentClass = getcomponentclass(ComponentClass)
+    if not hasattr(ComponentClass, 'autosetup'):
+        return None
+    configuration = bareinstance(ComponentClass).autosetup()
+    if not isinstance(configuration, (list, tuple)): configuration = (configuration,)
+    formats = []
+    for TaskClass in configuration:
+        for attrname in getclassinfo(TaskClass).outputslots:
+            if attrname[4:] not in formats:
+                formats.append(attrname[4:])
+    return tuple(formats)
+
 class PassParameters(dict):
     def __init__(self, *args, **kwargs):
         super().__init__()
@@ -491,35 +1145,122 @@ class PassParameters(dict):
     def __hash__(self):
         return hash(tuple(sorted(self.items())))
 
+def gettasks(component):
+    """Returns all tasks in the workflow of a component (including the component itself), upstream tasks first"""
+    tasks = []
+    seen = set()
+    def visit(task):
+        if task.task_id not in seen:
+            seen.add(task.task_id)
+            for dependency in luigi.task.flatten(task.requires()):
+                visit(dependency)
+            tasks.append(task)
+    visit(component)
+    return tasks
+
+def componentoutputs(component):
+    """Returns the paths of the outputs of all tasks in the workflow of a component (intermediate ones included, the input files not), e.g. to record what to remove when its input goes away (see luiginlp.util.DirectoryManifest)"""
+    return [ target.path for task in gettasks(component) if isinstance(task, Task) for target in luigi.task.flatten(task.output()) if hasattr(target, 'path') ]
+
+def runbatched(components, batchsize=0):
+    """Runs the batchable tasks (see Task.run_batch()) in the workflows of the specified components in batches: all batchable tasks of the same class with the same parameters whose inputs are ready are invoked together, in batches of at most batchsize tasks (0 = unlimited). This is repeated as long as new batchable tasks become ready by it. Each task's own outputs are produced as usual, so luigi considers the tasks complete afterwards; the on_success()/on_failure() hooks are invoked for every task in a batch, as luigi would. Tasks that are not batchable are left for luigi to schedule, and so are the batchable tasks that depend on them: these run one by one."""
+    pending = {}
+    for component in components:
+        for task in gettasks(component):
+            if isinstance(task, Task) and task.batchable and task.task_id not in pending:
+                pending[task.task_id] = task
+    while pending:
+        groups = {}
+        for task_id, task in list(pending.items()):
+            if task.complete():
+                del pending[task_id]
+            elif all( dependency.complete() for dependency in luigi.task.flatten(task.requires()) ):
+                parameters = tuple(sorted( (key, value) for key, value in task.to_str_params().items() if key not in ('instance_name','workflow_task') ))
+                groups.setdefault((task.__class__, parameters), []).append(task)
+                del pending[task_id]
+        if not groups:
+            break #nothing (more) is ready to run, leave the rest to luigi
+        for (TaskClass, _), tasks in groups.items():
+            for batch in chunk(tasks, batchsize if batchsize > 0 else len(tasks)):
+                log.info("Running batch of " + str(len(batch)) + " " + TaskClass.__name__ + " tasks")
+                try:
+                    TaskClass.run_batch(batch)
+                except Exception as e:
+                    for task in batch:
+                        task.on_failure(e)
+                    raise
+                for task in batch:
+                    if task.complete(): #tasks whose outputs the batch did not produce are left for luigi
+                        task.on_success()
+
 class ParallelBatch(luigi.Task):
     """Meta workflow"""
     inputfiles = luigi.Parameter()
     component = luigi.Parameter()
     passparameters = luigi.Parameter(default=PassParameters())
+    batchexec = luigi.BoolParameter(default=False) #group the execution of batchable tasks (see Task.run_batch()) rather than just their scheduling
+    batchsize = luigi.IntParameter(default=0) #maximum number of tasks per batched invocation (0 = unlimited)
+    window = luigi.IntParameter(default=1000) #number of components scheduled at once, finished items are recorded after each window so an interrupted batch resumes with the remaining ones (0 = all at once)
 
-    def requires(self):
+    def getinputfiles(self):
+        if isinstance(self.inputfiles, str):
+            return self.inputfiles.split(',')
+        return list(self.inputfiles)
+
+    def getpassparameters(self):
         if isinstance(self.passparameters, str):
-            self.passparameters = PassParameters(json.loads(self.passparameters.replace("'",'"')))
+            try:
+                return PassParameters(json.loads(self.passparameters.replace("'",'"')))
+            except ValueError: #str() of a dictionary with non-string values, as luigi serialises it for dynamic dependencies
+                return PassParameters(ast.literal_eval(self.passparameters))
         elif isinstance(self.passparameters, dict):
-            self.passparameters = PassParameters(self.passparameters)
-        elif not isinstance(self.passparameters, PassParameters):
-            raise TypeError("Keywork argument passparameters must be instance of PassParameters, got " + repr(self.passparameters))
-        tasks = []
+            return PassParameters(self.passparameters)
+        raise TypeError("Keywork argument passparameters must be instance of PassParameters, got " + repr(self.passparameters))
+
+    def batchid(self):
+        """Stable identifier of this batch, a digest of the component, the input files and the passed parameters"""
+        batch = {'component': self.component, 'inputfiles': sorted(self.getinputfiles()), 'passparameters': self.getpassparameters()}
+        return hashlib.sha1(json.dumps(batch, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def progressfile(self):
+        return os.path.join(getstatedir(), 'progress', 'parallelbatch-' + self.batchid())
+
+    def components(self, inputfiles):
         ComponentClass = getcomponentclass(self.component)
-        if isinstance(self.inputfiles, str):
-            self.inputfiles = self.inputfiles.split(',')
-        for inputfile in self.inputfiles:
-            tasks.append(  ComponentClass(inputfile=inputfile,**self.passparameters))
-        return tasks
+        passparameters = self.getpassparameters()
+        prefetchexistence(inputfiles)
+        return [ ComponentClass(inputfile=inputfile,**passparameters) for inputfile in inputfiles ]
+
+    def distribute(self, index, processes):
+        """Returns the share of the components for another worker process (see runprocesses()), they are run there as soon as possible whilst this task schedules them in windows"""
+        return self.components(self.getinputfiles()[index-1::processes-1])
 
     def run(self):
-        if isinstance(self.inputfiles, str):
-            self.inputfiles = self.inputfiles.split(',')
+        inputfiles = self.getinputfiles()
+        progressfile = self.progressfile()
+        if os.path.exists(progressfile):
+            with open(progressfile,'r',encoding='utf-8') as f:
+                done = set(f.read().split('\n'))
+        else:
+            os.makedirs(os.path.dirname(progressfile), exist_ok=True)
+            done = set()
+        remaining = [ inputfile for inputfile in inputfiles if inputfile not in done ]
+        if len(remaining) < len(inputfiles):
+            log.info("Resuming batch, " + str(len(inputfiles) - len(remaining)) + " of " + str(len(inputfiles)) + " items already done")
+        for inputfiles_window in windowed(remaining, self.window if self.window > 0 else max(len(remaining),1)):
+            components = self.components(inputfiles_window)
+            if self.batchexec:
+                runbatched(components, self.batchsize)
+            yield components #whatever could not be batched is scheduled as usual
+            with open(progressfile,'a',encoding='utf-8') as f:
+                f.write("\n".join(inputfiles_window) + "\n")
         with self.output().open('w') as f:
-            f.write("\n".join(self.inputfiles))
+            f.write("\n".join(inputfiles))
+        if os.path.exists(progressfile):
+            os.unlink(progressfile)
 
     def output(self):
-        return luigi.LocalTarget('.parallelbatch-' + self.component + '-' + str(hash(self)) + '.done')
+        return luigi.LocalTarget(os.path.join(getstatedir(), 'parallelbatch-' + self.component + '-' + self.batchid() + '.done'))
 
 class Parallel(sciluigi.WorkflowTask):
     """Meta workflow"""
@@ -538,31 +1279,162 @@ class Parallel(sciluigi.WorkflowTask):
         ComponentClass = getcomponentclass(self.component)
         if isinstance(self.inputfiles, str):
             self.inputfiles = self.inputfiles.split(',')
+        prefetchexistence(self.inputfiles)
         for inputfile in self.inputfiles:
             tasks.append( self.new_task(self.component, ComponentClass, inputfile=inputfile,**self.passparameters) )
         return tasks
 
+def stream(items, maketask, window, progressid):
+    """Generator for use with ``yield from`` in a task's run() method: yields dynamic dependencies in windows of the specified size rather than all at once.
+
+    The items (e.g. input files, any iterable) are turned into tasks or components by maketask(), one window at a time, so memory use remains bounded by the window size regardless of the number of items. As luigi suspends run() until all tasks of a window are complete, the window size also caps the number of tasks in flight. Luigi reruns run() from the start after each suspension; windows that were already completed are recorded in the state directory (under the given progressid) and skipped without creating their tasks again.
+
+    A window of 0 yields all tasks at once."""
+    if not window:
+        tasks = [ maketask(item) for item in items ]
+        if tasks:
+            yield tasks
+        return
+    progressfile = os.path.join(getstatedir(), 'progress', hashlib.sha1(progressid.encode('utf-8')).hexdigest())
+    if os.path.exists(progressfile):
+        with open(progressfile,'r',encoding='utf-8') as f:
+            done = f.read().split('\n')[:-1] #first item of each completed window
+    else:
+        os.makedirs(os.path.dirname(progressfile), exist_ok=True)
+        done = []
+    for i, items_window in enumerate(windowed(items, window)):
+        if i < len(done):
+            if done[i] == str(items_window[0]):
+                continue
+            done = done[:i] #items changed since, no longer trust the rest of the recorded progress
+        yield [ maketask(item) for item in items_window ]
+        with open(progressfile,'a',encoding='utf-8') as f:
+            f.write(str(items_window[0]) + "\n")
+        done.append(str(items_window[0]))
+    if os.path.exists(progressfile):
+        os.unlink(progressfile)
+
 class ParallelFromDir(sciluigi.WorkflowTask):
     """Meta Workflow"""
     directory = luigi.Parameter()
     pattern = luigi.Parameter(default="*")
     component = luigi.Parameter()
     passparameters = luigi.Parameter(default=PassParameters())
+    incremental = luigi.BoolParameter(default=False) #only schedule the files that were added or changed since the last successful run, remove the outputs of files that were changed or removed (see luiginlp.util.DirectoryManifest)
 
-    def workflow(self):
+    def getpassparameters(self):
         if isinstance(self.passparameters, str):
             self.passparameters = PassParameters(json.loads(self.passparameters.replace("'",'"')))
         elif isinstance(self.passparameters, dict):
             self.passparameters = PassParameters(self.passparameters)
         elif not isinstance(self.passparameters, PassParameters):
             raise TypeError("Keywork argument passparameters must be instance of PassParameters, got " + repr(self.passparameters))
+        return self.passparameters
+
+    def getmanifest(self):
+        """Returns the manifest of the directory for incremental processing (see luiginlp.util.DirectoryManifest), shared by all runs of the component with the same parameters on it"""
+        return DirectoryManifest(self.directory, self.component + " " + self.pattern + " " + json.dumps(self.getpassparameters(), sort_keys=True))
+
+    def workflow(self):
+        if self.incremental:
+            return [] #the components are only known once the outputs of changed files are removed, they are scheduled from run()
+        passparameters = self.getpassparameters()
         tasks = []
         ComponentClass = getcomponentclass(self.component)
-        for inputfile in glob.glob(os.path.join(self.directory, self.pattern)):
-            tasks.append( self.new_task(self.component, ComponentClass, inputfile=inputfile,**self.passparameters) )
+        inputfiles = list(scandir_glob(self.directory, self.pattern))
+        prefetchexistence(inputfiles, listed=True)
+        for inputfile in inputfiles:
+            tasks.append( self.new_task(self.component, ComponentClass, inputfile=inputfile,**passparameters) )
         return tasks
 
+    def run(self):
+        if self.incremental:
+            passparameters = self.getpassparameters()
+            ComponentClass = getcomponentclass(self.component)
+            manifest = self.getmanifest()
+            delta = manifest.delta(scandir_glob(self.directory, self.pattern))
+            manifest.invalidate(delta)
+            log.info("Incremental run on " + self.directory + ": " + str(len(delta.changed)) + " new or changed file(s), " + str(len(delta.removed)) + " removed, " + str(len(delta.entries) - len(delta.changed)) + " unchanged")
+            if delta.changed:
+                #luigi reruns run() from the start once these are complete, with a delta that includes anything added in the meantime
+                yield [ ComponentClass(inputfile=inputfile, **passparameters) for inputfile in delta.changed ]
+            manifest.commit(delta, lambda inputfile: componentoutputs(ComponentClass(inputfile=inputfile, **passparameters)))
+        super().run()
+
+class ParallelStreamFromDir(luigi.Task):
+    """Meta task: like ParallelFromDir, but streams the files from the directory and schedules components in windows, so memory use remains flat regardless of the size of the directory (see stream())"""
+    directory = luigi.Parameter()
+    pattern = luigi.Parameter(default="*")
+    component = luigi.Parameter()
+    passparameters = luigi.Parameter(default=PassParameters())
+    window = luigi.IntParameter(default=1000)
+    incremental = luigi.BoolParameter(default=False) #only schedule the files that were added or changed since the last successful run, remove the outputs of files that were changed or removed (see luiginlp.util.DirectoryManifest)
+
+    getpassparameters = ParallelFromDir.getpassparameters
+    getmanifest = ParallelFromDir.getmanifest
+
+    def run(self):
+        passparameters = self.getpassparameters()
+        ComponentClass = getcomponentclass(self.component)
+        maketask = lambda inputfile: ComponentClass(inputfile=inputfile, **passparameters)
+        if self.incremental:
+            manifest = self.getmanifest()
+            delta = manifest.delta(scandir_glob(self.directory, self.pattern))
+            manifest.invalidate(delta)
+            yield from stream(delta.changed, maketask, self.window, self.task_id)
+            manifest.commit(delta, lambda inputfile: componentoutputs(maketask(inputfile)))
+        else:
+            yield from stream(scandir_glob(self.directory, self.pattern), maketask, self.window, self.task_id)
+        with self.output().open('w') as f:
+            f.write(self.directory + "\n")
+
+    def complete(self):
+        #in incremental mode, the task is only complete as long as the directory does not change
+        return super().complete() and (not self.incremental or self.getmanifest().unchanged(scandir_glob(self.directory, self.pattern)))
+
+    def output(self):
+        return luigi.LocalTarget(os.path.join(getstatedir(), 'parallelstreamfromdir-' + self.component + '-' + hashlib.sha1(self.task_id.encode('utf-8')).hexdigest() + '.done'))
+
 def run(*args, **kwargs):
+    environ = {} #environment variables set for this run only => their previous values
+    if 'statedir' in kwargs:
+        setenviron(environ, 'LUIGINLP_STATEDIR', kwargs['statedir'])
+        del kwargs['statedir']
+    if 'cachedir' in kwargs:
+        setenviron(environ, 'LUIGINLP_CACHEDIR', kwargs['cachedir'])
+        del kwargs['cachedir']
+    if 'cachesize' in kwargs:
+        setenviron(environ, 'LUIGINLP_CACHESIZE', str(kwargs['cachesize']))
+        del kwargs['cachesize']
+    if 'metrics' in kwargs:
+        setenviron(environ, 'LUIGINLP_METRICS', kwargs['metrics'])
+        del kwargs['metrics']
+    if 'modeldir' in kwargs:
+        setenviron(environ, 'LUIGINLP_MODELDIR', kwargs['modeldir'])
+        del kwargs['modeldir']
+    if 'modelsize' in kwargs:
+        setenviron(environ, 'LUIGINLP_MODELSIZE', str(kwargs['modelsize']))
+        del kwargs['modelsize']
+    if 'scheduler_timeout' in kwargs:
+        setenviron(environ, 'LUIGINLP_SCHEDULER_TIMEOUT', str(kwargs['scheduler_timeout']))
+        del kwargs['scheduler_timeout']
+    if 'processes' in kwargs:
+        processes = int(kwargs['processes'])
+        del kwargs['processes']
+    else:
+        processes = int(os.environ.get('LUIGINLP_PROCESSES', 1))
+    setenviron(environ, 'LUIGINLP_WORKERS', str(int(kwargs.get('workers', 1)) * processes)) #for tasks that size their work by it, see getworkers()
+    setenviron(environ, 'LUIGINLP_RUN', str(os.getpid()) + '-' + str(time.time())) #identifies the run in the processes luigi forks, see luiginlp.util.getrun()
+    clearexistence() #files may have been removed since a previous run in this process
+    cache = getoutputcache()
+    if cache is not None:
+        cacheoffset = cache.eventoffset()
+    metricsfile = getmetricsfile()
+    if metricsfile is not None and os.path.exists(metricsfile):
+        metricsoffset = os.path.getsize(metricsfile)
+    else:
+        metricsoffset = 0
+
     luigi_logger = logging.getLogger('luigi-interface')
     logfile = luigi_logger.handlers[0].baseFilename
     if len(luigi_logger.handlers) == 2:
@@ -581,20 +1453,45 @@ def run(*args, **kwargs):
     else:
         port = 8082
 
-    #test whether luigid is running, fall back to local scheduler otherwise
-    if 'local_scheduler' not in kwargs:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            sock.connect((host,port))
-            log.info("Using scheduler at " + host + ":" + str(port))
-        except:
-            kwargs['local_scheduler'] = True
-            log.info("Using local scheduler")
-
-    if not args:
-        success = luigi.run(**kwargs)
+    #test whether luigid is running, fall back to local scheduler otherwise (or start a scheduler of our own if multiple processes have to share it)
+    privatescheduler = None
+    if kwargs.get('local_scheduler'):
+        if processes > 1:
+            log.warning("LuigiNLP: Multiple processes require a central scheduler, running in a single process with the local scheduler")
+            processes = 1
+    elif schedulerrunning(host, port):
+        log.info("Using scheduler at " + host + ":" + str(port))
+    elif processes > 1:
+        privatescheduler = PrivateScheduler()
+        kwargs['scheduler_host'] = privatescheduler.host
+        kwargs['scheduler_port'] = privatescheduler.port
+        log.info("Using scheduler at " + privatescheduler.host + ":" + str(privatescheduler.port) + " (started for this run)")
     else:
-        success = luigi.build(args,**kwargs)
+        kwargs['local_scheduler'] = True
+        log.info("Using local scheduler")
+
+    try:
+        if processes > 1:
+            success = runprocesses(processes, args, kwargs)
+        elif not args:
+            success = luigi.run(**kwargs)
+        else:
+            success = luigi.build(args,**kwargs)
+    finally:
+        if privatescheduler is not None:
+            privatescheduler.stop()
+        shutdownservers(run=getrun()) #stop the persistent servers (e.g. Frog) that tasks of this run started or used, unless another run is using them
+        clearexistence()
+        if cache is not None:
+            cache.evict()
+            stats = cache.stats(cacheoffset)
+            log.info("LuigiNLP: Output cache: " + str(stats['hit']) + " hits, " + str(stats['miss']) + " misses, " + str(stats['store']) + " stored")
+        modelregistry = getmodelregistry()
+        if modelregistry is not None:
+            modelregistry.evict()
+        if metricsfile is not None:
+            logmetricssummary(summarizemetrics(readjsonlines(metricsfile, metricsoffset)))
+        restoreenviron(environ)
 
     if not success:
         log.error("LuigiNLP: There were errors in scheduling the workflow, inspect the log at %s for more details", logfile)
@@ -602,6 +1499,46 @@ def run(*args, **kwargs):
         log.info("LuigiNLP: Workflow run completed succesfully (logged to %s)", logfile)
     return success
 
+def runprocesses(processes, args, kwargs):
+    """Runs the workflow in multiple worker processes on this host that share the central scheduler, which hands out every task to only one of them. The other processes are forked, returns True if all processes succeeded"""
+    log.info("LuigiNLP: Running the workflow in " + str(processes) + " processes")
+    #workers have to wait for tasks that other processes are running rather than stop when they have nothing to run themselves (for this run only, the setting is restored afterwards)
+    config = luigi.configuration.get_config()
+    keepalive = config.get('worker', 'keep_alive', None)
+    config.set('worker', 'keep_alive', 'true')
+    try:
+        children = []
+        for index in range(1, processes):
+            pid = os.fork()
+            if pid == 0: #child process
+                status = 1
+                try:
+                    status = 0 if (luigi.run(**kwargs) if not args else luigi.build(processtasks(args, index, processes),**kwargs)) else 1
+                finally:
+                    os._exit(status) #pylint: disable=protected-access
+            children.append(pid)
+        success = luigi.run(**kwargs) if not args else luigi.build(args,**kwargs)
+        for pid in children:
+            _, status = os.waitpid(pid, 0)
+            if exitcode(status) != 0:
+                success = False
+    finally:
+        if keepalive is None:
+            config.remove_option('worker', 'keep_alive')
+        else:
+            config.set('worker', 'keep_alive', keepalive)
+    return success
+
+def processtasks(tasks, index, processes):
+    """Returns the tasks to schedule in worker process index (counting from 0) of the specified number of processes. Tasks that have a distribute() method (e.g. ParallelBatch, which schedules its components dynamically and thus only in the process that runs it) contribute a share of their components instead of themselves in the other processes"""
+    processtasks = []
+    for task in tasks:
+        if index > 0 and hasattr(task, 'distribute'):
+            processtasks += task.distribute(index, processes)
+        else:
+            processtasks.append(task)
+    return processtasks
+
 def run_cmdline(TaskClass,**kwargs):
     if 'local_scheduler' in kwargs:
         local_scheduler = kwargs['local_scheduler']
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import time
+import json
+import socket
+import hashlib
+import argparse
+import subprocess
+import importlib
+import logging
+from luiginlp.engine import ParallelBatch, PassParameters, run
+from luiginlp.util import getlog, getstatedir, scandir_glob, isrunning
+
+log = getlog()
+
+def partitionof(inputfile, partitions):
+    """Returns the partition (0-based) an input file belongs to: a hash of its path, so the partitioning is the same on every host, regardless of the order of the inputs"""
+    return int(hashlib.sha1(inputfile.encode('utf-8')).hexdigest(), 16) % partitions
+
+def partition(inputfiles, partitions):
+    """Splits the input files into the specified number of partitions, returns a list of lists"""
+    parts = [ [] for _ in range(partitions) ]
+    for inputfile in inputfiles:
+        parts[partitionof(inputfile, partitions)].append(inputfile)
+    return parts
+
+class LockTaken(Exception):
+    pass
+
+class Launch:
+    """A batch (the components for a set of input files) partitioned over multiple workers, possibly on multiple hosts sharing the state directory on a shared filesystem. The state of every partition (locked by a worker, done) is kept in files under the state directory"""
+
+    def __init__(self, component, inputfiles, partitions, passparameters=None):
+        self.component = component
+        self.inputfiles = inputfiles
+        self.partitions = partitions
+        self.passparameters = passparameters if passparameters is not None else PassParameters()
+        self.batch = ParallelBatch(inputfiles=','.join(inputfiles), component=component, passparameters=self.passparameters)
+        self.directory = os.path.join(getstatedir(), 'launch', self.batch.batchid() + '-' + str(partitions))
+        os.makedirs(self.directory, exist_ok=True)
+
+    def partition(self, index):
+        return partition(self.inputfiles, self.partitions)[index]
+
+    def lockfile(self, index):
+        return os.path.join(self.directory, str(index) + '.lock')
+
+    def donefile(self, index):
+        return os.path.join(self.directory, str(index) + '.done')
+
+    def lock(self, index):
+        """Claims a partition, raises LockTaken if another worker holds it. Locks of workers that died on this host are taken over, locks of other hosts have to be removed manually (or with --force)"""
+        owner = {'host': socket.gethostname(), 'pid': os.getpid(), 'time': time.time()}
+        while True:
+            try:
+                fd = os.open(self.lockfile(index), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                try:
+                    with open(self.lockfile(index),'r',encoding='utf-8') as f:
+                        holder = json.load(f)
+                except (OSError, ValueError): #removed in the meantime or still being written
+                    time.sleep(0.1)
+                    continue
+                if holder['host'] == owner['host'] and not isrunning(holder['pid']):
+                    log.warning("Taking over the lock of partition " + str(index) + " from " + str(holder['pid']) + ", which is no longer running")
+                    self.unlock(index)
+                    continue
+                raise LockTaken("Partition " + str(index) + " is locked by " + holder['host'] + ":" + str(holder['pid']) + " (" + self.lockfile(index) + ")")
+            with os.fdopen(fd,'w',encoding='utf-8') as f:
+                json.dump(owner, f)
+            return
+
+    def unlock(self, index):
+        try:
+            os.unlink(self.lockfile(index))
+        except FileNotFoundError:
+            pass
+
+    def done(self, index):
+        return os.path.exists(self.donefile(index))
+
+    def alldone(self):
+        return all( self.done(index) for index in range(self.partitions) )
+
+    def runpartition(self, index, **kwargs):
+        """Runs the components for one partition of the input files, returns True on success. Keyword arguments are passed to luiginlp.run()"""
+        if self.done(index) or self.batch.complete():
+            log.info("Partition " + str(index) + " of " + str(self.partitions) + " is already done")
+            return True
+        self.lock(index)
+        try:
+            inputfiles = self.partition(index)
+            log.info("Running partition " + str(index) + " of " + str(self.partitions) + ": " + str(len(inputfiles)) + " of " + str(len(self.inputfiles)) + " input files")
+            success = True
+            if inputfiles:
+                success = run(ParallelBatch(inputfiles=','.join(inputfiles), component=self.component, passparameters=self.passparameters), **kwargs)
+            if success:
+                with open(self.donefile(index) + '.tmp','w',encoding='utf-8') as f:
+                    f.write("\n".join(inputfiles))
+                os.replace(self.donefile(index) + '.tmp', self.donefile(index))
+            return success
+        finally:
+            self.unlock(index)
+
+    def merge(self):
+        """Merge step, once all partitions are done: marks the batch as a whole as complete (so ParallelBatch over all input files is complete too) and cleans up the state of the partitions. Only one worker performs it, returns True if this one did"""
+        if not self.alldone():
+            return False
+        try:
+            fd = os.open(os.path.join(self.directory, 'merge.lock'), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError: #merged by another worker
+            return False
+        os.close(fd)
+        merged = []
+        for index in range(self.partitions):
+            with open(self.donefile(index),'r',encoding='utf-8') as f:
+                merged += [ inputfile for inputfile in f.read().split("\n") if inputfile ]
+        with self.batch.output().open('w') as f:
+            f.write("\n".join(merged))
+        for index in range(self.partitions):
+            os.unlink(self.donefile(index))
+        os.unlink(os.path.join(self.directory, 'merge.lock'))
+        os.rmdir(self.directory)
+        log.info("Merged " + str(self.partitions) + " partitions, " + str(len(merged)) + " input files done")
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a component on a set of input files, partitioned over multiple workers (processes or hosts sharing the filesystem). Every worker runs one partition (--partition), or all partitions are launched as local processes (--local). The partitioning is deterministic, so every host arrives at the same one", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--module', type=str, help="Python module containing the component", action='store', required=True)
+    parser.add_argument('--component', type=str, help="Component to run on every input file", action='store', required=True)
+    parser.add_argument('--inputfiles', type=str, help="Input files (comma separated)", action='store', default="")
+    parser.add_argument('--directory', type=str, help="Directory with input files", action='store', default="")
+    parser.add_argument('--pattern', type=str, help="Pattern for input files in the directory", action='store', default="*")
+    parser.add_argument('--passparameters', type=str, help="Parameters to pass to the component (JSON)", action='store', default="{}")
+    parser.add_argument('--partitions', type=int, help="Number of partitions", action='store', required=True)
+    parser.add_argument('--partition', type=int, help="Partition to run (0-based)", action='store', default=None)
+    parser.add_argument('--local', help="Run all partitions, as local processes", action='store_true')
+    parser.add_argument('--merge', help="Only perform the merge step, waiting until all partitions are done", action='store_true')
+    parser.add_argument('--force', help="Remove the locks of all partitions first (when workers died on other hosts)", action='store_true')
+    parser.add_argument('--workers', type=int, help="Number of workers per partition", action='store', default=1)
+    parser.add_argument('--scheduler-host', type=str, help="Host of the central scheduler (luigid) shared by all partitions (defaults to localhost, a local scheduler is used if none is running)", action='store', default=None)
+    parser.add_argument('--scheduler-port', type=int, help="Port of the central scheduler (defaults to 8082)", action='store', default=None)
+    parser.add_argument('--statedir', type=str, help="State directory, on a filesystem shared by all hosts (defaults to .luiginlp/)", action='store', default=None)
+    args = parser.parse_args()
+
+    log.setLevel(logging.INFO)
+    if args.statedir:
+        os.environ['LUIGINLP_STATEDIR'] = args.statedir
+    importlib.import_module(args.module)
+    if args.inputfiles:
+        inputfiles = args.inputfiles.split(',')
+    elif args.directory:
+        inputfiles = sorted(scandir_glob(args.directory, args.pattern))
+    else:
+        parser.error("Specify --inputfiles or --directory")
+    launch = Launch(args.component, inputfiles, args.partitions, PassParameters(json.loads(args.passparameters)))
+    if args.force:
+        for index in range(args.partitions):
+            launch.unlock(index)
+
+    if args.merge:
+        while not launch.alldone():
+            time.sleep(5)
+        launch.merge()
+        return
+    elif args.local:
+        processes = []
+        for index in range(args.partitions):
+            cmd = [ arg for arg in sys.argv if arg != '--local' ] + ['--partition', str(index)]
+            processes.append(subprocess.Popen([sys.executable, '-m', 'luiginlp.launcher'] + cmd[1:]))
+        success = all([ process.wait() == 0 for process in processes ])
+    elif args.partition is not None:
+        if not 0 <= args.partition < args.partitions:
+            parser.error("--partition must be in the range 0 to " + str(args.partitions - 1))
+        try:
+            kwargs = {'workers': args.workers}
+            if args.scheduler_host:
+                kwargs['scheduler_host'] = args.scheduler_host
+            if args.scheduler_port:
+                kwargs['scheduler_port'] = args.scheduler_port
+            success = launch.runpartition(args.partition, **kwargs)
+        except LockTaken as e:
+            log.error(str(e))
+            sys.exit(3)
+    else:
+        parser.error("Specify --partition, --local or --merge")
+
+    launch.merge() #by the worker that finishes last
+    sys.exit(0 if success else 1)
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 
+import sys
 import luigi
 import logging
-from luiginlp.engine import Parallel, run
+from luiginlp.engine import Parallel, run, importcomponents
 from luiginlp.util import getlog
 
 log = getlog()
@@ -12,6 +13,8 @@ log.setLevel(logging.INFO)
 
 def main():
     log.info("Starting LuigiNLP")
+    #import only the modules of the components named on the command line (the workflow component or its --component parameter), --module is then not needed for LuigiNLP's own components
+    importcomponents([ arg.split('=')[-1] for arg in sys.argv[1:] ])
     run()
 
 if __name__ == '__main__':
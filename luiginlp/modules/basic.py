@@ -16,6 +16,8 @@ class Symlink(Task):
 
     in_file = InputSlot() #input slot
 
+    cacheable = False #the output is a symlink
+
     def out_file(self):
         if self.filename:
             return TargetInfo(self, self.filename)
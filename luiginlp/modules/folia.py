@@ -1,14 +1,25 @@
 import os
+import re
+import json
 import glob
 import natsort
 import subprocess
 import pickle
+import concurrent.futures
+import xml.etree.ElementTree as ElementTree
 from luiginlp.engine import Task, TargetInfo, InputFormat, StandardWorkflowComponent, registercomponent, InputSlot, Parameter, BoolParameter, IntParameter, PassParameters, ParallelBatch
-from luiginlp.util import getlog, recursive_glob, waitforslot, waitforcompletion, replaceextension, chunk
+from luiginlp.util import getlog, scandir_glob, replaceextension, chunk, splitparagraphs, windowed, cpucount
 from luiginlp.modules.openconvert import OpenConvert_folia
+try:
+    import folia.main as foliapy
+except ImportError: #the FoLiA library is optional, documents are validated by foliavalidator processes otherwise
+    foliapy = None
 
 log = getlog()
 
+FOLIANS = 'http://ilk.uvt.nl/folia'
+XMLID = '{http://www.w3.org/XML/1998/namespace}id'
+
 @registercomponent
 class ConvertToFoLiA(StandardWorkflowComponent):
     def accepts(self):
@@ -38,6 +49,7 @@ class ConvertToFoLiA(StandardWorkflowComponent):
 
 class Rst2folia(Task):
     executable = 'rst2folia' #external executable (None if n/a)
+    cachebyname = True #the FoLiA ID is derived from the input filename
 
     in_rst = InputSlot() #will be linked to an out_* slot of another module in the workflow specification
 
@@ -62,6 +74,7 @@ class Folia2html(Task):
 
 class Folia2txt(Task):
     executable = 'folia2txt' #external executable (None if n/a)
+    chunkable = True #each input document is converted independently (see run_batch())
 
     sentenceperline = BoolParameter(default=False)
     paragraphperline = BoolParameter(default=False)
@@ -79,6 +92,23 @@ class Folia2txt(Task):
             p=self.paragraphperline,
             t=self.retaintokenisation)
 
+    batchable = True
+
+    @classmethod
+    def run_batch(cls, tasks):
+        #folia2txt -O writes the output of each input document next to it, with the extension set by -E replaced by .txt, so we can only batch if that is where the outputs are expected
+        if any( not task.in_folia().path.endswith('.folia.xml') or task.out_html().path != task.in_folia().path[:-len('.folia.xml')] + '.txt' for task in tasks ):
+            for task in tasks:
+                task.run()
+        else:
+            task = tasks[0]
+            task.ex(*[ task.in_folia().path for task in tasks ],
+                O=True,
+                E='folia.xml', #the default extension is xml, which would make X.folia.txt of X.folia.xml
+                s=task.sentenceperline,
+                p=task.paragraphperline,
+                t=task.retaintokenisation)
+
 class Alpino2folia(Task):
     executable = 'alpino2folia'
 
@@ -107,8 +137,102 @@ class Foliacat(Task):
         foliafiles = [ filename for filename in natsort.natsorted(glob.glob(self.in_foliadir().path + '/*.' + self.extension)) ]
         self.ex(*foliafiles,
                 o=self.out_folia().path,
-                i=self.out_folia().path.split('.')[0]) #first component of filename acts as document ID
+                i=os.path.basename(self.out_folia().path).split('.')[0]) #first component of filename acts as document ID
+
+
+def splitfolia(filename, size, prefix, extension='.folia.xml'):
+    """Splits a FoLiA document into documents of about the specified size (in bytes), at the level of the top-level structure elements of the text body (divisions, paragraphs, etc), which keep their IDs. Every part keeps the metadata and annotation declarations. Part i is written to prefix + i + extension (counting from 1) and gets the basename of that as document ID, returns the list of parts in order"""
+    ElementTree.register_namespace('', FOLIANS)
+    ElementTree.register_namespace('xlink', 'http://www.w3.org/1999/xlink')
+    tree = ElementTree.parse(filename)
+    root = tree.getroot()
+    body = root.find('{' + FOLIANS + '}text')
+    if body is None:
+        raise ValueError("No text body in FoLiA document " + filename)
+    root.remove(body)
+    groups = [[]]
+    groupsize = 0
+    for element in body:
+        elementsize = len(ElementTree.tostring(element))
+        if groups[-1] and groupsize + elementsize > size:
+            groups.append([])
+            groupsize = 0
+        groups[-1].append(element)
+        groupsize += elementsize
+    parts = []
+    for i, group in enumerate(groups, 1):
+        parts.append(prefix + str(i) + extension)
+        partbody = ElementTree.SubElement(root, body.tag, body.attrib)
+        partbody.extend(group)
+        root.set(XMLID, os.path.basename(prefix) + str(i))
+        tree.write(parts[-1], encoding='utf-8', xml_declaration=True)
+        root.remove(partbody)
+    return parts
+
+def renameshardids(filename, docid):
+    """Renames the IDs that start with the ID of a shard (docid-i., see SplitText) to docid.shardi. in a FoLiA document, streaming"""
+    pattern = re.compile(r'(\s(?:xml:)?id=["\'])' + re.escape(docid) + r'-(\d+)\.')
+    with open(filename,'r',encoding='utf-8') as f_in:
+        with open(filename + '.tmp','w',encoding='utf-8') as f_out:
+            for line in f_in:
+                f_out.write(pattern.sub(lambda match: match.group(1) + docid + '.shard' + match.group(2) + '.', line))
+    os.replace(filename + '.tmp', filename)
+
+class SplitText(Task):
+    """Splits a plain text document into shards of about shardsize bytes, at paragraph boundaries, to be processed in parallel (see ProcessShards) and merged again (see MergeShards). Shard i of document docid.txt is docid-i.txt"""
+    shardsize = IntParameter(default=1000000) #size of a shard in bytes
+
+    in_txt = InputSlot()
+
+    def out_shards(self):
+        return self.outputfrominput(inputformat='txt',stripextension='.txt', addextension='.shards.txtdir')
+
+    def run(self):
+        self.setup_output_dir(self.out_shards().path)
+        docid = os.path.basename(self.in_txt().path).split('.')[0]
+        shards = splitparagraphs(self.in_txt().path, self.shardsize, os.path.join(self.out_shards().path, docid + '-'), '.txt')
+        log.info("Split " + self.in_txt().path + " into " + str(len(shards)) + " shards")
+
+class SplitFoLiA(Task):
+    """Splits a FoLiA document into shards of about shardsize bytes, at the level of the top-level structure elements of the text body (see splitfolia()), to be processed in parallel (see ProcessShards) and merged again (see MergeShards)"""
+    shardsize = IntParameter(default=1000000) #size of a shard in bytes
+
+    in_folia = InputSlot()
+
+    def out_shards(self):
+        return self.outputfrominput(inputformat='folia',stripextension='.folia.xml', addextension='.shards.foliadir')
+
+    def run(self):
+        self.setup_output_dir(self.out_shards().path)
+        docid = os.path.basename(self.in_folia().path).split('.')[0]
+        shards = splitfolia(self.in_folia().path, self.shardsize, os.path.join(self.out_shards().path, docid + '-'))
+        log.info("Split " + self.in_folia().path + " into " + str(len(shards)) + " shards")
+
+class ProcessShards(Task):
+    """Runs a component on all shards of a document (see SplitText and SplitFoLiA) in parallel, through a ParallelBatch, the FoLiA output of every shard ends up in a directory of its own"""
+    component = Parameter() #name of the component to run on every shard
+    passparameters = Parameter(default=PassParameters()) #parameters for the component
+    addextension = Parameter(default='') #extension (before .foliadir) of the output directory, e.g. .frogged
+
+    in_shards = InputSlot()
+
+    def out_foliadir(self):
+        return self.outputfrominput(inputformat='shards',stripextension=('.shards.txtdir','.shards.foliadir'), addextension=self.addextension + '.foliadir')
 
+    def run(self):
+        self.setup_output_dir(self.out_foliadir().path)
+        shards = natsort.natsorted(scandir_glob(self.in_shards().path))
+        passparameters = PassParameters(json.loads(self.passparameters) if isinstance(self.passparameters, str) else self.passparameters, outputdir=self.out_foliadir().path) #new_task() passes it as JSON
+        yield ParallelBatch(component=self.component, inputfiles=','.join(shards), passparameters=passparameters)
+
+class MergeShards(Foliacat):
+    """Merges the FoLiA documents of all shards of a document (see ProcessShards) into one, in order, with foliacat. The IDs in the shards of a plain text document start with the ID of the shard (docid-i), pass renameids to rename these to docid.shardi so all IDs start with the ID of the merged document"""
+    renameids = BoolParameter(default=False)
+
+    def run(self):
+        super().run()
+        if self.renameids:
+            renameshardids(self.out_folia().path, os.path.basename(self.out_folia().path).split('.')[0])
 
 class FoliaHOCR(Task):
     """Converts a directory of hocr files to a directory of FoLiA files"""
@@ -147,51 +271,155 @@ class FoliaValidatorTask(Task):
             __stderr_to=self.out_validator().path,
             __ignorefailure=True) #if the validator fails (it does when the document is invalid),  we ignore it as that is a valid result for us
 
+FOLIASCHEMA = None #the RelaxNG schema of FoLiA, loaded once per process by foliastages()
+
+def foliastages(inputfile, report):
+    """Validates a FoLiA document with the FoLiA library in the same stages, and with the same options, as foliavalidator does by default: against the RelaxNG schema, by a full parse and by serialisation. Appends foliavalidator's messages to the report (a list of lines), returns whether the document is valid"""
+    global FOLIASCHEMA #pylint: disable=global-statement
+    try:
+        if FOLIASCHEMA is None:
+            FOLIASCHEMA = foliapy.ElementTree.RelaxNG(foliapy.relaxng())
+        foliapy.validate(inputfile, FOLIASCHEMA)
+    except Exception as e: #pylint: disable=broad-except
+        report += [ "Error on line " + str(error.line) + ": " + error.message for error in (FOLIASCHEMA.error_log if FOLIASCHEMA is not None else []) ]
+        report += ["VALIDATION ERROR against RelaxNG schema (stage 1/3), in " + inputfile, str(e)]
+        return False
+    try:
+        document = foliapy.Document(file=inputfile, deepvalidation=False, textvalidation=False, autodeclare=False, checkreferences=True)
+    except Exception as e: #pylint: disable=broad-except
+        report += ["VALIDATION ERROR on full parse by library (stage 2/3), in " + inputfile, e.__class__.__name__ + ": " + str(e)]
+        return False
+    if not document.version:
+        report.append("VALIDATION ERROR: Document does not advertise FoLiA version (" + inputfile + ")")
+        return False
+    if foliapy.checkversion(document.version) == -1:
+        report.append("WARNING: Document (" + inputfile + ") uses an older FoLiA version (" + document.version + ") but is validated according to the newer specification (" + foliapy.FOLIAVERSION + ")")
+    if document.textvalidationerrors:
+        report.append("WARNING: there were " + str(document.textvalidationerrors) + " text validation errors but these are currently not counted toward the full validation result")
+    try:
+        document.xmlstring()
+    except Exception as e: #pylint: disable=broad-except
+        report += ["SERIALISATION ERROR (stage 3/3), in " + inputfile, e.__class__.__name__ + ": " + str(e)]
+        return False
+    return True
+
+def validatefolia(inputfile, reportfile):
+    """Validates a FoLiA document in this process as foliavalidator does (see foliastages()) and writes a report like foliavalidator's, returns whether the document is valid. The report is written to a temporary file first, so an interrupted validation leaves no (partial) report behind"""
+    report = []
+    valid = foliastages(inputfile, report)
+    if valid:
+        report.append("Validated successfully: " + inputfile)
+    with open(reportfile + '.tmp','w',encoding='utf-8') as f:
+        f.write("\n".join(report) + "\n")
+    os.replace(reportfile + '.tmp', reportfile)
+    return valid
+
+def validreport(reportfile):
+    """Returns whether a validation report (of foliavalidator or validatefolia()) says the document is valid"""
+    with open(reportfile,'r',encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('Validated successfully'):
+                return True
+    return False
+
 class FoliaValidatorDirTask(Task):
+    """Validates all FoLiA documents in a directory (recursively) and writes a summary. With the FoLiA library installed, the documents are validated in-process, by a pool of processes that each validate many documents; otherwise by a pool of foliavalidator processes. A report is written for every document (as FoliaValidatorTask does) and the summary is written as the results come in, in a single pass over the directory. Documents that have a report already are not validated again, unless they changed since the last successful run in incremental mode"""
     executable = "foliavalidator"
     in_foliadir = InputSlot()
     folia_extension = Parameter(default='folia.xml')
+    window = IntParameter(default=1000) #number of documents handed to the pool at once
+    threads = IntParameter(default=0) #number of concurrent validators (0 = number of CPUs)
+    incremental = BoolParameter(default=False) #validate the documents that were changed since the last successful run again, remove the reports of documents that were removed
 
     def out_validationsummary(self):
         return self.outputfrominput(inputformat='foliadir',stripextension='.foliadir', addextension='.folia-validation-summary.txt')
 
-
-    def run(self):
-        #gather input files
-        if self.outputdir and not os.path.exists(self.outputdir): os.makedirs(self.outputdir)
-
-        log.info("Collecting input files...")
-        inputfiles = recursive_glob(self.in_foliadir().path, '*.' + self.folia_extension)
-        log.info("Collected " + str(len(inputfiles)) + " input files")
-
-        log.info("Scheduling validators")
+    def reportfile(self, inputfile):
+        reportfile = replaceextension(inputfile, self.folia_extension, '.folia-validation-report.txt')
         if self.outputdir:
-            passparameters = PassParameters(folia_extension=self.folia_extension,replaceinputdir=self.in_foliadir().path, outputdir=self.outputdir)
-        else:
-            passparameters = PassParameters(folia_extension=self.folia_extension)
+            return os.path.join(self.outputdir, os.path.relpath(reportfile, self.in_foliadir().path))
+        return reportfile
 
-        yield [ FoliaValidator(inputfile=inputfile,passparameters=passparameters) for inputfile in inputfiles ]
-
-        log.info("Collecting output files...")
-        #Gather all output files
-        if self.outputdir:
-            outputfiles = recursive_glob(self.outputdir, '*.folia-validation-report.txt')
+    def run(self):
+        threads = self.threads if self.threads > 0 else cpucount()
+        if foliapy is None:
+            log.info("Validating with foliavalidator, " + str(threads) + " processes")
+            validate = self.validate_processes
         else:
-            outputfiles = recursive_glob(self.in_foliadir().path, '*.folia-validation-report.txt')
-
-        log.info("Writing summary")
-        with open(self.out_validationsummary().path,'w',encoding='utf-8') as f_summary:
-            for outputfilename in outputfiles:
-                with open(outputfilename, 'r',encoding='utf-8') as f:
-                    success = False
-                    for line in f:
-                        if line.startswith('Validated successfully'):
-                            success = True
-                            break
-                if success:
-                    f_summary.write(outputfilename + ": OK\n")
-                else:
-                    f_summary.write(outputfilename + ": ERROR\n")
+            log.info("Validating with the FoLiA library, " + str(threads) + " processes")
+            validate = self.validate_inprocess
+        if self.outputdir and not os.path.exists(self.outputdir): os.makedirs(self.outputdir)
+        if self.incremental:
+            #documents that have a report are not validated again, remove the reports of the documents that changed
+            manifest = self.getmanifest(self.in_foliadir().path)
+            delta = manifest.delta(self.inputfiles())
+            manifest.invalidate(delta)
+        summaryfile = self.out_validationsummary().path
+        counts = {True: 0, False: 0}
+        with open(summaryfile + '.tmp','w',encoding='utf-8') as f_summary:
+            for reportfile, valid in validate(self.documents(), threads):
+                f_summary.write(reportfile + (": OK\n" if valid else ": ERROR\n"))
+                counts[valid] += 1
+        os.replace(summaryfile + '.tmp', summaryfile)
+        if self.incremental:
+            manifest.commit(delta, lambda inputfile: [self.reportfile(inputfile)])
+        log.info("Validated " + str(counts[True] + counts[False]) + " documents, " + str(counts[False]) + " invalid")
+
+    def complete(self):
+        #in incremental mode, the summary is only complete as long as the directory does not change
+        return super().complete() and (not self.incremental or self.getmanifest(self.in_foliadir().path).unchanged(self.inputfiles()))
+
+    def inputfiles(self):
+        return scandir_glob(self.in_foliadir().path, '*.' + self.folia_extension, recursive=True)
+
+    def documents(self):
+        """Generator over (inputfile, reportfile) tuples for all documents in the directory, lazily"""
+        for inputfile in self.inputfiles():
+            reportfile = self.reportfile(inputfile)
+            if self.outputdir:
+                os.makedirs(os.path.dirname(reportfile), exist_ok=True)
+            yield inputfile, reportfile
+
+    def validate_inprocess(self, documents, threads):
+        """Validates the documents with the FoLiA library in a pool of processes, window documents at a time, yields (reportfile, valid) tuples as the results come in"""
+        with concurrent.futures.ProcessPoolExecutor(max_workers=threads) as executor:
+            for window in windowed(documents, self.window if self.window > 0 else 1000):
+                todo = []
+                for inputfile, reportfile in window:
+                    if os.path.exists(reportfile): #validated in an earlier run
+                        yield reportfile, validreport(reportfile)
+                    else:
+                        todo.append((inputfile, reportfile))
+                if todo:
+                    yield from zip([ reportfile for _, reportfile in todo ], executor.map(validatefolia, *zip(*todo), chunksize=max(1, len(todo) // (threads * 4))))
+
+    def validate_processes(self, documents, threads):
+        """Validates every document with a foliavalidator process in the task's process pool, yields (reportfile, valid) tuples as the processes finish"""
+        pool = self.getprocesspool(threads)
+        reports = {} #pid => report file
+        collected = 0 #number of finished processes in the pool that have been reported
+        try:
+            for inputfile, reportfile in documents:
+                if os.path.exists(reportfile): #validated in an earlier run
+                    yield reportfile, validreport(reportfile)
+                    continue
+                #if the validator fails (it does when the document is invalid), we ignore it as that is a valid result for us
+                #the report is written to a temporary file that is renamed when the validator is done, so an interrupted validation leaves no (partial) report behind
+                reports[self.ex_async(inputfile, __stderr_to=reportfile + '.tmp', __ignorefailure=True)] = reportfile
+                for process in pool.finished[collected:]:
+                    yield self.finishreport(reports.pop(process.pid))
+                    collected += 1
+            pool.wait()
+            for process in pool.finished[collected:]:
+                yield self.finishreport(reports.pop(process.pid))
+        finally:
+            self.cleanup_async()
+
+    @staticmethod
+    def finishreport(reportfile):
+        """Moves the report of a finished foliavalidator process into place, returns a (reportfile, valid) tuple"""
+        os.replace(reportfile + '.tmp', reportfile)
+        return reportfile, validreport(reportfile)
 
 @registercomponent
 class FoliaValidator(StandardWorkflowComponent):
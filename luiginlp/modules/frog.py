@@ -1,18 +1,46 @@
 import os
-from luiginlp.engine import Task, InputComponent, InputFormat, StandardWorkflowComponent, registercomponent, InputSlot, Parameter, BoolParameter
-from luiginlp.util import getlog
-from luiginlp.modules.folia import ConvertToFoLiA
+import re
+import socket
+from luiginlp.engine import Task, InputComponent, InputFormat, StandardWorkflowComponent, registercomponent, InputSlot, Parameter, BoolParameter, IntParameter, PassParameters
+from luiginlp.util import getlog, ServerPool
+from luiginlp.modules.folia import ConvertToFoLiA, SplitText, SplitFoLiA, ProcessShards, MergeShards
 
 log = getlog()
 
+SERVERDOCID = 'luiginlpserverdoc' #placeholder document ID for Frog servers, replaced by the actual ID in the output
+
+def frogserverpool(task, foliainput, **kwargs):
+    """Returns the pool of Frog servers for the given task, a server is started with the same options the task would otherwise pass to frog"""
+    cmd = task.getargs(S='{port}', x=foliainput, X=True, id=SERVERDOCID if not foliainput else None, **kwargs)
+    return ServerPool('frog', [task.executable] + cmd, size=task.servers)
+
+def frogquery(port, data, encoding='utf-8'):
+    """Send a document to a Frog server and return Frog's output (Frog's server protocol: input is terminated by EOT, output by READY)"""
+    with socket.create_connection(('localhost', port)) as sock:
+        sock.sendall(data.encode(encoding) + b'\r\nEOT\r\n')
+        buffer = bytearray()
+        while True:
+            moredata = sock.recv(65536)
+            if not moredata:
+                raise IOError("Frog server on port " + str(port) + " closed the connection prematurely")
+            buffer += moredata
+            end = len(buffer)
+            while end > 0 and buffer[end-1] in b'\r\n':
+                end -= 1
+            if buffer[max(0,end-5):end] == b'READY' and (end == 5 or buffer[end-6:end-5] == b'\n'):
+                return buffer[:end-5].decode(encoding)
+
 
 class Frog_txt2folia(Task):
     """A task for Frog: Takes plaintext input and produces FoLiA output"""
     executable = 'frog' #external executable (None if n/a)
+    cachebyname = True #the FoLiA ID is derived from the input filename
 
     #Parameters for this module (all mandatory!)
     tok_input_sentenceperline = BoolParameter(default=False)
     skip = Parameter(default="")
+    server = BoolParameter(default=False) #use a pool of persistent Frog servers rather than starting frog (and loading all models) for every document
+    servers = IntParameter(default=1) #number of Frog servers in the pool
 
     in_txt = InputSlot() #input slot placeholder (will be linked to an out_* slot of another module in the workflow specification)
 
@@ -21,6 +49,18 @@ class Frog_txt2folia(Task):
         return self.outputfrominput(inputformat='txt',stripextension='.txt', addextension='.frogged.folia.xml') #the format_id corresponds to the input slot (txt -> in_txt)
 
     def run(self):
+        if self.server:
+            docid = os.path.basename(self.in_txt().path).split('.')[0]
+            with open(self.in_txt().path,'r',encoding='utf-8') as f:
+                data = f.read()
+            with frogserverpool(self, False, skip=self.skip if self.skip else None, n=self.tok_input_sentenceperline).acquire() as port:
+                output = frogquery(port, data)
+            #the server assigns the same ID to all documents, replace it with the proper one
+            output = re.sub('(["\'])' + SERVERDOCID, lambda match: match.group(1) + docid, output)
+            with open(self.out_folia().path,'w',encoding='utf-8') as f:
+                f.write(output)
+            return
+
         #execute a shell command, python keyword arguments will be passed as option flags (- for one letter, -- for more)
         # values will be made shell-safe.
         # None or False values will not be propagated at all.
@@ -37,6 +77,8 @@ class Frog_folia2folia(Task):
 
     #Parameters for this module (all mandatory!)
     skip = Parameter(default="")
+    server = BoolParameter(default=False) #use a pool of persistent Frog servers rather than starting frog (and loading all models) for every document
+    servers = IntParameter(default=1) #number of Frog servers in the pool
 
     in_folia = InputSlot() #will be linked to an out_* slot of another module in the workflow specification
 
@@ -44,6 +86,15 @@ class Frog_folia2folia(Task):
         return self.outputfrominput(inputformat='folia',stripextension='.folia.xml', addextension='.frogged.folia.xml')
 
     def run(self):
+        if self.server:
+            with open(self.in_folia().path,'r',encoding='utf-8') as f:
+                data = f.read()
+            with frogserverpool(self, True, skip=self.skip if self.skip else None).acquire() as port:
+                output = frogquery(port, data)
+            with open(self.out_folia().path,'w',encoding='utf-8') as f:
+                f.write(output)
+            return
+
         self.ex(
             x=self.in_folia().path,
             X=self.out_folia().path,
@@ -58,6 +109,8 @@ class Frog(StandardWorkflowComponent):
     """A workflow component for Frog"""
 
     skip = Parameter(default="") #A parameter for the workflow, will be passed on to the tasks
+    server = BoolParameter(default=False) #use a pool of persistent Frog servers
+    servers = IntParameter(default=1) #number of Frog servers in the pool
 
     def autosetup(self):
         return (Frog_txt2folia, Frog_folia2folia)
@@ -86,3 +139,31 @@ class Frog(StandardWorkflowComponent):
     #            frog.in_folia = input_slot #set the input slot of the task to that of the workflow component
     #       return frog #return the last task of the workflow (mandatory!)
 
+
+@registercomponent
+class Frog_sharded(StandardWorkflowComponent):
+    """Frog for large documents: splits the document into shards of about shardsize bytes (at paragraph boundaries), runs Frog on the shards in parallel and merges the results into one FoLiA document"""
+
+    skip = Parameter(default="")
+    server = BoolParameter(default=False) #use a pool of persistent Frog servers
+    servers = IntParameter(default=1) #number of Frog servers in the pool
+    shardsize = IntParameter(default=1000000) #size of a shard in bytes
+
+    def setup(self, workflow, input_feeds):
+        if 'txt' in input_feeds:
+            split = workflow.new_task('split', SplitText, shardsize=self.shardsize)
+            split.in_txt = input_feeds['txt']
+        else:
+            split = workflow.new_task('split', SplitFoLiA, shardsize=self.shardsize)
+            split.in_folia = input_feeds['folia']
+        frog = workflow.new_task('frog', ProcessShards, component='Frog', addextension='.frogged', passparameters=PassParameters(skip=self.skip, server=self.server, servers=self.servers))
+        frog.in_shards = split.out_shards
+        merge = workflow.new_task('merge', MergeShards, renameids='txt' in input_feeds)
+        merge.in_foliadir = frog.out_foliadir
+        return merge
+
+    def accepts(self):
+        return (
+            InputFormat(self, format_id='folia', extension='folia.xml'),
+            InputFormat(self, format_id='txt', extension='txt'),
+        )
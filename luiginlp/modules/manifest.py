@@ -0,0 +1,20 @@
+#Generated by luiginlp.util.writecomponentmanifest(), do not edit
+#Maps the workflow components in LuigiNLP's modules to the module that defines them, so getcomponentclass() and the luiginlp command can import them on demand
+
+COMPONENTMODULES = {
+    'ConvertToFoLiA': 'luiginlp.modules.folia',
+    'ExtractPages': 'luiginlp.modules.ocr',
+    'FoliaValidator': 'luiginlp.modules.folia',
+    'Frog': 'luiginlp.modules.frog',
+    'Frog_sharded': 'luiginlp.modules.frog',
+    'OCR_document': 'luiginlp.modules.ocr',
+    'OCR_folia': 'luiginlp.modules.ocr',
+    'OCR_singlepage': 'luiginlp.modules.ocr',
+    'TimblClassifier': 'luiginlp.modules.timbl',
+    'TimblCrossValidator': 'luiginlp.modules.timbl',
+    'TimblLOOClassifier': 'luiginlp.modules.timbl',
+    'TimblShardedClassifier': 'luiginlp.modules.timbl',
+    'Ucto': 'luiginlp.modules.ucto',
+    'Ucto_dir': 'luiginlp.modules.ucto',
+    'Ucto_sharded': 'luiginlp.modules.ucto',
+}
@@ -2,8 +2,12 @@ import os
 import glob
 import sys
 import shutil
-from luiginlp.engine import Task, StandardWorkflowComponent, registercomponent, InputComponent, Parallel, run, InputFormat, InputSlot, Parameter, BoolParameter
-from luiginlp.util import getlog
+import time
+import signal
+import subprocess
+import natsort
+from luiginlp.engine import Task, StandardWorkflowComponent, registercomponent, InputComponent, Parallel, run, InputFormat, InputSlot, Parameter, BoolParameter, IntParameter, stream, ProcessFailure, componentoutputs
+from luiginlp.util import getlog, scandir_glob, replaceextension, cpucount, Slots
 from luiginlp.modules.pdf import Pdf2images
 from luiginlp.modules.folia import Foliacat, FoliaHOCR
 
@@ -39,8 +43,13 @@ class OCR_singlepage(StandardWorkflowComponent):
 
 class TesseractOCR_document(Task):
     """OCR for a whole document (input is a directory of tiff image files (pages), output is a directory of hOCR files"""
+    executable = 'tesseract' #used in page-parallel mode
     tiff_extension=Parameter(default='tif')
     language = Parameter()
+    window = IntParameter(default=0) #schedule the pages in windows of this size rather than all at once (0)
+    pageparallel = BoolParameter(default=False) #run tesseract on all pages from this task, through a pool of processes, rather than scheduling a component per page
+    threads = IntParameter(default=0) #number of concurrent tesseract processes in page-parallel mode (0 = number of CPUs), bounded machine-wide to the number of CPUs
+    incremental = BoolParameter(default=False) #only OCR the pages that were added or changed since the last successful run, remove the output of pages that were changed or removed
 
     in_tiffdir = InputSlot() #input slot
 
@@ -51,18 +60,185 @@ class TesseractOCR_document(Task):
         #Set up the output directory, will create it and tear it down on failure automatically
         self.setup_output_dir(self.out_hocrdir().path)
 
-        #gather input files
-        inputfiles = [ filename for filename in glob.glob(self.in_tiffdir().path + '/*.' + self.tiff_extension) ]
+        #gather input files (lazily)
+        pages = scandir_glob(self.in_tiffdir().path, '*.' + self.tiff_extension)
+        maketask = lambda inputfile: OCR_singlepage(inputfile=inputfile,outputdir=self.out_hocrdir().path,language=self.language,tiff_extension=self.tiff_extension)
 
-        #inception aka dynamic dependencies: we yield a list of tasks to perform which could not have been predicted statically
+        if self.incremental:
+            #only the pages that were added or changed since the last successful run
+            manifest = self.getmanifest(self.in_tiffdir().path)
+            delta = manifest.delta(pages)
+            manifest.invalidate(delta)
+            pages = delta.changed
+
+        if self.pageparallel:
+            self.run_pageparallel(pages)
+            if self.incremental:
+                manifest.commit(delta, lambda page: [self.hocrfile(page)])
+            return
+
+        #inception aka dynamic dependencies: we yield lists of tasks to perform which could not have been predicted statically
         #in this case we run the OCR_singlepage component for each input file in the directory
-        yield [ OCR_singlepage(inputfile=inputfile,outputdir=self.out_hocrdir().path,language=self.language,tiff_extension=self.tiff_extension) for inputfile in inputfiles ]
+        yield from stream(pages, maketask, self.window, self.task_id)
+
+        if self.incremental:
+            manifest.commit(delta, lambda inputfile: componentoutputs(maketask(inputfile)))
+
+    def complete(self):
+        #in incremental mode, the output directory is only complete as long as the input directory does not change
+        return super().complete() and (not self.incremental or self.getmanifest(self.in_tiffdir().path).unchanged(scandir_glob(self.in_tiffdir().path, '*.' + self.tiff_extension)))
+
+    def hocrfile(self, page):
+        return os.path.join(self.out_hocrdir().path, os.path.basename(replaceextension(page, ('.tif','.tiff'), '.hocr')))
+
+    def run_pageparallel(self, pages):
+        cpus = cpucount()
+        threads = self.threads if self.threads > 0 else cpus
+        #tesseract uses OpenMP threads itself, divide the CPUs over the processes so we don't oversubscribe
+        ompthreads = max(1, cpus // threads)
+        #the slots are shared by all tasks (and luigi workers) on this machine
+        self.getprocesspool(threads, Slots('tesseract', max(1, cpus // ompthreads)))
+
+        #largest pages first, they take longest, so the pool doesn't end up waiting for a few long pages at the end
+        pages = sorted( ((os.path.getsize(page), page) for page in pages), reverse=True )
+        begintime = time.time()
+        done = 0
+        for _, page in pages:
+            hocrfile = self.hocrfile(page)
+            if os.path.exists(hocrfile): #done in a previous run
+                continue
+            self.ex_async(page, hocrfile[:-5], #output path without hocr extension (-5), Tesseract adds it already
+                l=self.language,
+                c="tessedit_create_hocr=T",
+                __env={'OMP_THREAD_LIMIT': ompthreads})
+            done += 1
+        self.wait_async()
+        duration = time.time() - begintime
+        log.info("OCR of " + str(done) + " pages took " + str(round(duration,2)) + "s (" + str(round(done / duration if duration else 0,2)) + " pages/s with " + str(threads) + " processes)")
 
 
 
 
 
 
+class PipelinedOCR(Task):
+    """OCR for a whole PDF document (input is a PDF file, output is a directory of hOCR files and a directory of FoLiA files, one per page). Page extraction, OCR and conversion to FoLiA run concurrently, each page flows through the pipeline as soon as it is extracted"""
+    executable = 'pdfimages'
+    tesseract_executable = 'tesseract'
+    foliahocr_executable = 'FoLiA-hocr'
+
+    language = Parameter()
+    threads = IntParameter(default=0) #number of concurrent OCR processes (0 = number of CPUs), bounded machine-wide to the number of CPUs
+    queuesize = IntParameter(default=0) #maximum number of extracted pages awaiting or undergoing OCR, extraction is paused whilst it is reached (0 = twice the number of threads)
+    keepimages = BoolParameter(default=False) #keep the extracted page images (in a .tiffdir), rather than deleting each one once it has been OCRed
+
+    in_pdf = InputSlot() #input slot
+
+    def out_hocrdir(self):
+        return self.outputfrominput(inputformat='pdf',stripextension='.pdf',addextension='.hocrdir')
+
+    def out_foliadir(self):
+        return self.outputfrominput(inputformat='pdf',stripextension='.pdf',addextension='.foliadir')
+
+    def run(self):
+        hocrdir = self.out_hocrdir().path
+        foliadir = self.out_foliadir().path
+        self.setup_output_dir(hocrdir)
+        self.setup_output_dir(foliadir)
+        imagedir = foliadir[:-len('.foliadir')] + '.tiffdir.tmp'
+        if os.path.exists(imagedir):
+            shutil.rmtree(imagedir)
+        os.mkdir(imagedir)
+
+        cpus = cpucount()
+        threads = self.threads if self.threads > 0 else cpus
+        ompthreads = max(1, cpus // threads) #see TesseractOCR_document.run_pageparallel()
+        queuesize = self.queuesize if self.queuesize > 0 else 2 * threads
+        pool = self.getprocesspool(threads, Slots('tesseract', max(1, cpus // ompthreads)))
+
+        argv = self.getargv(self.in_pdf().path, imagedir + '/' + os.path.basename(self.in_pdf().path).split('.')[0], tiff=True, p=True, __singlehyphen=True)
+        log.info("Executing extraction command: " + ' '.join(argv))
+        begintime = time.time()
+        extractor = subprocess.Popen(argv)
+        paused = False
+        seen = set() #names of all extracted page images
+        queue = [] #page images awaiting OCR
+        pending = 0 #page images on disk (awaiting or undergoing OCR)
+        peak = 0
+        stages = {} #pid => (stage, page image)
+        reaped = 0 #number of processes in pool.finished that have been handled
+        try:
+            while True:
+                extracting = extractor.poll() is None
+                #pdfimages writes the images in order, an image is complete once the next one appears or pdfimages has finished
+                images = natsort.natsorted( entry.name for entry in os.scandir(imagedir) if entry.name.endswith('.tif') and entry.name not in seen )
+                if extracting and images:
+                    images.pop() #may still be written
+                for name in images:
+                    seen.add(name)
+                    queue.append(os.path.join(imagedir, name))
+                pending += len(images)
+                peak = max(peak, pending)
+
+                #bounded queue: pause extraction whilst enough pages are waiting
+                if extracting and not paused and pending >= queuesize:
+                    os.kill(extractor.pid, signal.SIGSTOP)
+                    paused = True
+                elif paused and pending < queuesize:
+                    os.kill(extractor.pid, signal.SIGCONT)
+                    paused = False
+
+                while queue and len(pool) < pool.threads:
+                    image = queue.pop(0)
+                    pid = self.ex_async(image, os.path.join(hocrdir, os.path.basename(image)[:-4]), #output path without hocr extension, Tesseract adds it already
+                        l=self.language,
+                        c="tessedit_create_hocr=T",
+                        __executable=self.tesseract_executable,
+                        __env={'OMP_THREAD_LIMIT': ompthreads})
+                    stages[pid] = ('ocr', image)
+
+                #handle all finished processes (the pool may also have collected some whilst submitting)
+                for process in pool.finished[reaped:]:
+                    reaped += 1
+                    stage, image = stages.pop(process.pid)
+                    if stage == 'ocr':
+                        pending -= 1
+                        if not self.keepimages:
+                            os.unlink(image)
+                        if process.returncode == 0:
+                            pid = self.ex_async(os.path.join(hocrdir, os.path.basename(image)[:-4] + '.hocr'),
+                                O=foliadir,
+                                __executable=self.foliahocr_executable)
+                            stages[pid] = ('folia', image)
+                if reaped < len(pool.finished):
+                    continue
+
+                if not extracting and not queue and not len(pool):
+                    break
+                if len(pool):
+                    pool.waitforany(None if paused or not extracting else 0.1)
+                else:
+                    try:
+                        extractor.wait(0.1)
+                    except subprocess.TimeoutExpired:
+                        pass
+        finally:
+            if extractor.poll() is None:
+                extractor.kill()
+                if paused:
+                    os.kill(extractor.pid, signal.SIGCONT)
+                extractor.wait()
+        if extractor.returncode != 0:
+            raise ProcessFailure("Page extraction with " + self.executable + " failed with exit code " + str(extractor.returncode))
+        self.wait_async()
+
+        if self.keepimages:
+            os.rename(imagedir, imagedir[:-len('.tmp')])
+        else:
+            shutil.rmtree(imagedir)
+        duration = time.time() - begintime
+        log.info("Pipelined OCR of " + str(len(seen)) + " pages took " + str(round(duration,2)) + "s (" + str(round(len(seen) / duration if duration else 0,2)) + " pages/s with " + str(threads) + " processes), at most " + str(peak) + " page images were on disk at once")
+
 
 
 @registercomponent
@@ -79,6 +255,10 @@ class ExtractPages(StandardWorkflowComponent):
 class OCR_document(StandardWorkflowComponent):
 
     language = Parameter()
+    window = IntParameter(default=0) #schedule pages in windows of this size (0 = all at once)
+    pageparallel = BoolParameter(default=False) #run tesseract on all pages through a pool of processes in one task, rather than a component per page
+    threads = IntParameter(default=0) #number of concurrent tesseract processes in page-parallel mode (0 = number of CPUs)
+    incremental = BoolParameter(default=False) #only OCR the pages that were added or changed since the last successful run
 
     def autosetup(self):
         return TesseractOCR_document
@@ -97,14 +277,30 @@ class OCR_document(StandardWorkflowComponent):
 class OCR_folia(StandardWorkflowComponent):
     """OCR with FoLiA output"""
     language = Parameter()
+    pageparallel = BoolParameter(default=False) #run tesseract on all pages through a pool of processes in one task, rather than a component per page
+    threads = IntParameter(default=0) #number of concurrent tesseract processes in page-parallel or pipelined mode (0 = number of CPUs)
+    pipelined = BoolParameter(default=False) #for PDF input: extract, OCR and convert pages concurrently, each page as soon as it is extracted
+    queuesize = IntParameter(default=0) #in pipelined mode: maximum number of extracted pages awaiting or undergoing OCR (0 = twice the number of threads)
+    keepimages = BoolParameter(default=False) #in pipelined mode: keep the extracted page images rather than deleting each one once it has been OCRed
 
     def setup(self, workflow, input_feeds):
-        foliahocr = workflow.new_task('foliahocr', FoliaHOCR)
-        foliahocr.in_hocrdir = input_feeds['hocrdir']
+        if 'pdf' in input_feeds:
+            pipelinedocr = workflow.new_task('pipelinedocr', PipelinedOCR, autopass=True)
+            pipelinedocr.in_pdf = input_feeds['pdf']
+            foliadir = pipelinedocr.out_foliadir
+        else:
+            foliahocr = workflow.new_task('foliahocr', FoliaHOCR)
+            foliahocr.in_hocrdir = input_feeds['hocrdir']
+            foliadir = foliahocr.out_foliadir
         foliacat = workflow.new_task('foliacat', Foliacat)
-        foliacat.in_foliadir = foliahocr.out_foliadir
+        foliacat.in_foliadir = foliadir
         return foliacat
 
     def accepts(self):
         """Returns a tuple of all the initial inputs and other workflows this component accepts as input (a disjunction, only one will be selected)"""
+        if self.pipelined:
+            return (
+                InputFormat(self, format_id='pdf', extension='pdf'),
+                InputComponent(self, OCR_document)
+            )
         return InputComponent(self, OCR_document)
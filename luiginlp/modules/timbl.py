@@ -2,12 +2,97 @@ import sys
 import os
 import logging
 import glob
+import re
+import shutil
+import tempfile
+import socket
+import collections
+import concurrent.futures
 import natsort
 from luiginlp.engine import Task, InputFormat, WorkflowComponent, StandardWorkflowComponent, registercomponent, InputSlot, Parameter, BoolParameter, IntParameter
 from luiginlp.modules.openconvert import OpenConvert_folia
+from luiginlp.util import splitlines, concatenate, cpucount, windowed, ServerPool, filedigest
 
 log = logging.getLogger('mainlog')
 
+ACCURACY = re.compile(r'overall accuracy:\s+[0-9.]+\s+\(([0-9]+)/([0-9]+)\)')
+SEPARATORS = {'Columns': None, 'Tabbed': '\t', 'C4.5': ','} #instance formats supported on Timbl servers => separator of the features and class (None = whitespace)
+
+def mergelogs(logfiles, outputfile, label='shard'):
+    """Merges the logs of multiple Timbl runs on parts of the data into one, in order, and appends the overall accuracy over all parts"""
+    correct = total = 0
+    with open(outputfile,'w',encoding='utf-8') as out:
+        for i, logfile in enumerate(logfiles):
+            out.write("=== " + label + " " + str(i+1) + " ===\n")
+            with open(logfile,'r',encoding='utf-8',errors='replace') as f:
+                for line in f:
+                    out.write(line)
+                    match = ACCURACY.search(line)
+                    if match:
+                        correct += int(match.group(1))
+                        total += int(match.group(2))
+        out.write("=== all " + str(len(logfiles)) + " " + label + "s ===\n")
+        out.write("overall accuracy:        " + ("%.6f" % (correct / total if total else 0)) + "  (" + str(correct) + "/" + str(total) + ")\n")
+    return correct, total
+
+def timblserverpool(task):
+    """Returns the pool of Timbl servers for the given test task, a server loads the instance base once and is started with the same options the task would otherwise pass to timbl"""
+    cmd = task.getargs(
+        i=task.in_ibase().path,
+        w=task.in_wgt().path + ':' + task.weighting,
+        a=task.algorithm,
+        k=task.k,
+        m=task.metric,
+        d=task.distance,
+        F=task.format,
+        S='{port}')
+    #servers are shared by all tasks testing against the same model, wherever its files are, with the same options
+    key = "\0".join([filedigest(task.in_ibase().path), filedigest(task.in_wgt().path)] + [ str(value) for value in (task.weighting, task.algorithm, task.k, task.metric, task.distance, task.format) ])
+    return ServerPool('timbl', [task.executable] + cmd, size=task.servers, key=key)
+
+def timblquery(port, instances, batchsize=1000):
+    """Classifies instances (lines as in the test data) on a Timbl server, yields the predicted class of each (Timbl's server protocol: every instance is sent as a "c" command, answered by a CATEGORY line; other lines such as the welcome message are skipped). Instances are sent in batches, so the server is never waiting on a round trip"""
+    with socket.create_connection(('localhost', port)) as sock:
+        f = sock.makefile('rwb')
+        for batch in windowed(instances, batchsize):
+            f.write(b''.join( b'c ' + instance.encode('utf-8') + b'\n' for instance in batch ))
+            f.flush()
+            for _ in batch:
+                while True:
+                    response = f.readline()
+                    if not response:
+                        raise IOError("Timbl server on port " + str(port) + " closed the connection prematurely")
+                    response = response.decode('utf-8').strip()
+                    if response.startswith('CATEGORY'):
+                        yield response[response.index('{')+1:response.index('}')].strip()
+                        break
+                    elif response.startswith('ERROR'):
+                        raise IOError("Timbl server on port " + str(port) + " returned an error: " + response)
+
+def timblserverclassify(port, testfile, outputfile, logfile, format='Columns'):
+    """Classifies a test file on a Timbl server, writes the output (the instances followed by the predicted class, with the separator of the format, as timbl -o does) and a log with the accuracy. Returns the number of correct and of all instances. Only the formats in SEPARATORS are supported"""
+    if format not in SEPARATORS:
+        raise ValueError("Classification on a Timbl server supports the " + ", ".join(SEPARATORS) + " formats only, not " + format)
+    separator = SEPARATORS[format]
+    correct = total = 0
+    with open(testfile,'r',encoding='utf-8') as f, open(outputfile,'w',encoding='utf-8') as out:
+        sent = collections.deque() #instances sent but not yet answered
+        def instances():
+            for line in f:
+                if line.strip():
+                    sent.append(line.strip())
+                    yield line.strip()
+        for predicted in timblquery(port, instances()):
+            instance = sent.popleft()
+            out.write(instance + (separator or ' ') + predicted + '\n')
+            total += 1
+            if instance.split(separator)[-1].strip() == predicted:
+                correct += 1
+    with open(logfile,'w',encoding='utf-8') as f:
+        f.write("Classified " + testfile + " on Timbl server (port " + str(port) + ")\n")
+        f.write("overall accuracy:        " + ("%.6f" % (correct / total if total else 0)) + "  (" + str(correct) + "/" + str(total) + ")\n")
+    return correct, total
+
 class Timbl_base(Task):
     executable = 'timbl'
 
@@ -20,6 +105,7 @@ class Timbl_base(Task):
 
 
 class Timbl_train(Timbl_base):
+    modelregistry = True #the instance base is reused whenever the same training data and parameters recur
     in_train = InputSlot() #input slot
 
     def out_ibase(self):
@@ -48,6 +134,9 @@ class Timbl_test(Timbl_base):
     in_wgt = InputSlot()
     in_test = InputSlot()
 
+    server = BoolParameter(default=False) #classify on a pool of persistent Timbl servers, so the instance base is loaded only once for all test files
+    servers = IntParameter(default=1) #number of Timbl servers in the pool
+
     def out_timbl(self):
         return self.outputfrominput(inputformat='test',stripextension='.test',addextension='.timbl.out')
 
@@ -55,6 +144,11 @@ class Timbl_test(Timbl_base):
         return self.outputfrominput(inputformat='test',stripextension='.test',addextension='.timbl.test.log')
 
     def run(self):
+        if self.server:
+            with timblserverpool(self).acquire() as port:
+                timblserverclassify(port, self.in_test().path, self.out_timbl().path, self.out_log().path, self.format)
+            return
+
         self.ex(
             i=self.in_ibase().path,
             t=self.in_test().path,
@@ -66,6 +160,50 @@ class Timbl_test(Timbl_base):
             d=self.distance,
             __stdout_to=self.out_log().path)
 
+class Timbl_shardedtest(Timbl_test):
+    """Like Timbl_test, but splits the test data into shards that are tested in parallel against the same instance base, the output and logs are merged in order"""
+    shards = IntParameter(default=0) #number of shards and concurrent timbl processes (0 = number of CPUs)
+
+    def run(self):
+        shards = self.shards if self.shards > 0 else cpucount()
+        workdir = tempfile.mkdtemp(prefix=os.path.basename(self.out_timbl().path) + '.', dir=os.path.dirname(self.out_timbl().path) or '.')
+        try:
+            parts = splitlines(self.in_test().path, shards, os.path.join(workdir, 'shard'), '.test')
+            if self.server:
+                self.run_server(parts)
+            else:
+                self.run_processes(parts)
+            concatenate([ part[:-5] + '.timbl.out' for part in parts ], self.out_timbl().path)
+            correct, total = mergelogs([ part[:-5] + '.log' for part in parts ], self.out_log().path)
+            log.info("Tested " + str(total) + " instances in " + str(len(parts)) + " shards, accuracy " + str(round(correct / total if total else 0, 4)))
+        finally:
+            shutil.rmtree(workdir)
+
+    def run_processes(self, parts):
+        self.getprocesspool(len(parts))
+        for part in parts:
+            self.ex_async(
+                i=self.in_ibase().path,
+                t=part,
+                w=self.in_wgt().path + ':' + self.weighting,
+                o=part[:-5] + '.timbl.out',
+                a=self.algorithm,
+                k=self.k,
+                m=self.metric,
+                d=self.distance,
+                __stdout_to=part[:-5] + '.log')
+        self.wait_async()
+
+    def run_server(self, parts):
+        """Classifies the shards concurrently on the pool of Timbl servers"""
+        pool = timblserverpool(self)
+        def classify(part):
+            with pool.acquire() as port:
+                return timblserverclassify(port, part, part[:-5] + '.timbl.out', part[:-5] + '.log', self.format)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(parts), self.servers)) as executor:
+            for _ in executor.map(classify, parts): #propagates exceptions
+                pass
+
 
 class Timbl_leaveoneout(Timbl_base):
     in_train = InputSlot()
@@ -125,4 +263,79 @@ class TimblLOOClassifier(StandardWorkflowComponent):
 TimblLOOClassifier.inherit_parameters(Timbl_leaveoneout)
 
 
+class Timbl_crossvalidate(Timbl_base):
+    """k-fold cross-validation on the training data, the folds are trained and tested in parallel, their output and logs are merged in order"""
+    folds = IntParameter(default=10)
+    threads = IntParameter(default=0) #number of concurrent timbl processes (0 = number of CPUs)
+
+    in_train = InputSlot()
+
+    def out_timbl(self):
+        return self.outputfrominput(inputformat='train',stripextension='.train',addextension='.timbl.cv.out')
+
+    def out_log(self):
+        return self.outputfrominput(inputformat='train',stripextension='.train',addextension='.timbl.cv.log')
+
+    def run(self):
+        workdir = tempfile.mkdtemp(prefix=os.path.basename(self.out_timbl().path) + '.', dir=os.path.dirname(self.out_timbl().path) or '.')
+        try:
+            parts = splitlines(self.in_train().path, self.folds, os.path.join(workdir, 'fold'), '.test')
+            self.getprocesspool(self.threads if self.threads > 0 else cpucount())
+            for i, part in enumerate(parts):
+                #train on all other folds
+                concatenate(parts[:i] + parts[i+1:], part[:-5] + '.train')
+                self.ex_async(
+                    f=part[:-5] + '.train',
+                    t=part,
+                    o=part[:-5] + '.timbl.out',
+                    a=self.algorithm,
+                    k=self.k,
+                    m=self.metric,
+                    w=self.weighting,
+                    d=self.distance,
+                    __stdout_to=part[:-5] + '.log')
+            self.wait_async()
+            concatenate([ part[:-5] + '.timbl.out' for part in parts ], self.out_timbl().path)
+            correct, total = mergelogs([ part[:-5] + '.log' for part in parts ], self.out_log().path, 'fold')
+            log.info("Cross-validated " + str(total) + " instances in " + str(len(parts)) + " folds, accuracy " + str(round(correct / total if total else 0, 4)))
+        finally:
+            shutil.rmtree(workdir)
+
+@registercomponent
+class TimblCrossValidator(StandardWorkflowComponent):
+    """A Timbl classifier that performs k-fold cross-validation on the training data, with the folds running in parallel"""
+
+    def accepts(self):
+        return InputFormat(self, format_id='train', extension='train')
+
+    def autosetup(self):
+        return Timbl_crossvalidate
+
+TimblCrossValidator.inherit_parameters(Timbl_crossvalidate)
+
+@registercomponent
+class TimblShardedClassifier(WorkflowComponent):
+    """Like TimblClassifier, but the test data is split into shards that are classified in parallel"""
+
+    trainfile = Parameter()
+    testfile = Parameter()
+
+    def accepts(self):
+        return [ ( InputFormat(self, format_id='train', extension='train',inputparameter='trainfile'), InputFormat(self, format_id='test', extension='test',inputparameter='testfile')) ]
+
+    def setup(self, workflow, input_feeds):
+        timbl_train = workflow.new_task('timbl_train',Timbl_train, autopass=True)
+        timbl_train.in_train = input_feeds['train']
+
+        timbl_test = workflow.new_task('timbl_shardedtest',Timbl_shardedtest, autopass=True)
+        timbl_test.in_test = input_feeds['test']
+        timbl_test.in_ibase = timbl_train.out_ibase
+        timbl_test.in_wgt = timbl_train.out_wgt
+
+        return timbl_test
+
+TimblShardedClassifier.inherit_parameters(Timbl_train)
+TimblShardedClassifier.inherit_parameters(Timbl_shardedtest)
+
+
 
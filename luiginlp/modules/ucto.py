@@ -1,12 +1,13 @@
-import glob
-from luiginlp.engine import Task, registercomponent, StandardWorkflowComponent, InputComponent, InputFormat, InputSlot, Parameter, BoolParameter
-from luiginlp.util import getlog
-from luiginlp.modules.folia import ConvertToFoLiA
+import os
+from luiginlp.engine import Task, registercomponent, StandardWorkflowComponent, InputComponent, InputFormat, InputSlot, Parameter, BoolParameter, IntParameter, PassParameters, stream, componentoutputs
+from luiginlp.util import getlog, scandir_glob
+from luiginlp.modules.folia import ConvertToFoLiA, SplitText, SplitFoLiA, ProcessShards, MergeShards
 
 log = getlog()
 
 class Ucto_txt2folia(Task):
     executable = 'ucto' #external executable (None if n/a)
+    cachebyname = True #the FoLiA ID is derived from the input filename
 
     #Parameters for this module (all mandatory!)
     language = Parameter()
@@ -21,7 +22,8 @@ class Ucto_txt2folia(Task):
         self.ex(self.in_txt().path, self.out_folia().path,
                 L=self.language,
                 m=self.tok_input_sentenceperline,
-                X=True)
+                X=True,
+                id=os.path.basename(self.in_txt().path).split('.')[0]) #first component of input filename (up to first period) will be FoLiA ID
 
 class Ucto_txt2tok(Task):
     executable = 'ucto' #external executable (None if n/a)
@@ -105,9 +107,39 @@ class Ucto(StandardWorkflowComponent):
             InputComponent(self, ConvertToFoLiA))
 
 
+@registercomponent
+class Ucto_sharded(StandardWorkflowComponent):
+    """Ucto for large documents: splits the document into shards of about shardsize bytes (at paragraph boundaries), tokenises the shards in parallel and merges the results into one FoLiA document"""
+
+    language = Parameter()
+    tok_input_sentenceperline = BoolParameter(default=False)
+    shardsize = IntParameter(default=1000000) #size of a shard in bytes
+
+    def setup(self, workflow, input_feeds):
+        if 'txt' in input_feeds:
+            split = workflow.new_task('split', SplitText, shardsize=self.shardsize)
+            split.in_txt = input_feeds['txt']
+        else:
+            split = workflow.new_task('split', SplitFoLiA, shardsize=self.shardsize)
+            split.in_folia = input_feeds['folia']
+        ucto = workflow.new_task('ucto', ProcessShards, component='Ucto', addextension='' if 'txt' in input_feeds else '.tok', passparameters=PassParameters(language=self.language, tok_input_sentenceperline=self.tok_input_sentenceperline))
+        ucto.in_shards = split.out_shards
+        merge = workflow.new_task('merge', MergeShards, renameids='txt' in input_feeds)
+        merge.in_foliadir = ucto.out_foliadir
+        return merge
+
+    def accepts(self):
+        return (
+            InputFormat(self, format_id='folia', extension='folia.xml'),
+            InputFormat(self, format_id='txt', extension='txt'),
+        )
+
+
 class Ucto_txt2folia_dir(Task):
     extension = Parameter(default="txt")
     language = Parameter()
+    window = IntParameter(default=0) #schedule the components for the files in windows of this size rather than all at once (0), for large directories
+    incremental = BoolParameter(default=False) #only process the files that were added or changed since the last successful run, remove the outputs of files that were changed or removed
 
     in_txtdir = InputSlot() #input slot
 
@@ -118,16 +150,33 @@ class Ucto_txt2folia_dir(Task):
         #Set up the output directory, will create it and tear it down on failure automatically
         self.setup_output_dir(self.out_tokfoliadir().path)
 
-        #gather input files
-        inputfiles = [ filename for filename in glob.glob(self.in_txtdir().path + '/*.' + self.extension) ]
+        #gather input files (lazily)
+        inputfiles = scandir_glob(self.in_txtdir().path, '*.' + self.extension)
+        maketask = lambda inputfile: Ucto(inputfile=inputfile,inputslot='txt',outputdir=self.out_tokfoliadir().path,language=self.language)
+
+        if self.incremental:
+            #only the files that were added or changed since the last successful run
+            manifest = self.getmanifest(self.in_txtdir().path)
+            delta = manifest.delta(inputfiles)
+            manifest.invalidate(delta)
+            inputfiles = delta.changed
+
+        #inception aka dynamic dependencies: we yield lists of tasks to perform which could not have been predicted statically
+        #in this case we run the Ucto component for each input file in the directory
+        yield from stream(inputfiles, maketask, self.window, self.task_id)
 
-        #inception aka dynamic dependencies: we yield a list of tasks to perform which could not have been predicted statically
-        #in this case we run the FeaturizerTask_single component for each input file in the directory
-        yield [ Ucto(inputfile=inputfile,inputslot='txt',outputdir=self.out_tokfoliadir().path,language=self.language) for inputfile in inputfiles ]
+        if self.incremental:
+            manifest.commit(delta, lambda inputfile: componentoutputs(maketask(inputfile)))
+
+    def complete(self):
+        #in incremental mode, the output directory is only complete as long as the input directory does not change
+        return super().complete() and (not self.incremental or self.getmanifest(self.in_txtdir().path).unchanged(scandir_glob(self.in_txtdir().path, '*.' + self.extension)))
 
 class Ucto_folia2folia_dir(Task):
     extension = Parameter(default="folia.xml")
     language = Parameter()
+    window = IntParameter(default=0) #schedule the components for the files in windows of this size rather than all at once (0), for large directories
+    incremental = BoolParameter(default=False) #only process the files that were added or changed since the last successful run, remove the outputs of files that were changed or removed
 
     in_foliadir = InputSlot() #input slot
 
@@ -138,12 +187,27 @@ class Ucto_folia2folia_dir(Task):
         #Set up the output directory, will create it and tear it down on failure automatically
         self.setup_output_dir(self.out_tokfoliadir().path)
 
-        #gather input files
-        inputfiles = [ filename for filename in glob.glob(self.in_foliadir().path + '/*.' + self.extension) ]
+        #gather input files (lazily)
+        inputfiles = scandir_glob(self.in_foliadir().path, '*.' + self.extension)
+        maketask = lambda inputfile: Ucto(inputfile=inputfile,inputslot='folia',outputdir=self.out_tokfoliadir().path,language=self.language)
+
+        if self.incremental:
+            #only the files that were added or changed since the last successful run
+            manifest = self.getmanifest(self.in_foliadir().path)
+            delta = manifest.delta(inputfiles)
+            manifest.invalidate(delta)
+            inputfiles = delta.changed
+
+        #inception aka dynamic dependencies: we yield lists of tasks to perform which could not have been predicted statically
+        #in this case we run the Ucto component for each input file in the directory
+        yield from stream(inputfiles, maketask, self.window, self.task_id)
+
+        if self.incremental:
+            manifest.commit(delta, lambda inputfile: componentoutputs(maketask(inputfile)))
 
-        #inception aka dynamic dependencies: we yield a list of tasks to perform which could not have been predicted statically
-        #in this case we run the FeaturizerTask_single component for each input file in the directory
-        yield [ Ucto(inputfile=inputfile,inputslot='folia',outputdir=self.out_tokfoliadir().path,language=self.language) for inputfile in inputfiles ]
+    def complete(self):
+        #in incremental mode, the output directory is only complete as long as the input directory does not change
+        return super().complete() and (not self.incremental or self.getmanifest(self.in_foliadir().path).unchanged(scandir_glob(self.in_foliadir().path, '*.' + self.extension)))
 
 @registercomponent
 class Ucto_dir(StandardWorkflowComponent):
@@ -154,6 +218,8 @@ class Ucto_dir(StandardWorkflowComponent):
     language = Parameter()
     tok_input_sentenceperline = BoolParameter(default=False)
     tok_output_sentenceperline = BoolParameter(default=False)
+    window = IntParameter(default=0) #schedule files in windows of this size (0 = all at once)
+    incremental = BoolParameter(default=False) #only process the files that were added or changed since the last successful run
 
     def autosetup(self):
         return (Ucto_txt2folia_dir, Ucto_folia2folia_dir)
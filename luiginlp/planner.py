@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import json
+import argparse
+import importlib
+import logging
+import luigi
+from luiginlp.engine import Task, WorkflowComponent, InputTask, ParallelBatch, PassParameters, getcomponentclass, summarizemetrics
+from luiginlp.util import getlog, getmetricsfile, readjsonlines, scandir_glob
+
+log = getlog()
+
+class Plan:
+    """The DAG of tasks the specified components (or other luigi tasks) expand into, resolved without running anything: every node records its kind, component, outputs (and whether they exist) and, given historical metrics, an estimate of its wall time. ParallelBatch, which only schedules its components when it runs, is expanded into those components"""
+
+    def __init__(self, tasks, metrics=None):
+        self.nodes = [] #list of dictionaries, in topological order (upstream first)
+        self.edges = [] #(upstream index, downstream index) tuples
+        self.index = {} #task_id => index in self.nodes
+        self.estimates = estimates(metrics) if metrics is not None else {}
+        for task in tasks:
+            self.visit(task)
+
+    def visit(self, task):
+        if task.task_id in self.index:
+            return self.index[task.task_id]
+        if isinstance(task, ParallelBatch):
+            dependencies = task.components(task.getinputfiles())
+        else:
+            dependencies = luigi.task.flatten(task.requires())
+        upstream = [ self.visit(dependency) for dependency in dependencies ]
+        if isinstance(task, WorkflowComponent):
+            kind = 'component'
+        elif isinstance(task, InputTask):
+            kind = 'input'
+        elif isinstance(task, Task):
+            kind = 'task'
+        else:
+            kind = 'meta'
+        component = task.workflow_task.__class__.__name__ if isinstance(getattr(task, 'workflow_task', None), luigi.Task) else ''
+        if kind == 'component':
+            outputs = [] #only the audit log of the run
+        else:
+            outputs = [ {'path': target.path, 'exists': os.path.exists(target.path)} for target in luigi.task.flatten(task.output()) if hasattr(target, 'path') ]
+        complete = bool(outputs) and all( output['exists'] for output in outputs )
+        if not complete and kind in ('component', 'meta') and upstream:
+            complete = all( self.nodes[i]['complete'] for i in upstream ) #complete as soon as everything it runs is
+        node = {
+            'id': len(self.nodes),
+            'task_id': task.task_id,
+            'family': task.__class__.__name__,
+            'kind': kind,
+            'component': component,
+            'outputs': outputs,
+            'complete': complete,
+            'estimate': self.estimate(component, task.__class__.__name__) if kind == 'task' else 0.0,
+        }
+        self.index[task.task_id] = node['id']
+        self.nodes.append(node)
+        for i in upstream:
+            self.edges.append((i, node['id']))
+        return node['id']
+
+    def estimate(self, component, family):
+        """Returns the estimated wall time of a task: the mean of earlier runs of the same task in the same component, or in any component, or None if there are none"""
+        if (component, family) in self.estimates:
+            return self.estimates[(component, family)]
+        return self.estimates.get(('', family))
+
+    def summary(self, workers=1):
+        """Returns a summary of the plan: the number of tasks per family (pending and complete), the estimated total wall time of the pending tasks, the critical path (the longest chain of pending tasks, a lower bound on the run time) and the estimated run time for the specified number of workers"""
+        families = {}
+        for node in self.nodes:
+            counts = families.setdefault(node['family'], {'kind': node['kind'], 'pending': 0, 'complete': 0})
+            counts['complete' if node['complete'] else 'pending'] += 1
+        pending = [ node for node in self.nodes if not node['complete'] and node['kind'] == 'task' ]
+        unestimated = sorted(set( node['family'] for node in pending if node['estimate'] is None ))
+        total = sum( node['estimate'] or 0.0 for node in pending )
+        #longest path over the DAG, nodes are in topological order
+        upstream = {}
+        for i, j in self.edges:
+            upstream.setdefault(j, []).append(i)
+        path = []
+        for node in self.nodes:
+            cost = 0.0 if node['complete'] else (node['estimate'] or 0.0)
+            path.append(cost + max( [ path[i] for i in upstream.get(node['id'], ()) ] + [0.0] ))
+        criticalpath = max(path + [0.0])
+        return {
+            'nodes': len(self.nodes),
+            'edges': len(self.edges),
+            'families': families,
+            'pending': len(pending),
+            'estimated_total': total,
+            'critical_path': criticalpath,
+            'estimated_runtime': max(criticalpath, total / max(workers,1)),
+            'unestimated': unestimated,
+        }
+
+    def json(self, workers=1):
+        return json.dumps({'nodes': self.nodes, 'edges': self.edges, 'summary': self.summary(workers)}, indent=1)
+
+    def dot(self):
+        """Returns the plan in the DOT language (graphviz): components as boxes, input files as ellipses, complete nodes greyed out"""
+        lines = ['digraph plan {', '    rankdir=LR;']
+        for node in self.nodes:
+            label = node['family']
+            if node['kind'] == 'input' and node['outputs']:
+                label = os.path.basename(node['outputs'][0]['path'])
+            elif node['estimate']:
+                label += "\\n~" + str(round(node['estimate'],2)) + "s"
+            attributes = ['label="' + label.replace('"', '\\"') + '"', 'shape=' + {'component': 'box', 'input': 'ellipse', 'task': 'box, style=rounded', 'meta': 'box, style=dashed'}[node['kind']]]
+            if node['complete']:
+                attributes.append('color=grey, fontcolor=grey')
+            lines.append('    n' + str(node['id']) + ' [' + ', '.join(attributes) + '];')
+        for i, j in self.edges:
+            lines.append('    n' + str(i) + ' -> n' + str(j) + ';')
+        lines.append('}')
+        return "\n".join(lines) + "\n"
+
+    def text(self, workers=1):
+        summary = self.summary(workers)
+        lines = []
+        for family, counts in sorted(summary['families'].items(), key=lambda x: (x[1]['kind'], x[0])):
+            lines.append(counts['kind'] + "\t" + family + "\t" + str(counts['pending']) + " pending, " + str(counts['complete']) + " complete")
+        lines.append(str(summary['nodes']) + " nodes, " + str(summary['edges']) + " edges, " + str(summary['pending']) + " tasks to run")
+        lines.append("estimated total wall time " + str(round(summary['estimated_total'],2)) + "s, critical path " + str(round(summary['critical_path'],2)) + "s, estimated run time with " + str(workers) + " worker(s) " + str(round(summary['estimated_runtime'],2)) + "s")
+        if summary['unestimated']:
+            lines.append("no metrics for: " + ", ".join(summary['unestimated']))
+        return "\n".join(lines) + "\n"
+
+def estimates(records):
+    """Returns the mean wall time per (component, task) from metrics records (see Task.writemetrics()), and per ('', task) over all components. Runs restored from the output cache are left out, they say nothing about the cost of a task"""
+    summary = summarizemetrics( record for record in records if record['status'] == 'success' and not record.get('cached') )
+    means = {}
+    pertask = {}
+    for (component, family), totals in summary.items():
+        means[(component, family)] = totals['walltime'] / totals['tasks']
+        walltime, tasks = pertask.get(family, (0.0, 0))
+        pertask[family] = (walltime + totals['walltime'], tasks + totals['tasks'])
+    for family, (walltime, tasks) in pertask.items():
+        means[('', family)] = walltime / tasks
+    return means
+
+def plan(*tasks, metrics=None):
+    """Plans the specified components (or other luigi tasks) without running them, returns a Plan. Estimates are based on the metrics file (see luiginlp.util.getmetricsfile()) unless another one is specified"""
+    if metrics is None:
+        metrics = getmetricsfile()
+    return Plan(tasks, readjsonlines(metrics) if metrics else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shows what running a component on a set of input files involves, without running anything: the tasks it expands into, which outputs already exist and, based on the metrics of earlier runs, how long it will take", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--module', type=str, help="Python module containing the component (not needed for the components in LuigiNLP's own modules)", action='store', default="")
+    parser.add_argument('--component', type=str, help="Component to run on every input file", action='store', required=True)
+    parser.add_argument('--inputfiles', type=str, help="Input files (comma separated)", action='store', default="")
+    parser.add_argument('--directory', type=str, help="Directory with input files", action='store', default="")
+    parser.add_argument('--pattern', type=str, help="Pattern for input files in the directory", action='store', default="*")
+    parser.add_argument('--passparameters', type=str, help="Parameters to pass to the component (JSON)", action='store', default="{}")
+    parser.add_argument('--format', type=str, help="Output format: text (summary), json or dot", action='store', choices=('text','json','dot'), default='text')
+    parser.add_argument('--metrics', type=str, help="Metrics of earlier runs (JSON lines), defaults to the metrics file of runs (LUIGINLP_METRICS)", action='store', default=None)
+    parser.add_argument('--workers', type=int, help="Number of workers, for the run time estimate", action='store', default=1)
+    parser.add_argument('--maxtasks', type=int, help="Exit with status 2 if the plan has more tasks to run than this (0 = no limit)", action='store', default=0)
+    args = parser.parse_args()
+
+    log.setLevel(logging.WARNING)
+    if args.module:
+        importlib.import_module(args.module)
+    if args.inputfiles:
+        inputfiles = args.inputfiles.split(',')
+    elif args.directory:
+        inputfiles = sorted(scandir_glob(args.directory, args.pattern))
+    else:
+        parser.error("Specify --inputfiles or --directory")
+    ComponentClass = getcomponentclass(args.component)
+    passparameters = PassParameters(json.loads(args.passparameters))
+    workflowplan = plan(*[ ComponentClass(inputfile=inputfile, **passparameters) for inputfile in inputfiles ], metrics=args.metrics)
+    if args.format == 'json':
+        print(workflowplan.json(args.workers))
+    elif args.format == 'dot':
+        print(workflowplan.dot(), end="")
+    else:
+        print(workflowplan.text(args.workers), end="")
+    if args.maxtasks and workflowplan.summary()['pending'] > args.maxtasks:
+        log.error("Plan has " + str(workflowplan.summary()['pending']) + " tasks to run, more than " + str(args.maxtasks))
+        sys.exit(2)
+
+if __name__ == '__main__':
+    main()
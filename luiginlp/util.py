@@ -1,8 +1,21 @@
 import os
+import sys
+import ast
 import shutil
 import glob
 import fnmatch
+import collections
 import logging
+import fcntl
+import hashlib
+import http.client
+import json
+import selectors
+import signal
+import socket
+import subprocess
+import tempfile
+import time
 
 DISALLOWINSHELLSAFE = ('|','&',';','!','<','>','{','}','`','\n','\r','\t')
 
@@ -11,6 +24,24 @@ def getlog():
 
 log = getlog()
 
+def getstatedir():
+    """Returns the directory where LuigiNLP keeps its state (markers, server registry, etc), configurable through the LUIGINLP_STATEDIR environment variable (or the statedir keyword argument to run())"""
+    return os.environ.get('LUIGINLP_STATEDIR', '.luiginlp')
+
+def setenviron(saved, variable, value):
+    """Sets an environment variable for the duration of a run, its previous value is recorded in saved so restoreenviron() can put it back"""
+    saved.setdefault(variable, os.environ.get(variable))
+    os.environ[variable] = value
+
+def restoreenviron(saved):
+    """Restores the environment variables recorded by setenviron()"""
+    for variable, value in saved.items():
+        if value is None:
+            os.environ.pop(variable, None)
+        else:
+            os.environ[variable] = value
+    saved.clear()
+
 def replaceextension(filename, oldextensions, newextension):
     if newextension[0] != '.':
         newextension = '.' + newextension
@@ -24,21 +55,17 @@ def replaceextension(filename, oldextensions, newextension):
     return filename + newextension
 
 def escape(s, quote):
-    s2 = ""
+    s2 = []
+    escapes = 0 #number of consecutive backslashes preceding the current character (not counting the first character of the string)
     for i, c in enumerate(s):
-        if c == quote:
+        if c == quote and escapes % 2 == 0: #even number of escapes, we need another one
+            s2.append("\\")
+        s2.append(c)
+        if c == "\\" and i > 0:
+            escapes += 1
+        else:
             escapes = 0
-            j = i - 1
-            while j > 0:
-                if s[j] == "\\":
-                    escapes += 1
-                else:
-                    break
-                j -= 1
-            if escapes % 2 == 0: #even number of escapes, we need another one
-                s2 += "\\"
-        s2 += c
-    return s2
+    return "".join(s2)
 
 def shellsafe(s, quote="'", doescape=True):
     """Returns the value string, wrapped in the specified quotes (if not empty), but checks and raises an Exception if the string is at risk of causing code injection"""
@@ -100,31 +127,1093 @@ def recursive_glob(treeroot, pattern):
 
 
 def waitforslot(pids, threads):
+    """Blocks until fewer than the specified number of child processes (pids) are running, returns the pids still running. Not used by LuigiNLP itself any more (tasks use ex_async() and their process pool), kept for external callers"""
+    pids = list(pids)
     while len(pids) >= threads:
-        newpids = []
-        for pid in pids:
-            try:
-                os.kill(pid, 0) #checks if process still running, does not kill
-                newpids.append(pid)
-            except:
-                pass
-        pids = newpids
+        pid, _, _, _ = waitforany(pids)
+        pids.remove(pid)
     return pids
 
 def waitforcompletion(pids):
-    while len(pids) >= 0:
-        newpids = []
+    """Blocks until all specified child processes have finished. Not used by LuigiNLP itself any more, kept for external callers (see waitforslot())"""
+    pids = list(pids)
+    while pids:
+        pid, _, _, _ = waitforany(pids)
+        pids.remove(pid)
+
+def waitforany(pids, timeout=None):
+    """Blocks until any of the specified child processes exits, and reaps it. Returns a (pid, returncode, resource usage, I/O counters) tuple (see reap()), or None if a timeout (in seconds) is specified and expires first"""
+    pids = list(pids)
+    if not pids:
+        raise ValueError("No processes to wait for")
+    if len(pids) == 1 and timeout is None:
+        return reap(pids[0])
+    if hasattr(os, 'pidfd_open'):
+        with selectors.DefaultSelector() as selector:
+            try:
+                for pid in pids:
+                    try:
+                        selector.register(os.pidfd_open(pid), selectors.EVENT_READ, pid)
+                    except ProcessLookupError: #already gone
+                        return reap(pid)
+                ready = selector.select(timeout)
+                if not ready:
+                    return None
+                return reap(ready[0][0].data)
+            finally:
+                for key in list(selector.get_map().values()):
+                    os.close(key.fd)
+    #no pidfd support on this platform, poll without reaping other children
+    endtime = time.time() + timeout if timeout is not None else None
+    while True:
         for pid in pids:
             try:
-                os.kill(pid, 0) #checks if process still running, does not kill
-                newpids.append(pid)
-            except:
+                if os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None:
+                    return reap(pid)
+            except ChildProcessError:
+                return pid, None, None, None
+        if endtime is not None and time.time() >= endtime:
+            return None
+        time.sleep(0.01)
+
+def reap(pid):
+    """Blocks until the child process exits and reaps it. Returns a (pid, returncode, resource usage, I/O counters) tuple, see procio() for the latter. Returncode is None if the process was already reaped elsewhere"""
+    try:
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT) #wait without reaping yet, the I/O counters are gone after that
+    except ChildProcessError:
+        return pid, None, None, None
+    io = procio(pid)
+    try:
+        _, status, rusage = os.wait4(pid, 0)
+    except ChildProcessError:
+        return pid, None, None, None
+    return pid, exitcode(status), rusage, io
+
+def procio(pid):
+    """Returns the I/O counters of a process (including its finished children) as a dictionary (rchar, wchar, read_bytes, write_bytes etc, see proc(5)), or None if not available on this platform"""
+    try:
+        with open('/proc/' + str(pid) + '/io','r',encoding='ascii') as f:
+            return { key: int(value) for key, value in ( line.split(':') for line in f if ':' in line ) }
+    except (OSError, ValueError):
+        return None
+
+def processusage(walltime, rusage, io):
+    """Summarises the resource usage of a finished process as a dictionary: wall time, user and system CPU time (seconds), peak resident set size (KiB) and I/O (bytes read and written, through system calls and from/to storage)"""
+    usage = {'walltime': walltime}
+    if rusage is not None:
+        usage.update(user=rusage.ru_utime, sys=rusage.ru_stime, maxrss=rusage.ru_maxrss)
+    if io is not None:
+        for key in ('rchar','wchar','read_bytes','write_bytes'):
+            usage[key] = io.get(key,0)
+    return usage
+
+def exitcode(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    else:
+        return os.WEXITSTATUS(status)
+
+ARG_MAX = os.sysconf('SC_ARG_MAX') #maximum size of the arguments plus environment of a new process
+
+def argvsize(argv):
+    """Returns the number of bytes an argument vector occupies when passed to a new process (the strings plus a pointer to each)"""
+    return sum( len(os.fsencode(arg)) + 1 + 8 for arg in argv )
+
+def argvlimit():
+    """Returns the number of bytes available for the arguments of a new process, taking the size of the environment into account"""
+    return ARG_MAX - argvsize( key + '=' + value for key, value in os.environ.items() ) - 4096 #some margin
+
+def openredirects(stdin_from=None, stdout_to=None, stderr_to=None):
+    """Opens the files to redirect standard input, output and error from/to, returns a dictionary of keyword arguments for subprocess.Popen. Close the files (closeredirects()) once the process(es) started"""
+    redirects = {}
+    try:
+        if stdin_from is not None:
+            redirects['stdin'] = open(stdin_from,'rb')
+        if stdout_to is not None:
+            redirects['stdout'] = open(stdout_to,'wb')
+        if stderr_to is not None:
+            redirects['stderr'] = open(stderr_to,'wb')
+    except OSError:
+        closeredirects(redirects)
+        raise
+    return redirects
+
+def closeredirects(redirects):
+    for f in redirects.values():
+        f.close()
+
+def execute(argv, **kwargs):
+    """Executes a command, given as a list of arguments, without a shell, and waits for it. Keyword arguments are passed to subprocess.Popen; standard output and error are captured unless redirected. Returns (returncode, stdout, stderr, usage), see processusage() for the latter"""
+    captured = {}
+    for stream in ('stdout','stderr'):
+        if stream not in kwargs:
+            kwargs[stream] = captured[stream] = tempfile.TemporaryFile() #rather than a pipe, so we can wait for the process ourselves
+    try:
+        begintime = time.time()
+        try:
+            popen = subprocess.Popen(argv, **kwargs)
+        except FileNotFoundError:
+            return 127, '', argv[0] + ": command not found", {} #same as the shell would report
+        _, returncode, rusage, io = reap(popen.pid)
+        popen.returncode = returncode #we reaped the process ourselves, let Popen know
+        usage = processusage(time.time() - begintime, rusage, io)
+        output = {}
+        for stream in ('stdout','stderr'):
+            if stream in captured:
+                captured[stream].seek(0)
+                output[stream] = str(captured[stream].read(),'utf-8',errors='replace')
+            else:
+                output[stream] = ''
+        return returncode, output['stdout'], output['stderr'], usage
+    finally:
+        closeredirects(captured)
+
+class PoolProcess:
+    """A process in a ProcessPool"""
+
+    def __init__(self, popen, cmd, owner=None, ignorefailure=False):
+        self.popen = popen
+        self.pid = popen.pid
+        self.cmd = cmd
+        self.owner = owner
+        self.ignorefailure = ignorefailure
+        self.returncode = None
+        self.rusage = None
+        self.io = None
+        self.slot = None #lock on a machine-wide slot (see Slots), if any
+        self.begintime = time.time()
+        self.endtime = None
+
+    def done(self, returncode, rusage, io=None):
+        self.returncode = returncode
+        self.popen.returncode = returncode #we reaped the process ourselves, let Popen know
+        self.rusage = rusage
+        self.io = io
+        self.endtime = time.time()
+
+    def usage(self):
+        """Returns the resource usage of the (finished) process, see processusage()"""
+        return processusage(self.walltime, self.rusage, self.io)
+
+    @property
+    def failed(self):
+        return self.returncode != 0 and not self.ignorefailure
+
+    @property
+    def walltime(self):
+        return (self.endtime or time.time()) - self.begintime
+
+    def __str__(self):
+        s = "pid " + str(self.pid) + ": " + str(self.cmd)
+        if self.returncode is not None:
+            s += " (returncode " + str(self.returncode) + ", " + str(round(self.walltime,2)) + "s"
+            if self.rusage:
+                s += ", user " + str(round(self.rusage.ru_utime,2)) + "s, sys " + str(round(self.rusage.ru_stime,2)) + "s, maxrss " + str(self.rusage.ru_maxrss) + "KiB"
+            s += ")"
+        return s
+
+class ProcessPool:
+    """Runs external processes concurrently, at most the specified number at the same time. Waiting is blocking (no polling), the exit status and resource usage of all processes are collected.
+
+    If slots (a Slots instance) are specified, each process additionally holds one of these machine-wide slots whilst it runs, which bounds the number of processes across all pools (and worker processes) sharing them."""
+
+    def __init__(self, threads=1, slots=None):
+        self.threads = max(1,int(threads))
+        self.slots = slots
+        self.running = {} #pid => PoolProcess
+        self.finished = []
+
+    def submit(self, cmd, owner=None, ignorefailure=False, **kwargs):
+        """Launch a process, blocks first if the maximum number of processes is already running. The command is a string (executed through the shell) or a list of arguments; keyword arguments are passed to subprocess.Popen. Returns a PoolProcess"""
+        self.waitforslot()
+        slot = self.acquireslot()
+        try:
+            popen = subprocess.Popen(cmd, shell=isinstance(cmd, str), **kwargs)
+        except:
+            if slot is not None:
+                self.slots.release(slot)
+            raise
+        process = PoolProcess(popen, cmd, owner, ignorefailure)
+        process.slot = slot
+        self.running[process.pid] = process
+        return process
+
+    def waitforslot(self):
+        while len(self.running) >= self.threads:
+            self.waitforany()
+
+    def acquireslot(self):
+        """Acquires a machine-wide slot (if slots are used), blocks until one is available"""
+        if self.slots is None:
+            return None
+        slot = self.slots.tryacquire()
+        while slot is None:
+            if self.running:
+                self.waitforany() #one of our own processes releases a slot when it finishes
+                slot = self.slots.tryacquire()
+            else:
+                slot = self.slots.acquire() #all slots are held by others, block
+        return slot
+
+    def waitforany(self, timeout=None):
+        """Blocks until one of the running processes finishes, returns it. Returns None if a timeout (in seconds) is specified and expires first"""
+        result = waitforany(self.running.keys(), timeout)
+        if result is None:
+            return None
+        pid, returncode, rusage, io = result
+        process = self.running.pop(pid)
+        process.done(returncode, rusage, io)
+        if process.slot is not None:
+            self.slots.release(process.slot)
+            process.slot = None
+        if process.returncode != 0:
+            log.error("Process failed: " + str(process))
+        else:
+            log.debug("Process finished: " + str(process))
+        self.finished.append(process)
+        return process
+
+    def wait(self):
+        """Blocks until all processes are finished, returns a list of all finished processes"""
+        while self.running:
+            self.waitforany()
+        return self.finished
+
+    def failures(self):
+        return [ process for process in self.finished if process.failed ]
+
+    def terminate(self):
+        """Terminate all running processes"""
+        for process in list(self.running.values()):
+            try:
+                process.popen.terminate()
+            except OSError:
                 pass
-        pids = newpids
+        self.wait()
+
+    def __len__(self):
+        return len(self.running)
+
+def cpucount():
+    """Returns the number of CPUs available to this process"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError: #not available on this platform
+        return os.cpu_count() or 1
+
+def getslotsdir():
+    """Returns the directory with the lock files of the machine-wide slots (see Slots). This is a fixed location per user, independent of the state directory (which is relative to the current directory by default), so all workers of the user share it wherever they were started: $XDG_RUNTIME_DIR/luiginlp/slots, or /tmp/luiginlp-$UID/slots if XDG_RUNTIME_DIR is not set"""
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        basedir = os.path.join(os.environ['XDG_RUNTIME_DIR'], 'luiginlp')
+    else:
+        basedir = os.path.join(tempfile.gettempdir(), 'luiginlp-' + str(os.getuid()))
+    os.makedirs(basedir, mode=0o700, exist_ok=True)
+    return os.path.join(basedir, 'slots')
+
+class Slots:
+    """A fixed number of machine-wide slots, implemented as lock files in a fixed per-user directory (see getslotsdir()), to bound the number of concurrent processes of a kind across all processes (e.g. luigi workers) of the user on this machine. Defaults to one slot per CPU"""
 
+    def __init__(self, name, size=None):
+        self.size = max(1,int(size)) if size else cpucount()
+        self.directory = os.path.join(getslotsdir(), name)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def open(self, slot):
+        return open(os.path.join(self.directory, str(slot) + '.lock'),'w')
+
+    def tryacquire(self):
+        """Acquires a free slot, returns its lock (to pass to release()), or None if all slots are taken"""
+        for slot in range(self.size):
+            lock = self.open(slot)
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock.close()
+                continue
+            return lock
+        return None
+
+    def acquire(self):
+        """Acquires a slot, blocks until one is available. Never call this whilst holding a slot yourself"""
+        lock = self.tryacquire()
+        if lock is None:
+            lock = self.open(os.getpid() % self.size)
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def release(self, lock):
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
 
 def chunk(lst, n):
     l = len(lst)
     for i in range(0,l,n):
         yield lst[i:i+n]
 
+def windowed(iterable, n):
+    """Like chunk(), but for any iterable (e.g. a generator): yields lists of at most n items, without materialising the iterable"""
+    window = []
+    for item in iterable:
+        window.append(item)
+        if len(window) >= n:
+            yield window
+            window = []
+    if window:
+        yield window
+
+def getworkers():
+    """Returns the total number of luigi workers (over all worker processes) of the current run, set by run() through the LUIGINLP_WORKERS environment variable"""
+    return max(1,int(os.environ.get('LUIGINLP_WORKERS', 1)))
+
+def getrun():
+    """Returns an identifier of the current run, set by run() through the LUIGINLP_RUN environment variable so the processes luigi forks for its workers share it (empty outside of run())"""
+    return os.environ.get('LUIGINLP_RUN', '')
+
+class AdaptiveChunker:
+    """Splits a list of items (e.g. input files) into chunks whose size adapts to the measured cost of the chunks before them, to wrap in a ParallelBatch each, rather than chunks of a fixed size: too small and the scheduler round trip of every chunk dominates, too large and a single chunk takes hours. Iterate over it in a task's run() method and yield a ParallelBatch per chunk; the first chunk is small, the wall time of every chunk (measured until the task is resumed) is fitted linearly (overhead + cost per item) and subsequent chunks are sized to take about target seconds. Sizes are multiples of the number of workers and the remainder of the items is never left as a small straggler chunk.
+
+    Luigi restarts run() after every yielded dependency, so the chunks handed out so far and their wall times are kept in the state directory: a restarted run() gets exactly the same chunks again (which are complete by then, so luigi passes them right away) and only the chunk that follows is sized anew"""
+
+    def __init__(self, items, key, target=60.0, initial=0, maxsize=100000, growth=4, workers=0):
+        self.items = list(items)
+        self.target = target #target wall time per chunk (seconds)
+        self.workers = workers if workers > 0 else getworkers()
+        self.initial = initial if initial > 0 else 2 * self.workers #size of the first chunk
+        self.maxsize = maxsize
+        self.growth = growth #maximum factor by which a chunk may be larger than the one before
+        digest = hashlib.sha1((key + "\n" + "\n".join(self.items)).encode('utf-8')).hexdigest()
+        self.statefile = os.path.join(getstatedir(), 'progress', 'chunks-' + digest + '.json')
+        self.chunks = [] #dictionaries with begin, end, begintime, run and walltime (None until measured, -1 if it can not be measured)
+
+    def load(self):
+        if os.path.exists(self.statefile):
+            with open(self.statefile,'r',encoding='utf-8') as f:
+                self.chunks = json.load(f)
+        else:
+            self.chunks = []
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.statefile), exist_ok=True)
+        with open(self.statefile + '.tmp','w',encoding='utf-8') as f:
+            json.dump(self.chunks, f)
+        os.replace(self.statefile + '.tmp', self.statefile)
+
+    def fit(self):
+        """Fits the wall times of the measured chunks to overhead + size * cost per item (least squares), returns (overhead, cost per item), or None if nothing has been measured yet"""
+        measured = [ (chunk['end'] - chunk['begin'], chunk['walltime']) for chunk in self.chunks if chunk['walltime'] is not None and chunk['walltime'] >= 0 ]
+        if not measured:
+            return None
+        n = len(measured)
+        meansize = sum( size for size, _ in measured ) / n
+        meantime = sum( walltime for _, walltime in measured ) / n
+        variance = sum( (size - meansize) ** 2 for size, _ in measured )
+        if variance > 0:
+            cost = sum( (size - meansize) * (walltime - meantime) for size, walltime in measured ) / variance
+            overhead = meantime - cost * meansize
+            if cost > 0 and overhead >= 0:
+                return overhead, cost
+        #a single size measured, or too noisy to separate the overhead: attribute everything to the items (sizes err on the small side)
+        return 0.0, max(meantime / meansize, 1e-6)
+
+    def nextsize(self, remaining):
+        """Returns the size of the next chunk, given the number of remaining items"""
+        model = self.fit()
+        previous = self.chunks[-1]['end'] - self.chunks[-1]['begin'] if self.chunks else 0
+        if model is None:
+            size = self.initial
+        else:
+            overhead, cost = model
+            if overhead < self.target:
+                size = int((self.target - overhead) / cost)
+            else:
+                size = self.maxsize #the overhead alone exceeds the target, only larger chunks amortise it
+            log.info("Chunks take " + str(round(overhead,2)) + "s overhead and " + str(round(cost,4)) + "s per item")
+        if previous:
+            size = min(size, previous * self.growth)
+        size = min(max(size, 1), self.maxsize)
+        size = -(-size // self.workers) * self.workers #round up to a multiple of the number of workers
+        if remaining - size < size // 2:
+            size = remaining #no small straggler chunk at the end
+        return size
+
+    def __iter__(self):
+        self.load()
+        begin = 0
+        for chunk in self.chunks: #chunks handed out before luigi restarted run()
+            yield self.items[chunk['begin']:chunk['end']]
+            if chunk['walltime'] is None:
+                #a chunk handed out by an earlier (interrupted) run says nothing about its cost; luigi runs every resumption of run() in a process of its own if there are multiple workers, so the run is what counts, not the process
+                chunk['walltime'] = time.time() - chunk['begintime'] if chunk.get('run') == getrun() else -1
+                self.save()
+            begin = chunk['end']
+        while begin < len(self.items):
+            size = self.nextsize(len(self.items) - begin)
+            chunk = {'begin': begin, 'end': begin + size, 'begintime': time.time(), 'run': getrun(), 'walltime': None}
+            self.chunks.append(chunk)
+            self.save()
+            yield self.items[chunk['begin']:chunk['end']]
+            chunk['walltime'] = time.time() - chunk['begintime']
+            self.save()
+            begin = chunk['end']
+        if os.path.exists(self.statefile):
+            os.unlink(self.statefile)
+
+def scandir_glob(directory, pattern='*', recursive=False):
+    """Generator over all files in the directory that match the glob pattern, in directory order. Uses os.scandir() so the directory listing is never held in memory entirely. A pattern with a directory part (e.g. sub/*.txt) is matched by glob instead, as only the entry names are matched otherwise"""
+    if os.sep in pattern or (os.altsep and os.altsep in pattern):
+        yield from glob.iglob(os.path.join(directory, pattern), recursive=recursive)
+        return
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.name[0] == '.' and pattern[0] != '.':
+                    continue #hidden files are skipped, as glob does
+                if recursive and entry.is_dir():
+                    stack.append(entry.path)
+                elif fnmatch.fnmatch(entry.name, pattern):
+                    yield entry.path
+
+EXISTING = {} #directory => set of the names in it, see prefetchexistence()
+PREFETCHTHRESHOLD = 16 #minimum number of files in a directory to list it rather than check them one by one
+
+def prefetchexistence(filenames, listed=False):
+    """Lists the directories of the specified files once, rather than checking every file separately, so fileexists() can answer for them from memory. If listed is True, the files are known to exist (they come from a directory listing) and are recorded as such directly. The listings are kept until clearexistence() is called (at the start and end of every run)"""
+    directories = {}
+    for filename in filenames:
+        directories.setdefault(os.path.dirname(filename), []).append(filename)
+    for directory, files in directories.items():
+        if listed:
+            EXISTING.setdefault(directory, set()).update( os.path.basename(filename) for filename in files )
+        elif directory not in EXISTING and len(files) >= PREFETCHTHRESHOLD:
+            try:
+                EXISTING[directory] = set(os.listdir(directory if directory else '.'))
+            except OSError:
+                pass
+
+def fileexists(path):
+    """Like os.path.exists(), but answered from the listings gathered by prefetchexistence() where possible. Files that were not listed (e.g. created since) are checked on the filesystem"""
+    if EXISTING:
+        directory, name = os.path.split(path)
+        if name in EXISTING.get(directory, ()):
+            return True
+    return os.path.exists(path)
+
+def clearexistence():
+    EXISTING.clear()
+
+def splitlines(filename, n, prefix, extension=''):
+    """Splits a file into at most n parts of roughly equal size, at line boundaries, streaming (the file is never loaded into memory). Part i is written to prefix + i + extension, returns the list of parts in order (fewer than n if there are fewer lines)"""
+    size = os.path.getsize(filename)
+    parts = []
+    with open(filename,'rb') as f:
+        begin = 0
+        for i in range(1,n+1):
+            if begin >= size:
+                break
+            if i == n:
+                end = size
+            else:
+                #move to the end of the line that the target offset is on
+                f.seek(max(begin, size * i // n - 1))
+                f.readline()
+                end = f.tell()
+            part = prefix + str(i) + extension
+            f.seek(begin)
+            with open(part,'wb') as out:
+                copybytes(f, out, end - begin)
+            parts.append(part)
+            begin = end
+    return parts
+
+def splitparagraphs(filename, size, prefix, extension=''):
+    """Splits a text file into parts of about the specified size (in bytes), at paragraph boundaries (empty lines), streaming. A paragraph is only split itself (at a line boundary) once a part has grown to twice the size. Part i is written to prefix + i + extension (counting from 1), returns the list of parts in order"""
+    parts = []
+    out = None
+    try:
+        with open(filename,'rb') as f:
+            for line in f:
+                if out is None:
+                    parts.append(prefix + str(len(parts)+1) + extension)
+                    out = open(parts[-1],'wb')
+                    written = 0
+                out.write(line)
+                written += len(line)
+                if written >= size and (not line.strip() or written >= 2 * size):
+                    out.close()
+                    out = None
+    finally:
+        if out is not None:
+            out.close()
+    return parts
+
+def copybytes(source, target, length, buffersize=1024*1024):
+    """Copies length bytes from one open file to another"""
+    while length > 0:
+        data = source.read(min(length, buffersize))
+        if not data:
+            break
+        target.write(data)
+        length -= len(data)
+
+def concatenate(filenames, outputfile):
+    """Concatenates the files into the output file, in the specified order"""
+    with open(outputfile,'wb') as out:
+        for filename in filenames:
+            with open(filename,'rb') as f:
+                shutil.copyfileobj(f, out)
+
+class ServerPool:
+    """A pool of long-lived server processes (e.g. Frog or Timbl in server mode), listening on a TCP port, that are shared by all tasks running the same command.
+
+    Servers are started on demand and registered in the state directory (per host, with the run that started or last used them), so they outlive the (forked) worker process that started them and are reused by subsequent tasks. Call shutdownservers() to stop them (run() does so for the servers of its own run when the workflow completes).
+
+    The command is a list of arguments, where the string ``{port}`` will be replaced by the port to listen on."""
+
+    def __init__(self, name, command, size=1, startuptimeout=600, logfile=None, key=None):
+        self.name = name
+        self.command = list(command)
+        self.size = max(1,int(size))
+        self.startuptimeout = startuptimeout
+        self.logfile = logfile
+        #servers with the same key are interchangeable, by default those with the same command
+        digest = hashlib.sha1((key if key else "\0".join(self.command)).encode('utf-8')).hexdigest()[:16]
+        self.directory = os.path.join(getserversdir(), name + '-' + digest)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def acquire(self):
+        """Acquire a server from the pool (starting it if needed), blocks until one is available. Returns a context manager that yields the port of the server and releases it again on exit"""
+        for slot in range(self.size):
+            lock = open(os.path.join(self.directory, str(slot) + '.lock'),'w')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock.close()
+                continue
+            return ServerSlot(self, slot, lock)
+        #all servers are busy, wait for one
+        slot = os.getpid() % self.size
+        lock = open(os.path.join(self.directory, str(slot) + '.lock'),'w')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return ServerSlot(self, slot, lock)
+
+    def start(self, slot):
+        """Returns the port of the server in the specified slot, starting the server first if it is not running yet. Only call this whilst holding the slot's lock"""
+        statefile = os.path.join(self.directory, str(slot) + '.json')
+        state = readserverstate(statefile)
+        if state is not None and isserver(state):
+            if portopen(state['port']):
+                if state['run'] != getrun(): #the server is now used by this run, which will stop it when it is done with it
+                    state['run'] = getrun()
+                    writeserverstate(statefile, state)
+                return state['port']
+            stopserver(state['pid']) #running but not listening, hung
+        #otherwise the registration is stale (the pid may belong to another process by now), it is replaced
+        port = freeport()
+        cmd = [ arg.replace('{port}', str(port)) for arg in self.command ]
+        log.info("Starting " + self.name + " server on port " + str(port) + ": " + " ".join(cmd))
+        if self.logfile:
+            stderr = open(self.logfile,'a')
+        else:
+            stderr = subprocess.DEVNULL
+        process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=stderr, stderr=stderr, start_new_session=True)
+        writeserverstate(statefile, {'host': socket.gethostname(), 'run': getrun(), 'pid': process.pid, 'port': port, 'command': cmd})
+        begintime = time.time()
+        while not portopen(port):
+            if process.poll() is not None:
+                raise Exception("Server " + self.name + " exited prematurely (return code " + str(process.returncode) + "): " + " ".join(cmd))
+            if time.time() - begintime > self.startuptimeout:
+                stopserver(process.pid)
+                raise Exception("Server " + self.name + " did not come up within " + str(self.startuptimeout) + "s: " + " ".join(cmd))
+            time.sleep(0.1)
+        log.info("Server " + self.name + " running on port " + str(port) + " (startup took " + str(round(time.time() - begintime,2)) + "s)")
+        return port
+
+    def shutdown(self):
+        shutdownservers(self.directory)
+
+class ServerSlot:
+    """A server acquired from a ServerPool, use as a context manager"""
+
+    def __init__(self, pool, slot, lock):
+        self.pool = pool
+        self.slot = slot
+        self.lock = lock
+
+    def __enter__(self):
+        try:
+            return self.pool.start(self.slot)
+        except:
+            self.release()
+            raise
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+    def release(self):
+        fcntl.flock(self.lock, fcntl.LOCK_UN)
+        self.lock.close()
+
+def getserversdir():
+    """Returns the directory where the servers of this host are registered (see ServerPool), under the state directory"""
+    return os.path.join(getstatedir(), 'servers', socket.gethostname())
+
+def readserverstate(statefile):
+    """Reads the registration of a server (host, run, pid, port and command), returns None if there is none"""
+    try:
+        with open(statefile,'r',encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not all( key in state for key in ('host', 'run', 'pid', 'port', 'command') ):
+        return None #registered by an older version, without host and run
+    return state
+
+def writeserverstate(statefile, state):
+    with open(statefile + '.tmp','w',encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(statefile + '.tmp', statefile)
+
+def shutdownservers(directory=None, run=None):
+    """Stops the servers registered under the specified directory (defaults to all servers of this host in the state directory). If a run is specified (see getrun()), only the servers of that run (that it started or used last) are stopped. Servers that are in use (whose slot is locked) are left running, and processes registered by another host are never signalled"""
+    if directory is None:
+        directory = getserversdir()
+    if not os.path.isdir(directory):
+        return
+    for base, dirs, files in os.walk(directory):
+        for filename in files:
+            if filename.endswith('.json'):
+                statefile = os.path.join(base, filename)
+                state = readserverstate(statefile)
+                if state is not None and (state['host'] != socket.gethostname() or (run is not None and state['run'] != run)):
+                    continue
+                with open(statefile[:-len('.json')] + '.lock','w') as lock:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        log.info("Not stopping server " + " ".join(state['command'] if state else [statefile]) + ", it is in use")
+                        continue
+                    state = readserverstate(statefile) #may have changed before we got the lock
+                    if state is not None and (state['host'] != socket.gethostname() or (run is not None and state['run'] != run)):
+                        continue
+                    if state is not None and isserver(state):
+                        log.info("Stopping server " + " ".join(state['command']))
+                        stopserver(state['pid'])
+                    os.unlink(statefile) #stale registrations are just removed
+
+def isserver(state):
+    """Returns whether the process registered for a server (see readserverstate()) is still that server: it must run on this host, and its command line must end with the arguments of the registered command (the executable may be a wrapper that execs another). Pids are reused, so a registered pid that is alive may belong to an unrelated process. Without /proc, this cannot be established and False is returned"""
+    if state['host'] != socket.gethostname() or not isrunning(state['pid']):
+        return False
+    try:
+        with open('/proc/' + str(state['pid']) + '/cmdline','rb') as f:
+            cmdline = f.read().decode('utf-8', errors='replace').split('\0')[:-1]
+    except OSError:
+        return False
+    args = state['command'][1:]
+    return len(cmdline) > len(args) and cmdline[len(cmdline) - len(args):] == args
+
+def stopserver(pid):
+    try:
+        os.killpg(pid, signal.SIGTERM)
+    except OSError:
+        pass
+
+def isrunning(pid):
+    try:
+        os.kill(pid, 0) #checks if process still running, does not kill
+    except OSError:
+        return False
+    return True
+
+def portopen(port, host='localhost', timeout=1):
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+def freeport():
+    """Returns a TCP port that is currently free on this host"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('localhost',0))
+        return sock.getsockname()[1]
+
+SCHEDULERS = {} #(host, port) => time at which a central scheduler was last found running there
+SCHEDULERTTL = 10 #seconds for which a scheduler found running is assumed to be still running
+
+def schedulerrunning(host='localhost', port=8082, timeout=None):
+    """Returns whether a central luigi scheduler (luigid) is running and healthy at host:port. The connection is attempted with a short timeout (the LUIGINLP_SCHEDULER_TIMEOUT environment variable, in seconds, 0.5 by default), so filtered ports do not stall, and the scheduler's HTTP API is queried. Only a running scheduler is remembered, for SCHEDULERTTL seconds, so a scheduler that is started or stops later is noticed by the next run in the same process"""
+    if time.time() - SCHEDULERS.get((host, port), 0) < SCHEDULERTTL:
+        return True
+    if timeout is None:
+        timeout = float(os.environ.get('LUIGINLP_SCHEDULER_TIMEOUT', 0.5))
+    if pingscheduler(host, port, timeout):
+        SCHEDULERS[(host, port)] = time.time()
+        return True
+    SCHEDULERS.pop((host, port), None)
+    return False
+
+def pingscheduler(host, port, timeout):
+    """Queries the HTTP API of a luigi scheduler, returns True if it responds properly"""
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request('GET', '/api/is_paused')
+        response = connection.getresponse()
+        return response.status == 200 and 'response' in json.loads(response.read().decode('utf-8'))
+    except (OSError, ValueError, http.client.HTTPException):
+        return False
+    finally:
+        connection.close()
+
+class PrivateScheduler:
+    """A central luigi scheduler (luigid) on a free port of this host, started for the duration of a workflow run so multiple worker processes can share it. Its state and log are kept in the state directory"""
+
+    def __init__(self, startuptimeout=60):
+        self.host = 'localhost'
+        self.port = freeport()
+        directory = os.path.join(getstatedir(), 'scheduler')
+        os.makedirs(directory, exist_ok=True)
+        cmd = [sys.executable, '-c', 'import sys, luigi.cmdline; luigi.cmdline.luigid(sys.argv[1:])', '--address', self.host, '--port', str(self.port), '--state-path', os.path.join(directory, 'state.pickle'), '--logdir', directory]
+        log.info("Starting scheduler on port " + str(self.port))
+        with open(os.path.join(directory, 'luigid.log'),'a') as logfile:
+            self.process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=logfile, stderr=logfile, start_new_session=True)
+        begintime = time.time()
+        while not pingscheduler(self.host, self.port, 1):
+            if self.process.poll() is not None or time.time() - begintime > startuptimeout:
+                self.stop()
+                raise Exception("Unable to start a scheduler, see " + os.path.join(directory, 'luigid.log'))
+            time.sleep(0.1)
+        SCHEDULERS[(self.host, self.port)] = time.time()
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        SCHEDULERS.pop((self.host, self.port), None)
+
+DIGESTS = {} #(path, inode, size, mtime) => sha256 digest
+
+def filedigest(path):
+    """Returns the SHA-256 digest of the contents of a file, memoised as long as the file does not change"""
+    st = os.stat(path)
+    signature = (path, st.st_ino, st.st_size, st.st_mtime_ns)
+    if signature not in DIGESTS:
+        h = hashlib.sha256()
+        with open(path,'rb') as f:
+            for block in iter(lambda: f.read(1024*1024), b''):
+                h.update(block)
+        DIGESTS[signature] = h.hexdigest()
+    return DIGESTS[signature]
+
+Delta = collections.namedtuple('Delta', ('changed', 'removed', 'entries')) #see DirectoryManifest.delta()
+
+class DirectoryManifest:
+    """Records the files in a directory as of the last successful run of a task on it, for incremental processing: for every file (by path relative to the directory) its size, modification time, content digest and the outputs that were produced for it. Manifests are kept in the state directory, under the directory and a key identifying the task (e.g. its output), and replaced atomically"""
+
+    def __init__(self, directory, key):
+        self.directory = directory
+        self.file = os.path.join(getstatedir(), 'manifests', hashlib.sha1((os.path.abspath(directory) + "\n" + key).encode('utf-8')).hexdigest() + '.json')
+        if os.path.exists(self.file):
+            with open(self.file,'r',encoding='utf-8') as f:
+                self.entries = json.load(f)
+        else:
+            self.entries = {}
+
+    def delta(self, files):
+        """Compares the files (paths in the directory) with the manifest. Returns a Delta: the files that are new or changed (in order), the relative paths of the files that were removed, and the entries for the next manifest. Only files whose size or modification time differ are read to compare their digest, a file that was merely touched does not count as changed"""
+        changed = []
+        entries = {}
+        for filename in files:
+            relpath = os.path.relpath(filename, self.directory)
+            st = os.stat(filename)
+            entry = self.entries.get(relpath)
+            if entry is not None and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+                entries[relpath] = entry
+                continue
+            digest = filedigest(filename)
+            if entry is not None and entry['digest'] == digest:
+                entries[relpath] = dict(entry, mtime=st.st_mtime_ns)
+            else:
+                entries[relpath] = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'digest': digest, 'outputs': []}
+                changed.append(filename)
+        removed = [ relpath for relpath in self.entries if relpath not in entries ]
+        return Delta(changed, removed, entries)
+
+    def unchanged(self, files):
+        """Returns True if no files were added, changed or removed since the last successful run"""
+        delta = self.delta(files)
+        return not delta.changed and not delta.removed
+
+    def invalidate(self, delta):
+        """Removes the outputs of the files that were changed or removed and drops them from the manifest, so changed files are processed anew rather than considered done by their existing outputs. Call before processing; calling it again (luigi restarts run() after every dynamic dependency) is harmless"""
+        stale = set(delta.removed)
+        stale.update( os.path.relpath(filename, self.directory) for filename in delta.changed )
+        stale.intersection_update(self.entries)
+        if stale:
+            for relpath in stale:
+                removeoutputs(self.entries[relpath]['outputs'])
+            log.info("Removed the outputs of " + str(len(stale)) + " changed or removed file(s) in " + self.directory)
+            self.write({ relpath: entry for relpath, entry in self.entries.items() if relpath not in stale })
+
+    def commit(self, delta, outputs):
+        """Records a successful run: the files in the delta, with the outputs of the files that were processed (outputs is a function from input file to a list of output paths)"""
+        entries = dict(delta.entries)
+        for filename in delta.changed:
+            relpath = os.path.relpath(filename, self.directory)
+            entries[relpath] = dict(entries[relpath], outputs=list(outputs(filename)))
+        self.write(entries)
+
+    def write(self, entries):
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        with open(self.file + '.tmp','w',encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(self.file + '.tmp', self.file)
+        self.entries = entries
+
+def removeoutputs(paths):
+    """Removes output files and directories, if they exist"""
+    for path in paths:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.unlink(path)
+
+def executableversion(executable):
+    """Returns a string identifying the installed version of an executable (path, size and modification time), or None if it can not be found"""
+    if executable.endswith('.jar'):
+        path = executable if os.path.exists(executable) else None
+    else:
+        path = shutil.which(executable)
+    if path is None:
+        return None
+    st = os.stat(path)
+    return path + ':' + str(st.st_size) + ':' + str(st.st_mtime_ns)
+
+def linkfile(source, target):
+    """Materialises a file at target with the contents of source, by hardlink if possible, otherwise by reflink (on filesystems that support it) or, as a last resort, by copying"""
+    try:
+        os.link(source, target)
+        return
+    except OSError:
+        pass
+    try:
+        with open(source,'rb') as f_in:
+            with open(target,'wb') as f_out:
+                fcntl.ioctl(f_out.fileno(), 0x40049409, f_in.fileno()) #FICLONE
+        return
+    except OSError:
+        pass
+    shutil.copyfile(source, target)
+
+EVENTSLIMIT = 1024 * 1024 #size in bytes of the event log of an output cache beyond which it is rotated
+
+class OutputCache:
+    """Content-addressed cache of task outputs. Each entry is a directory (named after the key) with one file per output slot. Entries are evicted in least-recently-used order once the cache exceeds maxsize bytes (0 = unlimited)"""
+
+    def __init__(self, directory, maxsize=0):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.stored = 0
+        os.makedirs(os.path.join(self.directory, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(self.directory, 'tmp'), exist_ok=True)
+
+    def entry(self, key):
+        return os.path.join(self.directory, 'objects', key[:2], key)
+
+    def get(self, key, slots):
+        """Returns a dictionary of slot => cached file, or None if not (fully) cached"""
+        entry = self.entry(key)
+        files = { slot: os.path.join(entry, slot) for slot in slots }
+        if not all( os.path.isfile(f) for f in files.values() ):
+            return None
+        try:
+            os.utime(entry) #marks the entry as recently used
+        except OSError: #evicted in the meantime
+            return None
+        return files
+
+    def restore(self, key, targets):
+        """Materialises the cached files for the given key at the specified targets (dictionary of slot => path), returns True on success, False if not cached"""
+        files = self.get(key, targets.keys())
+        if files is None:
+            return False
+        try:
+            for slot, path in targets.items():
+                if os.path.exists(path):
+                    os.unlink(path)
+                linkfile(files[slot], path)
+        except OSError: #evicted in the meantime
+            return False
+        return True
+
+    def put(self, key, sources):
+        """Adds the files (dictionary of slot => path) to the cache under the given key"""
+        entry = self.entry(key)
+        if os.path.exists(entry):
+            return
+        tmpentry = os.path.join(self.directory, 'tmp', key + '.' + str(os.getpid()))
+        try:
+            os.makedirs(tmpentry, exist_ok=True)
+            for slot, path in sources.items():
+                shutil.copyfile(path, os.path.join(tmpentry, slot))
+                os.chmod(os.path.join(tmpentry, slot), 0o444) #outputs are hardlinked to cached files, which therefore may never be modified in place
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+        except OSError: #e.g. the cache is full, leave no partial entry behind
+            shutil.rmtree(tmpentry, ignore_errors=True)
+            raise
+        try:
+            os.rename(tmpentry, entry)
+        except OSError: #stored concurrently by another process
+            shutil.rmtree(tmpentry, ignore_errors=True)
+        self.stored += 1
+        if self.maxsize and self.stored % 100 == 0:
+            self.evict()
+
+    def entries(self):
+        """Yields (last access time, size, path) tuples for all entries"""
+        for prefix in os.scandir(os.path.join(self.directory, 'objects')):
+            if prefix.is_dir():
+                for entry in os.scandir(prefix.path):
+                    try:
+                        size = sum( f.stat().st_size for f in os.scandir(entry.path) )
+                        yield entry.stat().st_mtime, size, entry.path
+                    except OSError: #evicted concurrently
+                        pass
+
+    def size(self):
+        return sum( size for _, size, _ in self.entries() )
+
+    def evict(self):
+        """Removes the least recently used entries until the cache no longer exceeds its maximum size, and rotates the event log (see rotateevents())"""
+        self.rotateevents()
+        if not self.maxsize:
+            return
+        entries = sorted(self.entries())
+        total = sum( size for _, size, _ in entries )
+        for _, size, path in entries:
+            if total <= self.maxsize:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def record(self, event, name):
+        """Records a cache event (hit, miss, store) in the event log, from which statistics are computed"""
+        os.makedirs(self.directory, exist_ok=True) #may have been removed whilst in use
+        with open(os.path.join(self.directory, 'events'),'a',encoding='utf-8') as f:
+            f.write(event + "\t" + name + "\n")
+
+    def rotateevents(self):
+        """Moves the event log aside (to events.1, replacing the previous one) once it exceeds EVENTSLIMIT bytes, so it does not grow forever"""
+        eventsfile = os.path.join(self.directory, 'events')
+        try:
+            if os.path.getsize(eventsfile) > EVENTSLIMIT:
+                os.replace(eventsfile, eventsfile + '.1')
+        except OSError: #no events (yet)
+            pass
+
+    def eventoffset(self):
+        """Returns the current position in the event log, to pass to stats(): the inode of the log and its size"""
+        try:
+            stat = os.stat(os.path.join(self.directory, 'events'))
+        except OSError:
+            return (None, 0)
+        return (stat.st_ino, stat.st_size)
+
+    def stats(self, offset=None):
+        """Returns a dictionary of event => count, for all events since the specified position in the event log (see eventoffset()), or all events in the current log. Events in the log rotated since (see rotateevents()) count as well"""
+        stats = {'hit': 0, 'miss': 0, 'store': 0}
+        eventsfile = os.path.join(self.directory, 'events')
+        logs = [ (eventsfile, 0) ]
+        if offset is not None and offset[0] is not None:
+            inode, position = offset
+            if fileinode(eventsfile) == inode:
+                logs = [ (eventsfile, position) ]
+            elif fileinode(eventsfile + '.1') == inode: #rotated in the meantime
+                logs = [ (eventsfile + '.1', position), (eventsfile, 0) ]
+        for filename, position in logs:
+            try:
+                with open(filename,'r',encoding='utf-8') as f:
+                    f.seek(position)
+                    for line in f:
+                        event = line.split("\t")[0]
+                        stats[event] = stats.get(event,0) + 1
+            except FileNotFoundError:
+                pass
+        return stats
+
+def fileinode(path):
+    try:
+        return os.stat(path).st_ino
+    except OSError:
+        return None
+
+OUTPUTCACHE = {}
+
+def getoutputcache():
+    """Returns the output cache, configured through the LUIGINLP_CACHEDIR and LUIGINLP_CACHESIZE (in bytes) environment variables (or the cachedir and cachesize keyword arguments to run()), or None if caching is disabled"""
+    directory = os.environ.get('LUIGINLP_CACHEDIR')
+    if not directory:
+        return None
+    maxsize = int(os.environ.get('LUIGINLP_CACHESIZE', 0))
+    if (directory, maxsize) not in OUTPUTCACHE:
+        OUTPUTCACHE[(directory, maxsize)] = OutputCache(directory, maxsize)
+    return OUTPUTCACHE[(directory, maxsize)]
+
+def getmodelregistry():
+    """Returns the registry of trained models (an OutputCache) in which tasks with modelregistry = True store their outputs, configured through the LUIGINLP_MODELDIR and LUIGINLP_MODELSIZE (in bytes) environment variables (or the modeldir and modelsize keyword arguments to run()), or None if the registry is disabled (the default)"""
+    directory = os.environ.get('LUIGINLP_MODELDIR')
+    if not directory:
+        return None
+    maxsize = int(os.environ.get('LUIGINLP_MODELSIZE', 0))
+    if (directory, maxsize) not in OUTPUTCACHE:
+        OUTPUTCACHE[(directory, maxsize)] = OutputCache(directory, maxsize)
+    return OUTPUTCACHE[(directory, maxsize)]
+
+def getmetricsfile():
+    """Returns the file to which task metrics are written (as JSON lines), configured through the LUIGINLP_METRICS environment variable (or the metrics keyword argument to run()), or None if metrics are disabled (the default)"""
+    return os.environ.get('LUIGINLP_METRICS') or None
+
+def appendjsonline(filename, record):
+    """Appends a record to a JSON lines file, in a single write so concurrent writers do not interleave"""
+    if os.path.dirname(filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+    fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(record) + "\n").encode('utf-8'))
+    finally:
+        os.close(fd)
+
+def readjsonlines(filename, offset=0):
+    """Yields the records in a JSON lines file, starting at the specified byte offset"""
+    try:
+        with open(filename,'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if line.strip():
+                    yield json.loads(str(line,'utf-8'))
+    except FileNotFoundError:
+        return
+
+def scancomponents(directory, package):
+    """Returns a dictionary mapping the workflow components (classes decorated with @registercomponent) defined in the Python modules in the specified directory to the module (in the specified package) that defines them. The modules are parsed rather than imported"""
+    components = {}
+    for filename in sorted(glob.glob(os.path.join(directory, '*.py'))):
+        module = package + '.' + os.path.basename(filename)[:-3]
+        with open(filename,'r',encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filename)
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef) and any( (isinstance(decorator, ast.Name) and decorator.id == 'registercomponent') for decorator in node.decorator_list ):
+                components[node.name] = module
+    return components
+
+def writecomponentmanifest():
+    """(Re)generates luiginlp/modules/manifest.py, the manifest of the workflow components in LuigiNLP's own modules, which allows importing them on demand. Run this after adding or renaming a component"""
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modules')
+    with open(os.path.join(directory, 'manifest.py'),'w',encoding='utf-8') as f:
+        f.write("#Generated by luiginlp.util.writecomponentmanifest(), do not edit\n")
+        f.write("#Maps the workflow components in LuigiNLP's modules to the module that defines them, so getcomponentclass() and the luiginlp command can import them on demand\n\n")
+        f.write("COMPONENTMODULES = {\n")
+        for component, module in sorted(scancomponents(directory, 'luiginlp.modules').items()):
+            f.write("    '" + component + "': '" + module + "',\n")
+        f.write("}\n")
@@ -35,8 +35,11 @@ setup(
     #include_package_data=True,
     #package_data = {'': ['*.wsgi','*.js','*.xsl','*.gif','*.png','*.xml','*.html','*.jpg','*.svg','*.rng'] },
     install_requires=['natsort','sciluigi'],
+    extras_require={'folia': ['folia']}, #in-process FoLiA validation
     entry_points = {    'console_scripts': [
             'luiginlp = luiginlp.luiginlp:main',
+            'luiginlp-launch = luiginlp.launcher:main',
+            'luiginlp-plan = luiginlp.planner:main',
     ]
     }
 )
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+"""Scale benchmark suite: runs a number of scenarios on batches of tiny input files of several sizes and reports, per scenario and size, the wall time, the scheduling overhead (wall time not spent in the tasks themselves, according to the task metrics), the throughput and the peak RSS of the driver process. Results are written as JSON, and compared against the results of an earlier run (e.g. of another commit) with --compare.
+
+Scenarios (only local tools are used: Python and sed):
+  noop             a task that only creates its (empty) output, scheduling overhead only
+  python           a task implemented in Python (lowercasing)
+  shell            a task invoking an external tool (sed, removing vowels, Voweleater from scaletest.py)
+  parallel         the Python task, scheduled through Parallel rather than ParallelBatch
+  parallelfromdir  the Python task, scheduled through ParallelFromDir
+  chunked          the shell task, scheduled in adaptively sized ParallelBatch chunks from a single task (ScaleTest from scaletest.py)
+  chain2, chain4   accept chains of depth 2 and 4 (one Python task per component)
+All other scenarios are scheduled through ParallelBatch. Every scenario runs in a process of its own, so luigi's instance cache and the peak RSS do not carry over.
+
+Usage: benchmark.py workdir [--sizes 1000,10000,100000] [--scenarios ...] [--workers 1] [--output results.json] [--compare baseline.json] [--tolerance 0.1]"""
+
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import resource
+import subprocess
+import luiginlp
+from luiginlp.engine import Task, StandardWorkflowComponent, InputFormat, InputComponent, InputSlot, ParallelBatch, Parallel, ParallelFromDir, PassParameters, registercomponent
+from luiginlp.util import readjsonlines
+from scaletest import Voweleater, ScaleTest #pylint: disable=unused-import
+
+SCENARIOS = ('noop', 'python', 'shell', 'parallel', 'parallelfromdir', 'chunked', 'chain2', 'chain4')
+
+class NoopTask(Task):
+    in_txt = InputSlot()
+
+    def out_txt(self):
+        return self.outputfrominput(inputformat='txt',stripextension='.txt',addextension='.noop.txt')
+
+    def run(self):
+        open(self.out_txt().path,'w').close()
+
+@registercomponent
+class Noop(StandardWorkflowComponent):
+    def autosetup(self):
+        return NoopTask
+
+    def accepts(self):
+        return InputFormat(self, format_id='txt',extension='txt')
+
+class LowercaseTask(Task):
+    in_txt = InputSlot()
+
+    def out_txt(self):
+        return self.outputfrominput(inputformat='txt',stripextension='.txt',addextension='.lowercase.txt')
+
+    def run(self):
+        with open(self.in_txt().path,'r',encoding='utf-8') as f_in:
+            with open(self.out_txt().path,'w',encoding='utf-8') as f_out:
+                f_out.write(f_in.read().lower())
+
+@registercomponent
+class Lowercaser(StandardWorkflowComponent):
+    def autosetup(self):
+        return LowercaseTask
+
+    def accepts(self):
+        return InputFormat(self, format_id='txt',extension='txt')
+
+def chaincomponent(level, AcceptedComponent=None):
+    """Returns a component at the specified level of an accept chain: level 1 accepts the input file, every next level accepts the component of the previous level (only). Each level runs a task of its own that appends the level to the filename"""
+    def out_txt(self):
+        return self.outputfrominput(inputformat='txt',stripextension='.txt',addextension='.' + str(level) + '.txt')
+    def run(self):
+        shutil.copyfile(self.in_txt().path, self.out_txt().path)
+    TaskClass = type('ChainTask' + str(level), (Task,), {'in_txt': InputSlot(), 'out_txt': out_txt, 'run': run, '__module__': __name__})
+    if AcceptedComponent is None:
+        accepts = lambda self: InputFormat(self, format_id='txt',extension='txt')
+    else:
+        accepts = lambda self: InputComponent(self, AcceptedComponent)
+    return registercomponent(type('Chain' + str(level), (StandardWorkflowComponent,), {'autosetup': lambda self: TaskClass, 'accepts': accepts, '__module__': __name__}))
+
+CHAIN = [None]
+for chainlevel in range(1,5):
+    CHAIN.append(chaincomponent(chainlevel, CHAIN[-1]))
+
+def runscenario(scenario, inputdir, size, outputdir, workers):
+    """Runs a scenario (in this process), returns its results"""
+    os.environ['LUIGINLP_STATEDIR'] = os.path.join(outputdir, 'state')
+    os.environ['LUIGINLP_METRICS'] = os.path.join(outputdir, 'metrics.jsonl')
+    inputfiles = [ os.path.join(inputdir, str(i) + '.txt') for i in range(1, size+1) ]
+    passparameters = PassParameters(outputdir=outputdir)
+    component = {'noop': 'Noop', 'shell': 'Voweleater', 'chunked': 'Voweleater', 'chain2': 'Chain2', 'chain4': 'Chain4'}.get(scenario, 'Lowercaser')
+    begintime = time.time()
+    if scenario == 'parallel':
+        success = luiginlp.run(Parallel(component=component, inputfiles=','.join(inputfiles), passparameters=passparameters), workers=workers)
+    elif scenario == 'chunked':
+        success = luiginlp.run(ScaleTest(inputfile=inputdir, n=size, outputdir=outputdir), workers=workers)
+    elif scenario == 'parallelfromdir':
+        success = luiginlp.run(ParallelFromDir(component=component, directory=inputdir, pattern='*.txt', passparameters=passparameters), workers=workers)
+    else:
+        success = luiginlp.run(ParallelBatch(component=component, inputfiles=','.join(inputfiles), passparameters=passparameters), workers=workers)
+    walltime = time.time() - begintime
+    records = list(readjsonlines(os.environ['LUIGINLP_METRICS']))
+    tasktime = sum( record['walltime'] for record in records if record['task'] != 'ScaleTestTask' ) #ScaleTestTask only schedules the others, its wall time spans theirs
+    return {
+        'scenario': scenario,
+        'size': size,
+        'workers': workers,
+        'success': bool(success),
+        'tasks': len(records),
+        'walltime': walltime,
+        'scheduling': max(walltime - tasktime / workers, 0.0),
+        'throughput': size / walltime,
+        'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+def makeinputs(inputdir, size):
+    os.makedirs(inputdir, exist_ok=True)
+    for i in range(1, size+1):
+        filename = os.path.join(inputdir, str(i) + '.txt')
+        if not os.path.exists(filename):
+            with open(filename,'w',encoding='utf-8') as f:
+                f.write("THIS IS A TEST " + str(i) + "\n")
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def compare(results, baseline, tolerance):
+    """Prints the results relative to the baseline, returns the number of regressions: scenarios that took more than (1 + tolerance) times as long"""
+    baselineresults = { (result['scenario'], result['size']): result for result in baseline['results'] }
+    regressions = 0
+    for result in results:
+        before = baselineresults.get((result['scenario'], result['size']))
+        if before is None:
+            continue
+        ratio = result['walltime'] / before['walltime'] if before['walltime'] else 1.0
+        regression = ratio > 1.0 + tolerance
+        regressions += int(regression)
+        print(result['scenario'] + "\t" + str(result['size']) + "\t" + str(round(before['walltime'],2)) + "s -> " + str(round(result['walltime'],2)) + "s (" + str(round(ratio,2)) + "x)" + ("\tREGRESSION" if regression else ""),file=sys.stderr)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Scale benchmark suite for LuigiNLP", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('workdir', type=str, help="Work directory (inputs are kept between runs, outputs are removed)")
+    parser.add_argument('--sizes', type=str, help="Numbers of input files (comma separated)", default="1000,10000,100000")
+    parser.add_argument('--scenarios', type=str, help="Scenarios to run (comma separated)", default=",".join(SCENARIOS))
+    parser.add_argument('--workers', type=int, help="Number of luigi workers", default=1)
+    parser.add_argument('--output', type=str, help="JSON file to write the results to", default="")
+    parser.add_argument('--compare', type=str, help="JSON file with the results of an earlier run to compare with, exits with status 1 on regressions", default="")
+    parser.add_argument('--tolerance', type=float, help="Relative slowdown tolerated before a scenario counts as a regression", default=0.1)
+    parser.add_argument('--run', type=str, help=argparse.SUPPRESS, default="") #internal: run a single scenario in this process (scenario:size)
+    args = parser.parse_args()
+    workdir = os.path.abspath(args.workdir)
+
+    if args.run:
+        scenario, size = args.run.split(':')
+        print(json.dumps(runscenario(scenario, os.path.join(workdir, 'input-' + size + '.txtdir'), int(size), os.path.join(workdir, 'output'), args.workers)))
+        return
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + ':' + env.get('PYTHONPATH','')
+    results = []
+    for size in [ int(size) for size in args.sizes.split(',') ]:
+        makeinputs(os.path.join(workdir, 'input-' + str(size) + '.txtdir'), size)
+        for scenario in args.scenarios.split(','):
+            if scenario not in SCENARIOS:
+                parser.error("No such scenario: " + scenario)
+            outputdir = os.path.join(workdir, 'output')
+            if os.path.exists(outputdir):
+                shutil.rmtree(outputdir)
+            os.makedirs(outputdir)
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__), workdir, '--run', scenario + ':' + str(size), '--workers', str(args.workers)], cwd=outputdir, env=env, stderr=subprocess.DEVNULL)
+            result = json.loads(output.decode('utf-8').strip().split("\n")[-1])
+            results.append(result)
+            print(scenario + "\t" + str(size) + "\t" + str(round(result['walltime'],2)) + "s, scheduling " + str(round(result['scheduling'],2)) + "s, " + str(round(result['throughput'],1)) + " inputs/s, driver peak rss " + str(result['maxrss']) + "KiB" + ("" if result['success'] else ", FAILED"),file=sys.stderr)
+            shutil.rmtree(outputdir)
+
+    report = {'commit': commit(), 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': sys.version.split()[0], 'workers': args.workers, 'results': results}
+    if args.output:
+        with open(args.output,'w',encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        with open(args.compare,'r',encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""A stand-in for Frog, used by the benchmarks when Frog is not installed. It mimics a subset of Frog's command line interface (-t, -x, -X, --id, -S) and its server protocol, and simulates the model loading time (FAKEFROG_LOADTIME environment variable, in seconds)."""
+
+import sys
+import os
+import time
+import argparse
+import socketserver
+from xml.sax.saxutils import escape
+
+def frog(text, docid):
+    paragraphs = [ p for p in text.split('\n\n') if p.strip() ]
+    xml = '<?xml version="1.0" encoding="utf-8"?>\n<FoLiA xmlns="http://ilk.uvt.nl/folia" xml:id="' + docid + '" version="1.4">\n<metadata type="native"/>\n<text xml:id="' + docid + '.text">\n'
+    for i, paragraph in enumerate(paragraphs):
+        pid = docid + '.p.' + str(i+1)
+        xml += '<p xml:id="' + pid + '">\n'
+        for j, word in enumerate(paragraph.split()):
+            xml += '  <w xml:id="' + pid + '.w.' + str(j+1) + '"><t>' + escape(word) + '</t></w>\n'
+        xml += '</p>\n'
+    return xml + '</text>\n</FoLiA>\n'
+
+class FrogHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        lines = []
+        for line in self.rfile:
+            line = str(line,'utf-8').rstrip('\r\n')
+            if line == 'EOT':
+                break
+            lines.append(line)
+        self.wfile.write(frog("\n".join(lines), self.server.docid).encode('utf-8') + b'READY\n')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-t')
+    parser.add_argument('-x', nargs='?', const=True)
+    parser.add_argument('-X', nargs='?', const=True)
+    parser.add_argument('-S', type=int)
+    parser.add_argument('-n', action='store_true')
+    parser.add_argument('--id', default='untitled')
+    parser.add_argument('--skip')
+    args = parser.parse_args()
+
+    time.sleep(float(os.environ.get('FAKEFROG_LOADTIME',1))) #loading models
+
+    if args.S:
+        server = socketserver.TCPServer(('localhost', args.S), FrogHandler)
+        server.docid = args.id
+        server.serve_forever()
+    elif args.t:
+        with open(args.t,'r',encoding='utf-8') as f:
+            text = f.read()
+        with open(args.X,'w',encoding='utf-8') as f:
+            f.write(frog(text, args.id))
+    else:
+        print("Unsupported invocation",file=sys.stderr)
+        sys.exit(2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+
+"""A stand-in for Tesseract, used by the tests and benchmarks when Tesseract is not installed. It mimics Tesseract's invocation for hOCR output (tesseract image outputbase -l language -c tessedit_create_hocr=T) and simulates recognition by keeping the CPU busy for a time proportional to the size of the image (FAKETESSERACT_SPEED environment variable, in bytes per second)."""
+
+import sys
+import os
+import time
+import argparse
+from xml.sax.saxutils import escape
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('image')
+    parser.add_argument('outputbase')
+    parser.add_argument('-l', default='eng')
+    parser.add_argument('-c', action='append')
+    args = parser.parse_args()
+
+    size = os.path.getsize(args.image)
+    endtime = time.process_time() + size / float(os.environ.get('FAKETESSERACT_SPEED', 10000000))
+    while time.process_time() < endtime: #recognising
+        pass
+
+    page = os.path.basename(args.image)
+    with open(args.outputbase + '.hocr','w',encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<html xmlns="http://www.w3.org/1999/xhtml">\n<head>\n<meta name="ocr-system" content="faketesseract" />\n<meta name="omp-thread-limit" content="' + os.environ.get('OMP_THREAD_LIMIT','') + '" />\n</head>\n<body>\n<div class="ocr_page" id="page_1" title="image ' + escape(page) + '; bbox 0 0 100 100">\n<span class="ocrx_word" id="word_1_1" title="bbox 0 0 10 10">' + escape(page) + '</span>\n</div>\n</body>\n</html>\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""A stand-in for Timbl, used by the tests when Timbl is not installed. It mimics a subset of Timbl's command line interface (-f, -t, -i, -I, -W, -w, -o, -S, -F and the ignored algorithm options) and its server protocol for data in the Columns, Tabbed and C4.5 formats (detected as Timbl does if -F is not given), and classifies using the nearest neighbour by overlap (ties are resolved by the first instance)."""
+
+import sys
+import shutil
+import argparse
+import socketserver
+
+SEPARATORS = {'Columns': None, 'Tabbed': '\t', 'C4.5': ','}
+SEPARATOR = None
+
+def split(line):
+    return [ field.strip() for field in line.strip().split(SEPARATOR) ]
+
+def readinstances(filename):
+    global SEPARATOR #pylint: disable=global-statement
+    with open(filename,'r',encoding='utf-8') as f:
+        lines = [ line for line in f if line.strip() ]
+    if SEPARATOR is None and lines and ',' in lines[0]:
+        SEPARATOR = ',' #detected as C4.5
+    return [ split(line) for line in lines ]
+
+def classify(instances, features):
+    best = None
+    bestoverlap = -1
+    for instance in instances:
+        overlap = sum( 1 for a, b in zip(instance[:-1], features) if a == b )
+        if overlap > bestoverlap:
+            best = instance
+            bestoverlap = overlap
+    return best[-1]
+
+class TimblHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(b'Welcome to the Timbl server.\n')
+        for line in self.rfile:
+            line = str(line,'utf-8').strip()
+            if line.startswith('c '):
+                fields = split(line[2:])
+                self.wfile.write(('CATEGORY {' + classify(self.server.instances, fields[:-1]) + '}\n').encode('utf-8'))
+            elif line in ('exit','quit'):
+                break
+            else:
+                self.wfile.write(b'ERROR { Unknown command }\n')
+
+def main():
+    parser = argparse.ArgumentParser()
+    global SEPARATOR #pylint: disable=global-statement
+    for option in ('-f','-t','-i','-I','-W','-w','-o','-a','-k','-m','-d','-S','-F'):
+        parser.add_argument(option)
+    args = parser.parse_args()
+    if args.F:
+        SEPARATOR = SEPARATORS[args.F]
+
+    if args.f:
+        instances = readinstances(args.f)
+    elif args.i:
+        instances = readinstances(args.i)
+    else:
+        print("No training data or instance base specified",file=sys.stderr)
+        sys.exit(2)
+    if args.I:
+        shutil.copyfile(args.f, args.I)
+    if args.W:
+        with open(args.W,'w',encoding='utf-8') as f:
+            f.write("# weights\n")
+    print("Data: " + str(len(instances)) + " instances")
+
+    if args.S:
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        server = socketserver.ThreadingTCPServer(('localhost', int(args.S)), TimblHandler)
+        server.instances = instances
+        server.serve_forever()
+    elif args.t:
+        correct = total = 0
+        with open(args.t,'r',encoding='utf-8') as f, open(args.o,'w',encoding='utf-8') as out:
+            for line in f:
+                if not line.strip():
+                    continue
+                fields = split(line)
+                predicted = classify(instances, fields[:-1])
+                out.write(line.strip() + (SEPARATOR or ' ') + predicted + '\n')
+                total += 1
+                if predicted == fields[-1]:
+                    correct += 1
+        print("overall accuracy:        " + ("%.6f" % (correct / total if total else 0)) + "  (" + str(correct) + "/" + str(total) + "), of which " + str(correct) + " exact matches")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""Benchmark comparing Frog with a process per document against a pool of persistent Frog servers.
+
+Usage: frogbench.py workdir [n] [workers] [servers]
+
+Uses the real frog if it is installed and FAKEFROG is not set, otherwise a stand-in (fakefrog.py) that simulates the model loading time (FAKEFROG_LOADTIME)"""
+
+import sys
+import os
+import shutil
+import time
+import luiginlp
+from luiginlp.engine import Parallel, PassParameters
+from luiginlp.modules.frog import Frog
+
+if __name__ == '__main__':
+    workdir = os.path.abspath(sys.argv[1])
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    servers = int(sys.argv[4]) if len(sys.argv) > 4 else workers
+
+    if not shutil.which('frog') or 'FAKEFROG' in os.environ:
+        bindir = os.path.join(workdir, 'bin')
+        os.makedirs(bindir, exist_ok=True)
+        with open(os.path.join(bindir, 'frog'),'w') as f:
+            f.write("#!/bin/sh\nexec " + sys.executable + " " + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakefrog.py') + " \"$@\"\n")
+        os.chmod(os.path.join(bindir, 'frog'), 0o755)
+        os.environ['PATH'] = bindir + ':' + os.environ['PATH']
+        print("Using stand-in frog (load time " + os.environ.get('FAKEFROG_LOADTIME','1') + "s)",file=sys.stderr)
+
+    inputdir = os.path.join(workdir, 'input')
+    os.makedirs(inputdir, exist_ok=True)
+    inputfiles = []
+    for i in range(1, n+1):
+        filename = os.path.join(inputdir, 'doc' + str(i) + '.txt')
+        if not os.path.exists(filename):
+            with open(filename,'w',encoding='utf-8') as f:
+                f.write("Dit is een korte test.\n\nHet is document " + str(i) + ".\n")
+        inputfiles.append(filename)
+
+    results = {}
+    for mode, passparameters in (('spawn', PassParameters()), ('server', PassParameters(server=True, servers=servers))):
+        outputdir = os.path.join(workdir, mode)
+        if os.path.exists(outputdir):
+            shutil.rmtree(outputdir)
+        os.mkdir(outputdir)
+        passparameters['outputdir'] = outputdir
+        begintime = time.time()
+        luiginlp.run(Parallel(component='Frog', inputfiles=','.join(inputfiles), passparameters=passparameters), workers=workers)
+        results[mode] = time.time() - begintime
+        produced = len([ f for f in os.listdir(outputdir) if f.endswith('.frogged.folia.xml') ])
+        print(mode + ": " + str(produced) + "/" + str(n) + " documents in " + str(round(results[mode],2)) + "s (" + str(round(n/results[mode],2)) + " docs/s)",file=sys.stderr)
+
+    print("speedup of server mode: " + str(round(results['spawn'] / results['server'],2)) + "x",file=sys.stderr)
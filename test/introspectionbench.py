@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+
+"""Micro-benchmark for workflow construction: builds n Voweleater workflows (each with a Lowercaser component in the accept chain) without running them.
+
+Usage: introspectionbench.py [n]"""
+
+import sys
+import os
+import time
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+sys.argv = sys.argv[:1]
+
+from test import Voweleater #pylint: disable=wrong-import-position
+from luiginlp.util import getlog #pylint: disable=wrong-import-position
+
+if __name__ == '__main__':
+    getlog().setLevel(logging.WARNING)
+    with tempfile.NamedTemporaryFile(suffix='.txt') as f:
+        begintime = time.time()
+        for i in range(0,n):
+            #a distinct outputdir yields a distinct component instance
+            Voweleater(inputfile=f.name, startcomponent='Lowercaser', outputdir='/tmp/out' + str(i)).requires()
+        duration = time.time() - begintime
+    print("Built " + str(n) + " workflows in " + str(round(duration,2)) + "s (" + str(round(n/duration,1)) + " workflows/s)")
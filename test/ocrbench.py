@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+"""Benchmark comparing OCR of a multi-page document page by page against page-parallel OCR on a bounded process pool.
+
+Usage: ocrbench.py workdir [pages] [threads]
+
+Uses the real tesseract if it is installed and FAKETESSERACT is not set, otherwise a stand-in (faketesseract.py) that simulates recognition time proportional to the page size (FAKETESSERACT_SPEED); the stand-in needs synthetic pages, the real tesseract needs real ones in workdir/input.tiffdir"""
+
+import sys
+import os
+import shutil
+import time
+import random
+import luiginlp
+from luiginlp.modules.ocr import OCR_document
+
+if __name__ == '__main__':
+    workdir = os.path.abspath(sys.argv[1])
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+    if not shutil.which('tesseract') or 'FAKETESSERACT' in os.environ:
+        bindir = os.path.join(workdir, 'bin')
+        os.makedirs(bindir, exist_ok=True)
+        with open(os.path.join(bindir, 'tesseract'),'w') as f:
+            f.write("#!/bin/sh\nexec " + sys.executable + " " + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'faketesseract.py') + " \"$@\"\n")
+        os.chmod(os.path.join(bindir, 'tesseract'), 0o755)
+        os.environ['PATH'] = bindir + ':' + os.environ['PATH']
+        print("Using stand-in tesseract (speed " + os.environ.get('FAKETESSERACT_SPEED','10000000') + " bytes/s)",file=sys.stderr)
+
+    inputdir = os.path.join(workdir, 'input.tiffdir')
+    os.makedirs(inputdir, exist_ok=True)
+    random.seed(n)
+    for i in range(1, n+1):
+        filename = os.path.join(inputdir, 'input-' + str(i).zfill(4) + '.tif')
+        if not os.path.exists(filename):
+            with open(filename,'wb') as f:
+                f.write(b'\0' * random.randint(50000, 500000)) #pages differ in size, and thus in recognition time
+
+    results = {}
+    for mode, pageparallel in (('sequential', False), ('pageparallel', True)):
+        outputdir = os.path.join(workdir, mode)
+        if os.path.exists(outputdir):
+            shutil.rmtree(outputdir)
+        os.mkdir(outputdir)
+        begintime = time.time()
+        luiginlp.run(OCR_document(inputfile=inputdir, outputdir=outputdir, language='eng', pageparallel=pageparallel, threads=threads))
+        results[mode] = time.time() - begintime
+        produced = len([ f for _, _, files in os.walk(outputdir) for f in files if f.endswith('.hocr') ])
+        print(mode + ": " + str(produced) + "/" + str(n) + " pages in " + str(round(results[mode],2)) + "s (" + str(round(n/results[mode],2)) + " pages/s)",file=sys.stderr)
+
+    print("speedup of page-parallel OCR: " + str(round(results['sequential'] / results['pageparallel'],2)) + "x",file=sys.stderr)
@@ -7,7 +7,7 @@ import luiginlp
 import luigi
 import json
 from luiginlp.engine import Task, StandardWorkflowComponent, PassParameters, InputFormat, InputComponent, InputSlot, Parameter, IntParameter, registercomponent, ParallelBatch
-from luiginlp.util import getlog, chunk
+from luiginlp.util import getlog, AdaptiveChunker
 
 log = getlog()
 
@@ -71,7 +71,8 @@ class ScaleTestTask(Task):
         log.info("Collected " + str(len(inputfiles)) + " input files")
 
         #inception aka dynamic dependencies: we yield a list of tasks to perform which could not have been predicted statically
-        for inputfiles_chunk in chunk(inputfiles, 1000):
+        #chunks are sized to take about a minute each, from the measured cost of the chunks before them
+        for inputfiles_chunk in AdaptiveChunker(inputfiles, self.task_id):
             yield ParallelBatch(component='Voweleater',inputfiles=','.join(inputfiles_chunk),passparameters=PassParameters(outputdir=self.out_txtdir().path))
 
         #log.info("Scheduling chunks: " + str(len(chunks)))
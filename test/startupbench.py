@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""Benchmark for the startup time of the luiginlp command: the interpreter itself, importing the engine, luiginlp --help, and a single-file run (OCR of one page by a stand-in tesseract, see faketesseract.py) with the component's module imported on demand and with all of LuigiNLP's modules imported eagerly.
+
+Usage: startupbench.py workdir [repetitions]"""
+
+import sys
+import os
+import subprocess
+import time
+
+MODULES = ('folia', 'frog', 'ocr', 'openconvert', 'pdf', 'timbl', 'ucto')
+
+def measure(cmd, repetitions, cwd, env, before=None):
+    """Returns the best wall time of the command over the specified number of repetitions"""
+    times = []
+    for _ in range(0, repetitions):
+        if before is not None:
+            before()
+        begintime = time.time()
+        subprocess.check_call(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.time() - begintime)
+    return min(times)
+
+if __name__ == '__main__':
+    workdir = os.path.abspath(sys.argv[1])
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    bindir = os.path.join(workdir, 'bin')
+    os.makedirs(bindir, exist_ok=True)
+    with open(os.path.join(bindir, 'tesseract'),'w') as f:
+        f.write("#!/bin/sh\nexec " + sys.executable + " " + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'faketesseract.py') + " \"$@\"\n")
+    os.chmod(os.path.join(bindir, 'tesseract'), 0o755)
+    env = dict(os.environ)
+    env['PATH'] = bindir + ':' + env['PATH']
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + ':' + env.get('PYTHONPATH','')
+    env['FAKETESSERACT_SPEED'] = '1000000000'
+    with open(os.path.join(workdir, 'page.tif'),'wb') as f:
+        f.write(b'\0' * 1000)
+
+    def clean():
+        if os.path.exists(os.path.join(workdir, 'page.hocr')):
+            os.unlink(os.path.join(workdir, 'page.hocr'))
+
+    runargs = ['OCR_singlepage', '--inputfile', 'page.tif', '--language', 'eng']
+    eager = "import " + ", ".join( 'luiginlp.modules.' + module for module in MODULES ) + "; from luiginlp.luiginlp import main; main()"
+    cmds = (
+        ('python', [sys.executable, '-c', 'pass'], None),
+        ('import engine', [sys.executable, '-c', 'import luiginlp.engine'], None),
+        ('luiginlp --help', [sys.executable, '-m', 'luiginlp.luiginlp', '--help'], None),
+        ('run (on demand)', [sys.executable, '-m', 'luiginlp.luiginlp'] + runargs, clean),
+        ('run (eager)', [sys.executable, '-c', eager] + runargs, clean),
+    )
+    for label, cmd, before in cmds:
+        print(label + ": " + str(round(measure(cmd, repetitions, workdir, env, before) * 1000)) + "ms",file=sys.stderr)
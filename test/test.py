@@ -1,10 +1,18 @@
 import sys
 import os
 import unittest
+import unittest.mock
 import glob
+import json
 import shutil
+import socket
+import subprocess
+import time
+import luigi
 import luiginlp
-from luiginlp.engine import Task, StandardWorkflowComponent, InputFormat, InputComponent, InputSlot, Parameter
+import luiginlp.util
+from luiginlp.engine import Task, StandardWorkflowComponent, InputFormat, InputComponent, InputSlot, Parameter, IntParameter, RESOLUTIONCACHE, PassParameters, ParallelFromDir, ParallelStreamFromDir, ParallelBatch, registercomponent
+from luiginlp.util import ProcessPool, OutputCache, AdaptiveChunker, readjsonlines, scandir_glob
 
 
 class LowercaseTask(Task):
@@ -68,6 +76,7 @@ class Voweleater(StandardWorkflowComponent):
 
 Voweleater.inherit_parameters(VoweleaterTask)
 
+@registercomponent
 class LowercaseVoweleater(StandardWorkflowComponent):
     """A component that chains two tasks"""
 
@@ -127,6 +136,78 @@ class LowercaseVoweleaterDirTask2(Task):
         yield [ Voweleater(inputfile=inputfile,outputdir=self.out_txtdir().path,startcomponent='Lowercaser') for inputfile in inputfiles ]
 
 
+class AsyncVoweleaterDirTask(Task):
+    """Example of a task that launches external processes asynchronously, at most threads at the same time"""
+    executable = 'sed'
+    in_txtdir = InputSlot()
+    threads = IntParameter(default=2)
+
+    def out_txtdir(self):
+        return self.outputfrominput(inputformat='txtdir',stripextension='.txtdir',addextension='.novowels.txtdir')
+
+    def run(self):
+        self.setup_output_dir(self.out_txtdir().path)
+        for filename in glob.glob(self.in_txtdir().path + '/*.txt'):
+            self.ex_async(e='s/[aeiouAEIOU]//g',__stdin_from=filename,__stdout_to=os.path.join(self.out_txtdir().path, os.path.basename(filename)))
+        self.wait_async()
+
+class AsyncVoweleaterDir(StandardWorkflowComponent):
+    def autosetup(self):
+        return AsyncVoweleaterDirTask
+
+    def accepts(self):
+        return InputFormat(self, format_id='txtdir',extension='txtdir', directory=True)
+
+AsyncVoweleaterDir.inherit_parameters(AsyncVoweleaterDirTask)
+
+class BatchVoweleaterTask(Task):
+    """Example of a batchable task: removes vowels from many files in one invocation of the external tool"""
+    executable = 'sed'
+    in_txt = InputSlot()
+    batchable = True
+    invocations = 0
+
+    def out_txt(self):
+        return self.outputfrominput(inputformat='txt',stripextension='.txt',addextension='.novowels.txt')
+
+    def run(self):
+        self.run_batch([self])
+
+    @classmethod
+    def run_batch(cls, tasks):
+        cls.invocations += 1
+        for task in tasks:
+            shutil.copyfile(task.in_txt().path, task.out_txt().path)
+        tasks[0].ex(*[ task.out_txt().path for task in tasks ], i=True, e='s/[aeiouAEIOU]//g')
+
+@registercomponent
+class BatchVoweleater(StandardWorkflowComponent):
+    def autosetup(self):
+        return BatchVoweleaterTask
+
+    def accepts(self):
+        return InputFormat(self, format_id='txt',extension='txt')
+
+class TouchDirTask(Task):
+    """Example of a task with a long argument list, split over multiple invocations if it exceeds the system limit"""
+    executable = 'touch'
+    chunkable = True
+    in_txt = InputSlot()
+
+    def out_txtdir(self):
+        return self.outputfrominput(inputformat='txt',stripextension='.txt',addextension='.touched.txtdir')
+
+    def run(self):
+        self.setup_output_dir(self.out_txtdir().path)
+        self.ex(*[ os.path.join(self.out_txtdir().path, 'file' + str(i) + '.txt') for i in range(0,200) ])
+
+class TouchDir(StandardWorkflowComponent):
+    def autosetup(self):
+        return TouchDirTask
+
+    def accepts(self):
+        return InputFormat(self, format_id='txt',extension='txt')
+
 class LowercaseVoweleaterDir2(StandardWorkflowComponent):
     def autosetup(self):
         return LowercaseVoweleaterDirTask2
@@ -134,6 +215,29 @@ class LowercaseVoweleaterDir2(StandardWorkflowComponent):
     def accepts(self):
         return InputFormat(self, format_id='txtdir',extension='txtdir', directory=True)
 
+class ChunkedLowercaseVoweleaterDirTask(Task):
+    """Runs a component on all files in a directory, in ParallelBatch chunks sized by AdaptiveChunker, records the sizes of the chunks"""
+    in_txtdir = InputSlot()
+
+    def out_chunks(self):
+        return self.outputfrominput(inputformat='txtdir',stripextension='.txtdir',addextension='.chunks.json')
+
+    def run(self):
+        inputfiles = sorted(glob.glob(self.in_txtdir().path + '/*.txt'))
+        sizes = []
+        for inputfiles_chunk in AdaptiveChunker(inputfiles, self.task_id):
+            sizes.append(len(inputfiles_chunk))
+            yield ParallelBatch(component='LowercaseVoweleater', inputfiles=','.join(inputfiles_chunk), passparameters=PassParameters(outputdir='/tmp/corpus.chunked.txtdir'))
+        with open(self.out_chunks().path,'w',encoding='utf-8') as f:
+            json.dump(sizes, f)
+
+class ChunkedLowercaseVoweleaterDir(StandardWorkflowComponent):
+    def autosetup(self):
+        return ChunkedLowercaseVoweleaterDirTask
+
+    def accepts(self):
+        return InputFormat(self, format_id='txtdir',extension='txtdir', directory=True)
+
 #------------------------------------------------------------------------------------------------------------
 
 def testfilecontents(filename, contents):
@@ -158,7 +262,7 @@ class Test1(unittest.TestCase):
             f.write("THIS IS A TEST")
 
     def tearDown(self):
-        for filename in ('/tmp/test.txt','/tmp/test.lowercase.txt','/tmp/test.novowels.txt', '/tmp/test.lowercase.novowels.txt'):
+        for filename in ('/tmp/test.txt','/tmp/test.lowercase.txt','/tmp/test.novowels.txt', '/tmp/test.lowercase.novowels.txt', '/tmp/cache1.txt', '/tmp/cache1.novowels.txt', '/tmp/cache2.txt', '/tmp/cache2.novowels.txt', '/tmp/metrics.txt', '/tmp/metrics.novowels.txt', '/tmp/metrics2.txt', '/tmp/metrics2.novowels.txt', '/tmp/cache3.txt', '/tmp/cache3.novowels.txt'):
             if os.path.exists(filename):
                 os.unlink(filename)
 
@@ -198,18 +302,205 @@ class Test1(unittest.TestCase):
         luiginlp.run(Voweleater(inputfile='/tmp/test.txt',startcomponent='Lowercaser'))
         self.assertTrue(testfilecontents('/tmp/test.lowercase.novowels.txt', 'ths s  tst'))
 
+    def test1_80(self):
+        """Accept chain resolution is cached for components with identical input types and parameters"""
+        RESOLUTIONCACHE.invalidate()
+        hits = RESOLUTIONCACHE.hits
+        first = Voweleater(inputfile='/tmp/test.txt',startcomponent='Lowercaser').requires()
+        self.assertEqual(RESOLUTIONCACHE.hits, hits)
+        second = Voweleater(inputfile='/tmp/test.txt',startcomponent='Lowercaser',outputdir='/tmp').requires()
+        self.assertTrue(RESOLUTIONCACHE.hits > hits)
+        self.assertEqual(first.in_txt().path, second.in_txt().path)
+        self.assertEqual(first.in_txt().path, '/tmp/test.lowercase.txt')
+
+    def test1_90(self):
+        """Content-addressed output cache: an identical document under another name is restored from the cache"""
+        shutil.copyfile('/tmp/test.txt', '/tmp/cache1.txt')
+        shutil.copyfile('/tmp/test.txt', '/tmp/cache2.txt')
+        try:
+            luiginlp.run(Voweleater(inputfile='/tmp/cache1.txt'), cachedir='/tmp/luiginlp.cache')
+            luiginlp.run(Voweleater(inputfile='/tmp/cache2.txt'), cachedir='/tmp/luiginlp.cache')
+            stats = OutputCache('/tmp/luiginlp.cache').stats()
+            self.assertEqual((stats['hit'], stats['store']), (1, 1))
+            self.assertTrue(testfilecontents('/tmp/cache2.novowels.txt', 'THS S  TST'))
+            self.assertEqual(os.stat('/tmp/cache2.novowels.txt').st_nlink, 2) #hardlinked to the cached file
+        finally:
+            shutil.rmtree('/tmp/luiginlp.cache')
+
+    def test1_91(self):
+        """A task whose outputs cannot be stored in the output cache still succeeds; the event log of the cache is rotated when it grows too large"""
+        shutil.copyfile('/tmp/test.txt', '/tmp/cache3.txt')
+        try:
+            with unittest.mock.patch('luiginlp.util.shutil.copyfile', side_effect=OSError(28, "No space left on device")):
+                self.assertTrue(luiginlp.run(Voweleater(inputfile='/tmp/cache3.txt'), cachedir='/tmp/luiginlp.cache'))
+            self.assertTrue(testfilecontents('/tmp/cache3.novowels.txt', 'THS S  TST'))
+            self.assertEqual(os.listdir('/tmp/luiginlp.cache/tmp'), [])
+            cache = OutputCache('/tmp/luiginlp.cache')
+            offset = cache.eventoffset()
+            with unittest.mock.patch('luiginlp.util.EVENTSLIMIT', 10):
+                cache.record('miss', 'Test')
+                cache.evict()
+            cache.record('hit', 'Test')
+            self.assertTrue(os.path.exists('/tmp/luiginlp.cache/events.1'))
+            self.assertEqual(os.path.getsize('/tmp/luiginlp.cache/events'), len("hit\tTest\n"))
+            self.assertEqual(cache.stats(offset), {'hit': 1, 'miss': 1, 'store': 0})
+        finally:
+            shutil.rmtree('/tmp/luiginlp.cache')
+
+    def test1_92(self):
+        """Settings passed to run() (the state directory, output cache, etc) apply to that run only"""
+        environ = { variable: os.environ.get(variable) for variable in ('LUIGINLP_STATEDIR', 'LUIGINLP_CACHEDIR', 'LUIGINLP_CACHESIZE', 'LUIGINLP_WORKERS', 'LUIGINLP_RUN') }
+        try:
+            luiginlp.run(Voweleater(inputfile='/tmp/test.txt'), statedir='/tmp/luiginlp.state', cachedir='/tmp/luiginlp.state/cache', cachesize=1000000, workers=2)
+            self.assertEqual({ variable: os.environ.get(variable) for variable in environ }, environ)
+        finally:
+            shutil.rmtree('/tmp/luiginlp.state', ignore_errors=True)
+
+    def test1_93(self):
+        """Machine-wide slots are shared by workflows regardless of their state directory, in a fixed per-user location"""
+        from luiginlp.util import Slots
+        with unittest.mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR': '/tmp/luiginlp.runtime'}):
+            try:
+                with unittest.mock.patch.dict(os.environ, {'LUIGINLP_STATEDIR': '/tmp/luiginlp.state1'}):
+                    slots = Slots('test', 1)
+                    lock = slots.acquire()
+                with unittest.mock.patch.dict(os.environ, {'LUIGINLP_STATEDIR': '/tmp/luiginlp.state2'}):
+                    self.assertIsNone(Slots('test', 1).tryacquire())
+                slots.release(lock)
+                self.assertEqual(slots.directory, '/tmp/luiginlp.runtime/luiginlp/slots/test')
+            finally:
+                shutil.rmtree('/tmp/luiginlp.runtime', ignore_errors=True)
+
+    def test1_95(self):
+        """Argument list exceeding the system limit is split over multiple invocations"""
+        argmax = luiginlp.util.ARG_MAX
+        luiginlp.util.ARG_MAX = argmax - luiginlp.util.argvlimit() + 2000 #leaves 2000 bytes for the arguments
+        try:
+            luiginlp.run(TouchDir(inputfile='/tmp/test.txt'))
+        finally:
+            luiginlp.util.ARG_MAX = argmax
+        self.assertEqual(len(glob.glob('/tmp/test.touched.txtdir/*.txt')), 200)
+        shutil.rmtree('/tmp/test.touched.txtdir')
+
+    def test1_97(self):
+        """Metrics are recorded for every task, including the resource usage of the external processes"""
+        shutil.copyfile('/tmp/test.txt', '/tmp/metrics.txt')
+        luiginlp.run(Voweleater(inputfile='/tmp/metrics.txt'), metrics='/tmp/metrics.jsonl')
+        records = list(readjsonlines('/tmp/metrics.jsonl'))
+        os.unlink('/tmp/metrics.jsonl')
+        self.assertEqual(len(records), 1)
+        self.assertEqual((records[0]['component'], records[0]['task'], records[0]['status'], records[0]['processes']), ('Voweleater', 'VoweleaterTask', 'success', 1))
+        self.assertEqual((records[0]['inputsize'], records[0]['outputsize']), (14, 10))
+        self.assertTrue(records[0]['maxrss'] > 0)
+
+    def test1_975(self):
+        """A task whose metrics cannot be written still succeeds"""
+        shutil.copyfile('/tmp/test.txt', '/tmp/metrics2.txt')
+        self.assertTrue(luiginlp.run(Voweleater(inputfile='/tmp/metrics2.txt'), metrics='/proc/metrics.jsonl')) #not writable
+        self.assertTrue(os.path.exists('/tmp/metrics2.novowels.txt'))
+
+    def test1_98(self):
+        """Registry finds the components accepting an input by its extension, directly or through the accept chain"""
+        from luiginlp.engine import getcomponentclass, componentsaccepting, componentsforformat, acceptedinputs, outputformats
+        self.assertIs(getcomponentclass('LowercaseVoweleater'), LowercaseVoweleater)
+        self.assertEqual([ Class.__name__ for Class in componentsaccepting('/tmp/doc.rst') ], ['ConvertToFoLiA', 'Frog', 'Ucto'])
+        self.assertEqual([ Class.__name__ for Class in componentsaccepting('.folia.xml') ], ['FoliaValidator', 'Frog', 'Frog_sharded', 'Ucto', 'Ucto_sharded'])
+        self.assertEqual(componentsaccepting('/tmp/doc.unknown'), [])
+        self.assertIn(BatchVoweleater, componentsforformat('txt'))
+        self.assertEqual([ (accepted.format_id, accepted.extensions, accepted.inputparameter) for accepted in acceptedinputs('TimblClassifier') ], [('train', ('train',), 'trainfile'), ('test', ('test',), 'testfile')])
+        self.assertEqual(outputformats('Frog'), ('folia',))
+        self.assertIsNone(outputformats('LowercaseVoweleater')) #uses setup()
+
+    def test1_99(self):
+        """Input formats match the longest accepted extension and check existence only when consulted, from prefetched directory listings where available"""
+        component = Lowercaser(inputfile='/tmp/prefetch/doc.folia.xml')
+        inputformat = InputFormat(component, format_id='xml', extension=('xml', '.folia.xml', 'txt'))
+        self.assertEqual((inputformat.basename, inputformat.extension), ('/tmp/prefetch/doc', 'folia.xml'))
+        self.assertRaises(FileNotFoundError, lambda: inputformat.valid) #not before it is consulted
+        self.assertFalse(InputFormat(component, format_id='txt', extension='txt').valid)
+        os.mkdir('/tmp/prefetch')
+        try:
+            inputfiles = [ '/tmp/prefetch/doc' + str(i) + '.txt' for i in range(0,20) ]
+            for inputfile in inputfiles:
+                with open(inputfile,'w') as f:
+                    f.write("test")
+            luiginlp.util.prefetchexistence(inputfiles)
+            with unittest.mock.patch('os.path.exists', side_effect=os.path.exists) as exists:
+                self.assertTrue(all( InputFormat(Lowercaser(inputfile=inputfile), format_id='txt', extension='txt').valid for inputfile in inputfiles ))
+                self.assertEqual(exists.call_count, 0)
+                self.assertFalse(luiginlp.util.fileexists('/tmp/prefetch/missing.txt'))
+                self.assertEqual(exists.call_count, 1)
+        finally:
+            luiginlp.util.clearexistence()
+            shutil.rmtree('/tmp/prefetch')
+
+    def test1_100(self):
+        """Adaptive chunks grow from small ones to the size that meets the target wall time, without a straggler at the end, and are handed out again identically when iteration restarts"""
+        items = [ str(i) + '.txt' for i in range(0,1000) ]
+        clock = [0.0]
+        with unittest.mock.patch('time.time', lambda: clock[0]):
+            chunks = []
+            for chunk in luiginlp.util.AdaptiveChunker(items, 'test1_100', target=10.0, workers=2):
+                chunks.append(chunk)
+                clock[0] += 1.0 + 0.01 * len(chunk) #one second of overhead per chunk
+                if len(chunks) == 2:
+                    break #as luigi does when the yielded chunk is not complete yet
+            chunker = luiginlp.util.AdaptiveChunker(items, 'test1_100', target=10.0, workers=2)
+            self.assertEqual(chunker.fit(), None)
+            restarted = []
+            for chunk in chunker:
+                restarted.append(chunk)
+                if len(restarted) > 2: #the others were complete already
+                    clock[0] += 1.0 + 0.01 * len(chunk)
+        self.assertEqual(restarted[:2], chunks)
+        self.assertEqual([ len(chunk) for chunk in restarted ], [4, 16, 64, 256, 660])
+        self.assertEqual(sum(restarted, []), items)
+        self.assertFalse(os.path.exists(chunker.statefile))
+
+    def test1_101(self):
+        """Documents are split into shards at paragraph boundaries (plain text) or top-level structure elements (FoLiA)"""
+        import xml.etree.ElementTree as ElementTree
+        from luiginlp.modules.folia import splitfolia, FOLIANS, XMLID
+        os.mkdir('/tmp/shards')
+        try:
+            with open('/tmp/shards/book.txt','w',encoding='utf-8') as f:
+                for i in range(0,10):
+                    f.write("Paragraph " + str(i) + ", line one.\nLine two.\n\n")
+            parts = luiginlp.util.splitparagraphs('/tmp/shards/book.txt', 60, '/tmp/shards/book-', '.txt')
+            self.assertEqual(parts, [ '/tmp/shards/book-' + str(i) + '.txt' for i in range(1,6) ])
+            contents = []
+            for part in parts:
+                with open(part,'r',encoding='utf-8') as f:
+                    contents.append(f.read())
+                self.assertEqual(contents[-1].count("\n\n"), 2)
+            with open('/tmp/shards/book.txt','r',encoding='utf-8') as f:
+                self.assertEqual("".join(contents), f.read())
+            with open('/tmp/shards/doc.folia.xml','w',encoding='utf-8') as f:
+                f.write('<?xml version="1.0" encoding="utf-8"?>\n<FoLiA xmlns="http://ilk.uvt.nl/folia" xml:id="doc" version="2.0"><metadata type="native"><annotations><token-annotation/></annotations></metadata><text xml:id="doc.text">' + "".join( '<p xml:id="doc.p.' + str(i) + '"><t>Paragraph ' + str(i) + '</t></p>' for i in range(1,5) ) + '</text></FoLiA>')
+            parts = splitfolia('/tmp/shards/doc.folia.xml', 200, '/tmp/shards/doc-')
+            self.assertEqual(len(parts), 2)
+            for i, part in enumerate(parts, 1):
+                root = ElementTree.parse(part).getroot()
+                self.assertEqual(root.get(XMLID), 'doc-' + str(i))
+                self.assertIsNotNone(root.find('{' + FOLIANS + '}metadata/{' + FOLIANS + '}annotations'))
+                self.assertEqual([ p.get(XMLID) for p in root.iter('{' + FOLIANS + '}p') ], ['doc.p.' + str(2*i-1), 'doc.p.' + str(2*i)])
+        finally:
+            shutil.rmtree('/tmp/shards')
+
 
 class Test2(unittest.TestCase):
     def setUp(self):
+        os.environ['LUIGINLP_STATEDIR'] = '/tmp/corpus.luiginlp' #completion markers and progress of the batches
         os.mkdir('/tmp/corpus.txtdir')
         for i in range(0,10):
             with open('/tmp/corpus.txtdir/test' + str(i) + '.txt','w',encoding='utf-8') as f:
                 f.write("THIS IS A TEST")
 
     def tearDown(self):
-        for d in ('/tmp/corpus.txtdir', '/tmp/corpus.lcnv.txtdir'):
+        for d in ('/tmp/corpus.txtdir', '/tmp/corpus.lcnv.txtdir', '/tmp/corpus.novowels.txtdir', '/tmp/corpus.stream.txtdir', '/tmp/corpus.batch.txtdir', '/tmp/corpus.resume.txtdir', '/tmp/corpus.processes.txtdir', '/tmp/corpus.launch.txtdir', '/tmp/corpus.plan.txtdir', '/tmp/corpus.incremental.txtdir', '/tmp/corpus.chunked.txtdir', '/tmp/corpus.luiginlp'):
             if os.path.exists(d):
                 shutil.rmtree(d)
+        del os.environ['LUIGINLP_STATEDIR']
 
     def test2_10(self):
         """Parallelisation on directory input (invokes two chained tasks in single component for each file)"""
@@ -221,6 +512,187 @@ class Test2(unittest.TestCase):
         luiginlp.run(LowercaseVoweleaterDir2(inputfile='/tmp/corpus.txtdir'))
         self.assertTrue(testdircontents('/tmp/corpus.lcnv.txtdir', 'lowercase.novowels.txt', 'ths s  tst'))
 
+    def test2_30(self):
+        """Asynchronous external processes in a bounded process pool"""
+        luiginlp.run(AsyncVoweleaterDir(inputfile='/tmp/corpus.txtdir', threads=3))
+        self.assertTrue(testdircontents('/tmp/corpus.novowels.txtdir', 'txt', 'THS S  TST'))
+
+    def test2_35(self):
+        """Streaming parallelisation on directory input, in windows"""
+        os.mkdir('/tmp/corpus.stream.txtdir')
+        luiginlp.run(ParallelStreamFromDir(directory='/tmp/corpus.txtdir', pattern='*.txt', component='LowercaseVoweleater', passparameters=PassParameters(outputdir='/tmp/corpus.stream.txtdir'), window=3))
+        self.assertEqual(len(glob.glob('/tmp/corpus.stream.txtdir/*.lowercase.novowels.txt')), 10)
+        self.assertTrue(testdircontents('/tmp/corpus.stream.txtdir', 'lowercase.novowels.txt', 'ths s  tst'))
+
+    def test2_355(self):
+        """Patterns with a directory part match as they do with glob, rather than matching nothing"""
+        os.mkdir('/tmp/corpus.txtdir/sub')
+        for i in range(0,3):
+            with open('/tmp/corpus.txtdir/sub/sub' + str(i) + '.txt','w',encoding='utf-8') as f:
+                f.write("THIS IS A TEST")
+        self.assertEqual(sorted(scandir_glob('/tmp/corpus.txtdir', 'sub/*.txt')), [ '/tmp/corpus.txtdir/sub/sub' + str(i) + '.txt' for i in range(0,3) ])
+        os.mkdir('/tmp/corpus.stream.txtdir')
+        luiginlp.run(ParallelFromDir(directory='/tmp/corpus.txtdir', pattern='sub/*.txt', component='LowercaseVoweleater', passparameters=PassParameters(outputdir='/tmp/corpus.stream.txtdir')))
+        self.assertEqual(len(glob.glob('/tmp/corpus.stream.txtdir/*.lowercase.novowels.txt')), 3)
+
+    def test2_36(self):
+        """Incremental processing of a directory: only new and changed files are processed again, outputs of removed files are removed"""
+        os.mkdir('/tmp/corpus.incremental.txtdir')
+        task = ParallelStreamFromDir(directory='/tmp/corpus.txtdir', pattern='*.txt', component='LowercaseVoweleater', passparameters=PassParameters(outputdir='/tmp/corpus.incremental.txtdir'), window=3, incremental=True)
+        luiginlp.run(task)
+        self.assertEqual(len(glob.glob('/tmp/corpus.incremental.txtdir/*.lowercase.novowels.txt')), 10)
+        self.assertTrue(task.complete())
+        unchanged = os.path.getmtime('/tmp/corpus.incremental.txtdir/test2.lowercase.novowels.txt')
+        with open('/tmp/corpus.txtdir/test0.txt','w',encoding='utf-8') as f:
+            f.write("ANOTHER TEST")
+        os.unlink('/tmp/corpus.txtdir/test1.txt')
+        with open('/tmp/corpus.txtdir/test10.txt','w',encoding='utf-8') as f:
+            f.write("THIS IS A TEST")
+        os.utime('/tmp/corpus.txtdir/test3.txt') #touched, but not changed
+        self.assertFalse(task.complete())
+        from luiginlp.planner import plan
+        plan(ParallelFromDir(directory='/tmp/corpus.txtdir', pattern='*.txt', component='LowercaseVoweleater', passparameters=PassParameters(outputdir='/tmp/corpus.incremental.txtdir'), incremental=True))
+        self.assertTrue(os.path.exists('/tmp/corpus.incremental.txtdir/test0.lowercase.novowels.txt')) #resolving dependencies removes nothing
+        luigi.task_register.Register.clear_instance_cache() #the components of the first run would be considered complete (by their audit log)
+        luiginlp.run(task)
+        self.assertTrue(task.complete())
+        self.assertEqual(sorted(os.path.basename(f) for f in glob.glob('/tmp/corpus.incremental.txtdir/*.novowels.txt')), sorted('test' + str(i) + '.lowercase.novowels.txt' for i in range(0,11) if i != 1))
+        self.assertFalse(os.path.exists('/tmp/corpus.incremental.txtdir/test1.lowercase.txt'))
+        with open('/tmp/corpus.incremental.txtdir/test0.lowercase.novowels.txt','r',encoding='utf-8') as f:
+            self.assertEqual(f.read().strip(), "nthr tst")
+        self.assertEqual(os.path.getmtime('/tmp/corpus.incremental.txtdir/test2.lowercase.novowels.txt'), unchanged)
+        #ParallelFromDir shares the manifest, as it runs the same component with the same parameters
+        with open('/tmp/corpus.txtdir/test4.txt','w',encoding='utf-8') as f:
+            f.write("ANOTHER TEST")
+        luigi.task_register.Register.clear_instance_cache()
+        luiginlp.run(ParallelFromDir(directory='/tmp/corpus.txtdir', pattern='*.txt', component='LowercaseVoweleater', passparameters=PassParameters(outputdir='/tmp/corpus.incremental.txtdir'), incremental=True))
+        with open('/tmp/corpus.incremental.txtdir/test4.lowercase.novowels.txt','r',encoding='utf-8') as f:
+            self.assertEqual(f.read().strip(), "nthr tst")
+        self.assertTrue(task.complete())
+        self.assertEqual(os.path.getmtime('/tmp/corpus.incremental.txtdir/test2.lowercase.novowels.txt'), unchanged)
+
+    def test2_365(self):
+        """Adaptive chunks grow with multiple workers too, where luigi runs every resumption of a task in a process of its own"""
+        os.mkdir('/tmp/corpus.chunked.txtdir')
+        for i in range(10,40):
+            with open('/tmp/corpus.txtdir/test' + str(i) + '.txt','w',encoding='utf-8') as f:
+                f.write("THIS IS A TEST")
+        try:
+            self.assertTrue(luiginlp.run(ChunkedLowercaseVoweleaterDir(inputfile='/tmp/corpus.txtdir'), workers=2))
+            with open('/tmp/corpus.chunks.json','r',encoding='utf-8') as f:
+                self.assertEqual(json.load(f), [4, 16, 20]) #the first chunk is 2 x the number of workers, the next may be 4 times as large
+        finally:
+            if os.path.exists('/tmp/corpus.chunks.json'):
+                os.unlink('/tmp/corpus.chunks.json')
+        self.assertEqual(len(glob.glob('/tmp/corpus.chunked.txtdir/*.lowercase.novowels.txt')), 40)
+
+    def test2_37(self):
+        """Batched execution: one invocation of the external tool per batch of files"""
+        os.mkdir('/tmp/corpus.batch.txtdir')
+        BatchVoweleaterTask.invocations = 0
+        inputfiles = sorted(glob.glob('/tmp/corpus.txtdir/*.txt'))
+        with unittest.mock.patch.object(BatchVoweleaterTask, 'on_success', autospec=True) as on_success:
+            luiginlp.run(ParallelBatch(inputfiles=','.join(inputfiles), component='BatchVoweleater', passparameters=PassParameters(outputdir='/tmp/corpus.batch.txtdir'), batchexec=True, batchsize=6))
+        self.assertEqual(BatchVoweleaterTask.invocations, 2)
+        self.assertEqual(on_success.call_count, 10) #the hooks run for every batched task
+        self.assertEqual(len(glob.glob('/tmp/corpus.batch.txtdir/*.novowels.txt')), 10)
+        self.assertTrue(testdircontents('/tmp/corpus.batch.txtdir', 'novowels.txt', 'THS S  TST'))
+
+    def test2_38(self):
+        """Batch with recorded progress resumes with the remaining items, and is recognised as complete afterwards"""
+        os.mkdir('/tmp/corpus.resume.txtdir')
+        inputfiles = sorted(glob.glob('/tmp/corpus.txtdir/*.txt'))
+        batch = ParallelBatch(inputfiles=','.join(inputfiles), component='LowercaseVoweleater', passparameters=PassParameters(outputdir='/tmp/corpus.resume.txtdir'), window=3)
+        os.makedirs(os.path.dirname(batch.progressfile()), exist_ok=True)
+        with open(batch.progressfile(),'w',encoding='utf-8') as f:
+            f.write("\n".join(inputfiles[:4]) + "\n") #as if interrupted after four items
+        luiginlp.run(batch)
+        self.assertEqual(len(glob.glob('/tmp/corpus.resume.txtdir/*.lowercase.novowels.txt')), 6)
+        self.assertFalse(os.path.exists(batch.progressfile()))
+        self.assertTrue(ParallelBatch(inputfiles=','.join(reversed(inputfiles)), component='LowercaseVoweleater', passparameters=PassParameters(outputdir='/tmp/corpus.resume.txtdir')).complete())
+
+    def test2_39(self):
+        """Workflow distributed over multiple worker processes sharing a scheduler"""
+        os.mkdir('/tmp/corpus.processes.txtdir')
+        inputfiles = sorted(glob.glob('/tmp/corpus.txtdir/*.txt'))
+        self.assertTrue(luiginlp.run(ParallelBatch(inputfiles=','.join(inputfiles), component='LowercaseVoweleater', passparameters=PassParameters(outputdir='/tmp/corpus.processes.txtdir')), processes=2, workers=2))
+        self.assertIsNone(luigi.configuration.get_config().get('worker', 'keep_alive', None)) #only kept alive for that run
+        self.assertTrue(testdircontents('/tmp/corpus.processes.txtdir', 'lowercase.novowels.txt', 'ths s  tst'))
+
+    def test2_41(self):
+        """Input files partitioned over workers, each claiming its partition with a lock file, merged when all are done"""
+        from luiginlp.launcher import Launch, LockTaken, partition
+        os.mkdir('/tmp/corpus.launch.txtdir')
+        inputfiles = sorted(glob.glob('/tmp/corpus.txtdir/*.txt'))
+        parts = partition(inputfiles, 3)
+        self.assertEqual(sorted(sum(parts, [])), inputfiles)
+        self.assertEqual(parts, [ sorted(part) for part in partition(list(reversed(inputfiles)), 3) ]) #independent of the order of the input
+        launch = Launch('LowercaseVoweleater', inputfiles, 3, PassParameters(outputdir='/tmp/corpus.launch.txtdir'))
+        with open(launch.lockfile(1),'w') as f:
+            f.write('{"host": "' + socket.gethostname() + '", "pid": ' + str(os.getppid()) + ', "time": 0}') #held by a live worker
+        self.assertRaises(LockTaken, launch.runpartition, 1)
+        os.unlink(launch.lockfile(1))
+        for index in range(0,3):
+            self.assertTrue(launch.runpartition(index))
+            self.assertFalse(os.path.exists(launch.lockfile(index)))
+            self.assertEqual(launch.merge(), index == 2)
+        self.assertTrue(testdircontents('/tmp/corpus.launch.txtdir', 'lowercase.novowels.txt', 'ths s  tst'))
+        self.assertTrue(ParallelBatch(inputfiles=','.join(inputfiles), component='LowercaseVoweleater', passparameters=PassParameters(outputdir='/tmp/corpus.launch.txtdir')).complete())
+
+    def test2_40(self):
+        """Process pool collects exit status and bounds concurrency"""
+        pool = ProcessPool(2)
+        for i in range(0,5):
+            pool.submit('sleep 0.1; exit ' + str(i % 2))
+            self.assertTrue(len(pool) <= 2)
+        pool.wait()
+        self.assertEqual(len(pool.finished), 5)
+        self.assertEqual(len(pool.failures()), 2)
+        self.assertTrue(all( process.rusage is not None for process in pool.finished))
+
+    def test2_45(self):
+        """Scheduler probe does not stall on unreachable schedulers, and only remembers a running scheduler, for a short while"""
+        port = luiginlp.util.freeport()
+        begintime = time.time()
+        self.assertFalse(luiginlp.util.schedulerrunning('localhost', port))
+        self.assertFalse(luiginlp.util.schedulerrunning('192.0.2.1', 8082, timeout=0.2)) #non-routable address
+        self.assertLess(time.time() - begintime, 2)
+        self.assertNotIn(('localhost', port), luiginlp.util.SCHEDULERS)
+        luiginlp.util.SCHEDULERS[('localhost', port)] = time.time() #found running just now
+        self.assertTrue(luiginlp.util.schedulerrunning('localhost', port))
+        luiginlp.util.SCHEDULERS[('localhost', port)] = time.time() - luiginlp.util.SCHEDULERTTL #has stopped since
+        self.assertFalse(luiginlp.util.schedulerrunning('localhost', port))
+        self.assertNotIn(('localhost', port), luiginlp.util.SCHEDULERS)
+
+    def test2_47(self):
+        """Plan of a batch without running it: the tasks it expands into, the outputs that exist, and estimates from earlier metrics"""
+        from luiginlp.planner import plan
+        os.mkdir('/tmp/corpus.plan.txtdir')
+        with open('/tmp/corpus.plan.txtdir/test0.lowercase.txt','w',encoding='utf-8') as f:
+            f.write("this is a test")
+        os.makedirs('/tmp/corpus.luiginlp')
+        for record in ({'task': 'LowercaseTask', 'walltime': 0.5}, {'task': 'LowercaseTask', 'walltime': 1.5}, {'task': 'LowercaseTask', 'walltime': 0.0, 'cached': True}, {'task': 'VoweleaterTask', 'walltime': 2.0}):
+            luiginlp.util.appendjsonline('/tmp/corpus.luiginlp/metrics.jsonl', dict(record, component='LowercaseVoweleater', status='success'))
+        workflowplan = plan(ParallelBatch(inputfiles=','.join(sorted(glob.glob('/tmp/corpus.txtdir/*.txt'))), component='LowercaseVoweleater', passparameters=PassParameters(outputdir='/tmp/corpus.plan.txtdir')), metrics='/tmp/corpus.luiginlp/metrics.jsonl')
+        summary = workflowplan.summary(workers=4)
+        self.assertEqual(summary['families']['LowercaseTask'], {'kind': 'task', 'pending': 9, 'complete': 1})
+        self.assertEqual(summary['families']['InputTask'], {'kind': 'input', 'pending': 0, 'complete': 10})
+        self.assertEqual((summary['pending'], summary['estimated_total'], summary['critical_path'], summary['estimated_runtime']), (19, 29.0, 3.0, 7.25))
+        self.assertEqual(os.listdir('/tmp/corpus.plan.txtdir'), ['test0.lowercase.txt']) #nothing ran
+        self.assertEqual(len(json.loads(workflowplan.json())['edges']), summary['edges'])
+        self.assertIn('n0 -> ', workflowplan.dot())
+
+    def test2_46(self):
+        """Manifest of the components in LuigiNLP's modules is up to date, their modules are imported on demand"""
+        from luiginlp.modules.manifest import COMPONENTMODULES
+        modulesdir = os.path.join(os.path.dirname(os.path.abspath(luiginlp.__file__)), 'modules')
+        self.assertEqual(luiginlp.util.scancomponents(modulesdir, 'luiginlp.modules'), COMPONENTMODULES)
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(luiginlp.__file__))))
+        output = subprocess.check_output([sys.executable, '-c', "import sys; from luiginlp.engine import getcomponentclass; getcomponentclass('TimblCrossValidator'); print(sorted( module for module in sys.modules if module.startswith('luiginlp.modules.') ))"], env=env, cwd='/tmp', stderr=subprocess.DEVNULL)
+        self.assertEqual(output.decode('utf-8').strip(), "['luiginlp.modules.manifest', 'luiginlp.modules.openconvert', 'luiginlp.modules.timbl']")
+        output = subprocess.check_output([sys.executable, '-m', 'luiginlp.luiginlp', 'TimblCrossValidator', '--help'], env=env, cwd='/tmp', stderr=subprocess.DEVNULL) #no --module needed
+        self.assertIn(b'--folds', output)
+
 class Test3(unittest.TestCase):
     def setUp(self):
         os.mkdir('/tmp/corpus.txtdir')
@@ -237,5 +709,339 @@ class Test3(unittest.TestCase):
         """Parallelisation on directory input (invokes two chained components, one task per component, for each file)"""
         luiginlp.run(LowercaseVoweleaterDir2(inputfile='/tmp/corpus.txtdir'), workers=5)
 
+class Test4(unittest.TestCase):
+    """Frog in server mode and sharded, using stand-ins for Frog and foliacat"""
+    def setUp(self):
+        os.mkdir('/tmp/frogtest')
+        with open('/tmp/frogtest/frog','w') as f:
+            f.write("#!/bin/sh\nFAKEFROG_LOADTIME=0 exec " + sys.executable + " " + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakefrog.py') + " \"$@\"\n")
+        os.chmod('/tmp/frogtest/frog', 0o755)
+        with open('/tmp/frogtest/foliacat','w') as f:
+            #foliacat -o out -i id files: concatenates the text bodies
+            f.write("#!" + sys.executable + "\nimport sys, re\nopts = dict(zip(sys.argv[1:5:2], sys.argv[2:5:2]))\nbody = ''.join( re.search(r'<text[^>]*>\\n(.*)</text>', open(filename).read(), re.S).group(1) for filename in sys.argv[5:] )\nopen(opts['-o'],'w').write('<FoLiA xmlns=\"http://ilk.uvt.nl/folia\" xml:id=\"' + opts['-i'] + '\"><text>\\n' + body + '</text></FoLiA>\\n')\n")
+        os.chmod('/tmp/frogtest/foliacat', 0o755)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = '/tmp/frogtest:' + self.path
+        with open('/tmp/frogtest/test.txt','w',encoding='utf-8') as f:
+            f.write("This is a test.\n\nSecond paragraph.")
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree('/tmp/frogtest')
+
+    def test4_10(self):
+        """Frog server mode produces the same output as running frog per document"""
+        from luiginlp.modules.frog import Frog
+        luiginlp.run(Frog(inputfile='/tmp/frogtest/test.txt'))
+        os.rename('/tmp/frogtest/test.frogged.folia.xml','/tmp/frogtest/expected.xml')
+        luiginlp.run(Frog(inputfile='/tmp/frogtest/test.txt',server=True))
+        with open('/tmp/frogtest/expected.xml','r',encoding='utf-8') as f:
+            self.assertTrue(testfilecontents('/tmp/frogtest/test.frogged.folia.xml', f.read()))
+
+    def test4_15(self):
+        """Runs only stop the servers they started or used last, and only when they are not in use; servers registered by other hosts are never signalled"""
+        from luiginlp.util import ServerPool, shutdownservers, portopen, isrunning
+        with unittest.mock.patch.dict(os.environ, {'LUIGINLP_STATEDIR': '/tmp/frogtest/state', 'LUIGINLP_RUN': 'other'}):
+            pool = ServerPool('frog', ['frog', '-S', '{port}'])
+            slot = pool.acquire()
+            port = slot.__enter__() #in use by the other run
+            shutdownservers(run='this')
+            self.assertTrue(portopen(port))
+            shutdownservers(run='other')
+            self.assertTrue(portopen(port))
+            slot.__exit__(None, None, None)
+            sleeper = subprocess.Popen(['sleep','30'], start_new_session=True)
+            os.makedirs('/tmp/frogtest/state/servers/' + socket.gethostname() + '/frog-elsewhere')
+            with open('/tmp/frogtest/state/servers/' + socket.gethostname() + '/frog-elsewhere/0.json','w') as f:
+                json.dump({'host': 'elsewhere', 'run': 'other', 'pid': sleeper.pid, 'port': 1, 'command': ['frog']}, f)
+            shutdownservers(run='other')
+            for _ in range(50):
+                if not portopen(port): break
+                time.sleep(0.1)
+            self.assertFalse(portopen(port))
+            self.assertTrue(isrunning(sleeper.pid))
+            sleeper.kill()
+            sleeper.wait()
+
+    def test4_16(self):
+        """A registered server whose pid now belongs to another process is not signalled, the stale registration is replaced"""
+        from luiginlp.util import ServerPool, shutdownservers, isrunning
+        with unittest.mock.patch.dict(os.environ, {'LUIGINLP_STATEDIR': '/tmp/frogtest/state', 'LUIGINLP_RUN': 'this'}):
+            pool = ServerPool('frog', ['frog', '-S', '{port}'])
+            sleeper = subprocess.Popen(['sleep','30'], start_new_session=True) #the process that got the pid
+            with open(os.path.join(pool.directory, '0.json'),'w') as f:
+                json.dump({'host': socket.gethostname(), 'run': 'this', 'pid': sleeper.pid, 'port': 1, 'command': ['frog', '-S', '1']}, f)
+            with pool.acquire() as port:
+                self.assertNotEqual(port, 1)
+            self.assertTrue(isrunning(sleeper.pid))
+            shutdownservers(run='this') #stops the server that replaced it
+            with open(os.path.join(pool.directory, '0.json'),'w') as f:
+                json.dump({'host': socket.gethostname(), 'run': 'this', 'pid': sleeper.pid, 'port': 1, 'command': ['frog', '-S', '1']}, f)
+            shutdownservers(run='this')
+            self.assertTrue(isrunning(sleeper.pid))
+            self.assertFalse(os.path.exists(os.path.join(pool.directory, '0.json')))
+            sleeper.kill()
+            sleeper.wait()
+
+    def test4_17(self):
+        """Frog in server mode across partitions launched as local processes, sharing one server: no partition stops it whilst another is using it"""
+        for i in range(0,8):
+            with open('/tmp/frogtest/doc' + str(i) + '.txt','w',encoding='utf-8') as f:
+                f.write("Document " + str(i) + ".")
+        inputfiles = ','.join( '/tmp/frogtest/doc' + str(i) + '.txt' for i in range(0,8) )
+        environ = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        with socket.socket() as sock: #a port without a scheduler, the partitions fall back to a local scheduler each
+            sock.bind(('localhost',0))
+            port = sock.getsockname()[1]
+        process = subprocess.run([sys.executable, '-m', 'luiginlp.launcher', '--module', 'luiginlp.modules.frog', '--component', 'Frog', '--inputfiles', inputfiles, '--passparameters', '{"server": true, "servers": 1}', '--partitions', '2', '--local', '--statedir', '/tmp/frogtest/state', '--scheduler-host', 'localhost', '--scheduler-port', str(port)], env=environ, cwd='/tmp/frogtest', stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=300)
+        self.assertEqual(process.returncode, 0, process.stderr.decode('utf-8')[-2000:])
+        self.assertEqual(len(glob.glob('/tmp/frogtest/doc*.frogged.folia.xml')), 8)
+        self.assertEqual(glob.glob('/tmp/frogtest/state/servers/*/frog-*/*.json'), []) #stopped by the partition that used it last
+
+    def test4_20(self):
+        """Sharded Frog splits a document, frogs the shards in parallel and merges them in order, with IDs under the document's ID"""
+        import xml.etree.ElementTree as ElementTree
+        from luiginlp.modules.frog import Frog_sharded
+        from luiginlp.modules.folia import FOLIANS, XMLID
+        with open('/tmp/frogtest/book.txt','w',encoding='utf-8') as f:
+            f.write("\n\n".join( "Paragraph " + str(i) + " of the book." for i in range(1,7) ) + "\n")
+        self.assertTrue(luiginlp.run(Frog_sharded(inputfile='/tmp/frogtest/book.txt', shardsize=50), workers=2))
+        self.assertEqual(len(glob.glob('/tmp/frogtest/book.frogged.foliadir/*.folia.xml')), 3)
+        root = ElementTree.parse('/tmp/frogtest/book.frogged.folia.xml').getroot()
+        self.assertEqual(root.get(XMLID), 'book')
+        self.assertEqual([ p.get(XMLID) for p in root.iter('{' + FOLIANS + '}p') ], [ 'book.shard' + str(i // 2 + 1) + '.p.' + str(i % 2 + 1) for i in range(0,6) ])
+        self.assertEqual([ w.find('{' + FOLIANS + '}t').text for w in root.iter('{' + FOLIANS + '}w') ][-5:], ['Paragraph', '6', 'of', 'the', 'book.'])
+
+class Test5(unittest.TestCase):
+    """Page-parallel and pipelined OCR, using stand-ins for Tesseract, pdfimages, FoLiA-hocr and foliacat"""
+    def setUp(self):
+        os.makedirs('/tmp/ocrtest/doc.tiffdir')
+        tools = {
+            'tesseract': "FAKETESSERACT_SPEED=${FAKETESSERACT_SPEED:-100000000} exec " + sys.executable + " " + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'faketesseract.py') + " \"$@\"",
+            #pdfimages -tiff -p pdf prefix: writes 10 pages, logs the number of page images on disk after each
+            'pdfimages': "for i in 01 02 03 04 05 06 07 08 09 10; do head -c 20000 /dev/zero > \"$4-0$i-000.tif\"; ls \"$(dirname $4)\" | grep -c tif >> /tmp/ocrtest/ondisk; sleep 0.05; done",
+            #FoLiA-hocr -O dir file.hocr
+            'FoLiA-hocr': "cp \"$3\" \"$2/$(basename $3 .hocr).folia.xml\"",
+            #foliacat -i id -o out files
+            'foliacat': "shift 4; cat \"$@\" > /tmp/ocrtest/doc.folia.xml",
+        }
+        for tool, script in tools.items():
+            with open('/tmp/ocrtest/' + tool,'w') as f:
+                f.write("#!/bin/sh\n" + script + "\n")
+            os.chmod('/tmp/ocrtest/' + tool, 0o755)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = '/tmp/ocrtest:' + self.path
+        for i in range(0,5):
+            with open('/tmp/ocrtest/doc.tiffdir/page' + str(i) + '.tif','wb') as f:
+                f.write(b'\0' * 1000 * (i+1))
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree('/tmp/ocrtest')
+
+    def test5_10(self):
+        """Page-parallel OCR runs all pages through a process pool, with OpenMP threads limited"""
+        from luiginlp.modules.ocr import OCR_document
+        luiginlp.run(OCR_document(inputfile='/tmp/ocrtest/doc.tiffdir', language='eng', pageparallel=True, threads=2))
+        self.assertEqual(len(glob.glob('/tmp/ocrtest/doc.hocrdir/*.hocr')), 5)
+        with open('/tmp/ocrtest/doc.hocrdir/page0.hocr','r',encoding='utf-8') as f:
+            self.assertTrue('content="' + str(max(1, luiginlp.util.cpucount() // 2)) + '"' in f.read())
+
+    def test5_20(self):
+        """Pipelined OCR of a PDF document, with a bounded number of page images on disk"""
+        from luiginlp.modules.ocr import OCR_folia
+        with open('/tmp/ocrtest/doc.pdf','w') as f:
+            f.write('%PDF')
+        os.environ['FAKETESSERACT_SPEED'] = '100000' #OCR is slower than extraction, so extraction has to be paused
+        try:
+            luiginlp.run(OCR_folia(inputfile='/tmp/ocrtest/doc.pdf', language='eng', pipelined=True, threads=1, queuesize=2))
+        finally:
+            del os.environ['FAKETESSERACT_SPEED']
+        self.assertEqual(len(glob.glob('/tmp/ocrtest/doc.hocrdir/*.hocr')), 10)
+        self.assertEqual(len(glob.glob('/tmp/ocrtest/doc.foliadir/*.folia.xml')), 10)
+        self.assertTrue(os.path.exists('/tmp/ocrtest/doc.folia.xml'))
+        self.assertFalse(glob.glob('/tmp/ocrtest/doc.tiffdir*/doc-*.tif')) #page images are deleted once consumed
+        with open('/tmp/ocrtest/ondisk','r') as f:
+            self.assertLessEqual(max( int(line) for line in f ), 2 + 2)
+
+class Test6(unittest.TestCase):
+    """Sharded and cross-validated Timbl, using a stand-in for Timbl"""
+    def setUp(self):
+        os.makedirs('/tmp/timbltest')
+        with open('/tmp/timbltest/timbl','w') as f:
+            f.write("#!/bin/sh\necho \"$@\" >> /tmp/timbltest/invocations\nexec " + sys.executable + " " + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'faketimbl.py') + " \"$@\"\n")
+        os.chmod('/tmp/timbltest/timbl', 0o755)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = '/tmp/timbltest:' + self.path
+        os.environ['LUIGINLP_MODELDIR'] = '/tmp/timbltest/models'
+        with open('/tmp/timbltest/data.train','w') as f:
+            for i in range(0,100):
+                f.write(str(i % 3) + ' ' + str(i % 5) + ' ' + str(i % 7) + ' ' + ('A' if i % 3 == 0 else 'B') + '\n')
+        for name in ('single','sharded','server'):
+            with open('/tmp/timbltest/' + name + '.test','w') as f:
+                for i in range(0,50):
+                    f.write(str(i % 3) + ' ' + str(i % 4) + ' ' + str(i % 6) + ' ' + ('A' if i % 2 == 0 else 'B') + '\n')
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        del os.environ['LUIGINLP_MODELDIR']
+        shutil.rmtree('/tmp/timbltest')
+
+    def invocations(self, option):
+        with open('/tmp/timbltest/invocations','r') as f:
+            return len([ line for line in f if option in line.split() ])
+
+    def test6_10(self):
+        """Sharded testing yields the same output as testing at once, the accuracy is merged"""
+        from luiginlp.modules.timbl import TimblClassifier, TimblShardedClassifier
+        luiginlp.run(TimblClassifier(trainfile='/tmp/timbltest/data.train', testfile='/tmp/timbltest/single.test'))
+        luiginlp.run(TimblShardedClassifier(trainfile='/tmp/timbltest/data.train', testfile='/tmp/timbltest/sharded.test', shards=4))
+        with open('/tmp/timbltest/single.timbl.out','r') as f1, open('/tmp/timbltest/sharded.timbl.out','r') as f2:
+            self.assertEqual(f1.read(), f2.read())
+        with open('/tmp/timbltest/single.timbl.test.log','r') as f:
+            accuracy = [ line for line in f if line.startswith('overall accuracy') ][0].split('(')[1].split(')')[0]
+        with open('/tmp/timbltest/sharded.timbl.test.log','r') as f:
+            lines = f.readlines()
+        self.assertEqual(len([ line for line in lines if line.startswith('=== shard') ]), 4)
+        self.assertEqual(lines[-1].split('(')[1].split(')')[0], accuracy)
+
+    def test6_20(self):
+        """k-fold cross-validation classifies every training instance once"""
+        from luiginlp.modules.timbl import TimblCrossValidator
+        luiginlp.run(TimblCrossValidator(inputfile='/tmp/timbltest/data.train', folds=5))
+        with open('/tmp/timbltest/data.timbl.cv.out','r') as f:
+            self.assertEqual(len(f.readlines()), 100)
+        with open('/tmp/timbltest/data.timbl.cv.log','r') as f:
+            self.assertTrue(f.readlines()[-1].startswith('overall accuracy:'))
+        self.assertFalse(glob.glob('/tmp/timbltest/data.timbl.cv.out.*')) #work directory removed
+
+    def test6_30(self):
+        """A model is trained only once for the same training data and parameters, also for other output locations"""
+        from luiginlp.modules.timbl import TimblClassifier
+        for name in ('single','sharded'):
+            os.mkdir('/tmp/timbltest/' + name)
+            luiginlp.run(TimblClassifier(trainfile='/tmp/timbltest/data.train', testfile='/tmp/timbltest/' + name + '.test', outputdir='/tmp/timbltest/' + name))
+            self.assertTrue(os.path.exists('/tmp/timbltest/' + name + '/data.ibase'))
+        self.assertEqual(self.invocations('-I'), 1)
+        luiginlp.run(TimblClassifier(trainfile='/tmp/timbltest/data.train', testfile='/tmp/timbltest/server.test', k=3))
+        self.assertEqual(self.invocations('-I'), 2) #other parameters, other model
+
+    def test6_40(self):
+        """Classification on Timbl servers yields the same output as timbl does, the servers are shared by all tasks using the same model"""
+        from luiginlp.modules.timbl import TimblClassifier, TimblShardedClassifier
+        for name in ('single','sharded','server'):
+            os.mkdir('/tmp/timbltest/' + name)
+        luiginlp.run(TimblClassifier(trainfile='/tmp/timbltest/data.train', testfile='/tmp/timbltest/single.test', outputdir='/tmp/timbltest/single', k=3))
+        luiginlp.run(
+            TimblShardedClassifier(trainfile='/tmp/timbltest/data.train', testfile='/tmp/timbltest/sharded.test', outputdir='/tmp/timbltest/sharded', k=3, shards=4, server=True, servers=2),
+            TimblClassifier(trainfile='/tmp/timbltest/data.train', testfile='/tmp/timbltest/server.test', outputdir='/tmp/timbltest/server', k=3, server=True, servers=2))
+        with open('/tmp/timbltest/single/single.timbl.out','r') as f:
+            expected = f.read()
+        for name in ('sharded','server'):
+            with open('/tmp/timbltest/' + name + '/' + name + '.timbl.out','r') as f:
+                self.assertEqual(f.read(), expected)
+        self.assertLessEqual(self.invocations('-S'), 2)
+
+    def test6_50(self):
+        """Classification on Timbl servers keeps the separator of the data format (C4.5: commas)"""
+        from luiginlp.modules.timbl import TimblClassifier
+        for name in ('c45','c45server'):
+            os.mkdir('/tmp/timbltest/' + name)
+            with open('/tmp/timbltest/' + name + '.train','w') as f:
+                for i in range(0,100):
+                    f.write(str(i % 3) + ',' + str(i % 5) + ',' + ('A' if i % 3 == 0 else 'B') + '\n')
+            with open('/tmp/timbltest/' + name + '.test','w') as f:
+                for i in range(0,20):
+                    f.write(str(i % 3) + ',' + str(i % 4) + ',' + ('A' if i % 2 == 0 else 'B') + '\n')
+        luiginlp.run(TimblClassifier(trainfile='/tmp/timbltest/c45.train', testfile='/tmp/timbltest/c45.test', outputdir='/tmp/timbltest/c45', format='C4.5'))
+        luiginlp.run(TimblClassifier(trainfile='/tmp/timbltest/c45server.train', testfile='/tmp/timbltest/c45server.test', outputdir='/tmp/timbltest/c45server', format='C4.5', server=True))
+        with open('/tmp/timbltest/c45/c45.timbl.out','r') as f:
+            expected = f.read()
+        with open('/tmp/timbltest/c45server/c45server.timbl.out','r') as f:
+            self.assertEqual(f.read(), expected)
+        self.assertEqual(expected.split('\n')[0], '0,0,A,A')
+        with open('/tmp/timbltest/c45server/c45server.timbl.test.log','r') as f:
+            self.assertEqual(f.readlines()[-1].split('(')[1].split(')')[0], str(sum( 1 for line in expected.splitlines() if line.split(',')[-2] == line.split(',')[-1] )) + '/20')
+    def test6_60(self):
+        """Timbl servers are shared by the tasks with the same model and options, whatever order or options the command line has"""
+        from luiginlp.modules.timbl import timblserverpool
+        def task(**options):
+            parameters = dict(weighting='gr', algorithm='IB1', k=1, metric='O', distance='Z', format='Columns')
+            parameters.update(options)
+            return unittest.mock.Mock(executable='timbl', servers=1, in_ibase=lambda: unittest.mock.Mock(path='/tmp/timbltest/data.train'), in_wgt=lambda: unittest.mock.Mock(path='/tmp/timbltest/single.test'), getargs=lambda **kwargs: [ str(value) for value in kwargs.values() if value is not None ], **parameters)
+        with unittest.mock.patch.dict(os.environ, {'LUIGINLP_STATEDIR': '/tmp/timbltest/state'}):
+            self.assertEqual(timblserverpool(task()).directory, timblserverpool(task()).directory)
+            for options in ({'k': 3}, {'distance': None}, {'format': 'C4.5'}, {'weighting': 'ig'}):
+                self.assertNotEqual(timblserverpool(task()).directory, timblserverpool(task(**options)).directory)
+
+class Test7(unittest.TestCase):
+    """Bulk FoLiA validation, using stand-ins for foliavalidator and the FoLiA library"""
+    def setUp(self):
+        os.makedirs('/tmp/validatortest/docs.foliadir/sub')
+        with open('/tmp/validatortest/foliavalidator','w') as f:
+            f.write("#!/bin/sh\necho \"$1\" >> /tmp/validatortest/invocations\nif grep -q INVALID \"$1\"; then echo \"ERROR: invalid document\" >&2; exit 1; fi\necho \"Validated successfully: $1\" >&2\n")
+        os.chmod('/tmp/validatortest/foliavalidator', 0o755)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = '/tmp/validatortest:' + self.path
+        for name, content in (('a','VALID'), ('b','INVALID'), ('sub/c','VALID')):
+            with open('/tmp/validatortest/docs.foliadir/' + name + '.folia.xml','w') as f:
+                f.write(content)
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree('/tmp/validatortest')
+
+    def summary(self, directory):
+        with open(directory + '/docs.folia-validation-summary.txt','r') as f:
+            return sorted(f.read().splitlines())
+
+    def test7_10(self):
+        """Without the FoLiA library, documents are validated by a pool of foliavalidator processes, documents with a report are not validated again"""
+        from luiginlp.modules.folia import FoliaValidator
+        self.assertTrue(luiginlp.run(FoliaValidator(inputfile='/tmp/validatortest/docs.foliadir', threads=2)))
+        self.assertEqual(self.summary('/tmp/validatortest'), [ '/tmp/validatortest/docs.foliadir/' + name + '.folia-validation-report.txt: ' + status for name, status in (('a','OK'), ('b','ERROR'), ('sub/c','OK')) ])
+        os.unlink('/tmp/validatortest/docs.folia-validation-summary.txt')
+        luiginlp.run(FoliaValidator(inputfile='/tmp/validatortest/docs.foliadir', threads=1)) #other parameters, as luigi caches task instances
+        self.assertEqual(len(self.summary('/tmp/validatortest')), 3)
+        with open('/tmp/validatortest/invocations','r') as f:
+            self.assertEqual(len(f.readlines()), 3)
+        self.assertFalse(os.path.exists('/tmp/validatortest/docs.foliadir/a.folia-validation-report.txt.tmp'))
+
+    def test7_20(self):
+        """With the FoLiA library, documents are validated in a pool of processes without invoking foliavalidator, in foliavalidator's stages; reports mirror the directory structure in the output directory and a partial report of an interrupted validation is not used"""
+        from luiginlp.modules.folia import FoliaValidator
+        def validate(file, schema):
+            with open(file,'r') as f:
+                if 'INVALID' in f.read():
+                    raise ValueError("invalid document")
+        def Document(file, **kwargs):
+            self.assertEqual((kwargs['deepvalidation'], kwargs['textvalidation'], kwargs['checkreferences']), (False, False, True))
+            return unittest.mock.Mock(version='2.5.3', textvalidationerrors=0)
+        os.makedirs('/tmp/validatortest/out')
+        with open('/tmp/validatortest/out/a.folia-validation-report.txt.tmp','w') as f:
+            f.write("partial report of an interrupted validation")
+        with unittest.mock.patch('luiginlp.modules.folia.foliapy', unittest.mock.Mock(validate=validate, Document=Document, checkversion=lambda version: 0, ElementTree=unittest.mock.Mock(RelaxNG=lambda schema: unittest.mock.Mock(error_log=[])))):
+            self.assertTrue(luiginlp.run(FoliaValidator(inputfile='/tmp/validatortest/docs.foliadir', outputdir='/tmp/validatortest/out', threads=2)))
+        self.assertEqual(self.summary('/tmp/validatortest/out'), [ '/tmp/validatortest/out/' + name + '.folia-validation-report.txt: ' + status for name, status in (('a','OK'), ('b','ERROR'), ('sub/c','OK')) ])
+        self.assertFalse(os.path.exists('/tmp/validatortest/invocations'))
+        self.assertFalse(os.path.exists('/tmp/validatortest/out/a.folia-validation-report.txt.tmp'))
+        with open('/tmp/validatortest/out/b.folia-validation-report.txt','r') as f:
+            self.assertIn("VALIDATION ERROR against RelaxNG schema (stage 1/3)", f.read())
+
+    def test7_30(self):
+        """Incremental validation: changed documents are validated again, reports of removed documents are removed"""
+        from luiginlp.modules.folia import FoliaValidator
+        with unittest.mock.patch.dict(os.environ, {'LUIGINLP_STATEDIR': '/tmp/validatortest/state'}):
+            self.assertTrue(luiginlp.run(FoliaValidator(inputfile='/tmp/validatortest/docs.foliadir', incremental=True)))
+            with open('/tmp/validatortest/docs.foliadir/b.folia.xml','w') as f:
+                f.write("VALID NOW")
+            os.unlink('/tmp/validatortest/docs.foliadir/sub/c.folia.xml')
+            luigi.task_register.Register.clear_instance_cache()
+            self.assertTrue(luiginlp.run(FoliaValidator(inputfile='/tmp/validatortest/docs.foliadir', incremental=True)))
+        self.assertEqual(self.summary('/tmp/validatortest'), [ '/tmp/validatortest/docs.foliadir/' + name + '.folia-validation-report.txt: OK' for name in ('a','b') ])
+        self.assertFalse(os.path.exists('/tmp/validatortest/docs.foliadir/sub/c.folia-validation-report.txt'))
+        with open('/tmp/validatortest/invocations','r') as f:
+            self.assertEqual(len(f.readlines()), 4)
+
 if __name__ == '__main__':
     unittest.main()